@@ -1,219 +1,275 @@
 # app.py
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, Response, render_template, request, jsonify, g, send_file, session
 import os
 import re
+import gzip
+import io
 import tempfile
 import json
 import uuid
+import zipfile
+import hashlib
+import pickle
+import threading
+import time
+import shutil
+import sqlite3
+import cProfile
+import gc
+import logging
+import math
+import atexit
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.utils import secure_filename as werkzeug_secure_filename
-from docx import Document
+from checkdoc import (KeywordMatcher, DocxTextExtractor, SQLiteRegionsStore, file_sha256, group_occurrences,
+                      keywords_fingerprint, check_file_in_pool, paragraph_matches, diff_occurrences,
+                      annotate_docx, quick_scan, MODE_ALL, MODE_EXISTS, MODE_COUNTS, QUERY_MODES, DEFAULT_FIRST_N)
+from divisions import load_divisions
+from metrics import Registry, Trace, BYTES_BUCKETS, COUNT_BUCKETS, process_memory
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只提供 gzip 压缩
+    brotli = None
 
 # --- 配置 ---
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'docx'}  # 为简化，暂时只支持 docx。doc 支持需要额外库且复杂。
 MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 增加到 100MB max file size
-REGIONS_FILE = 'china_regions.json'
+REGIONS_FILE = 'china_regions.json'  # 地域数据库第一次创建时从该文件导入，也是导入导出使用的格式
+REGIONS_DB = 'regions.db'  # 地域名称数据库（SQLite）
+DIVISIONS_FILE = 'china_divisions.json'  # 全国行政区划数据，与地域名称数据库一起用于地域检查；设为 None 则只使用数据库中的名称
+DEFAULT_REGION_LEVEL = '区级'  # 不指定级别添加的地域名称归入该级别
+REGIONS_ADMIN_PASSWORD = '123456'  # 删除和批量导入地域名称时需要的密码
+DOCUMENT_CACHE_MAX_CHARS = 50 * 1000 * 1000  # 文档模型缓存上限（按段落字符数计）
+RESULT_CACHE_MAX_OCCURRENCES = 500 * 1000  # 匹配结果缓存上限（按匹配项数计）
+CACHE_DIR = None  # 设置为目录路径即可启用磁盘缓存层，例如 'cache'
+CACHE_DISK_MAX_ENTRIES = 1000  # 每个缓存在磁盘上保留的最多条目数
+JOB_WORKERS = 2  # 异步任务的工作线程数
+JOB_QUEUE_LIMIT = 20  # 同时排队和执行中的异步任务上限
+JOB_RETENTION_SECONDS = 3600  # 已完成任务的结果保留时间
+BATCH_MAX_FILES = 200  # 单次批量检查的最多文件数
+BATCH_MAX_UNCOMPRESSED_SIZE = 5 * MAX_CONTENT_LENGTH  # zip 包解压后的总大小上限
+BATCH_WORKERS = os.cpu_count() or 1  # 批量检查进程池的进程数（每个 Web 工作进程一个进程池）
+UPLOAD_SPOOL_MAX_MEMORY = 16 * 1024 * 1024  # 上传文件在内存中缓冲的上限，超过后才写入磁盘临时文件
+GROUPED_PAGE_SIZE = 200  # 分组响应每页返回的上下文片段数
+GROUPED_MAX_PAGE_SIZE = 2000  # 客户端可请求的每页片段数上限
+GROUPED_VIEW_CACHE_MAX_SNIPPETS = 500 * 1000  # 供游标翻页的分组结果缓存上限（按片段数计）
+RESPONSE_COMPRESSION_MIN_SIZE = 1024  # 超过该字节数的 JSON 响应才压缩
+RESPONSE_COMPRESSION_LEVEL = 5  # gzip（1-9）和 brotli（0-11）共用的压缩级别
+SLOW_REQUEST_SECONDS = 5  # 超过该耗时的请求会把各阶段耗时写入日志
+PROFILE_DIR = None  # 设置为目录路径后，带 X-Profile 请求头的请求会用 cProfile 分析，例如 'profiles'
+PROFILE_MIN_SECONDS = 1.0  # 只保存耗时超过该值的请求的分析结果
+DOCUMENT_HISTORY_MAX_ENTRIES = 2 * 1000 * 1000  # 增量检查保存的各文档上一版本上限（按段落数加匹配项数计）
+DOCUMENT_ID_MAX_LENGTH = 200  # 客户端指定的文档标识的最大长度
+QUICK_FIRST_N_MAX = 1000  # first_n 模式单次最多返回的匹配项数
+ADMISSION_MAX_COST = 2 * MAX_CONTENT_LENGTH  # 每个工作进程同时处理的上传请求的代价之和上限（按字节计，见 upload_cost）
+ADMISSION_KEYWORD_COST = 1024  # 每个关键词折合的代价（字节）
+ADMISSION_QUEUE_LIMIT = 8  # 超过代价上限时最多排队等待的上传请求数，再多直接返回 503
+ADMISSION_QUEUE_TIMEOUT = 60  # 上传请求排队等待的最长秒数，超时返回 503
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
 
 app = Flask(__name__)
 app.secret_key = 'your_strong_secret_key_here'  # 更换为强密钥用于生产环境
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+app.config['UPLOAD_SPOOL_MAX_MEMORY'] = UPLOAD_SPOOL_MAX_MEMORY
 
 # 确保上传文件夹存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
 def load_regions():
-    """从 JSON 文件加载地域名称"""
-    if os.path.exists(REGIONS_FILE):
-        try:
-            with open(REGIONS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # 如果是列表格式，直接返回
-                if isinstance(data, list):
-                    return data
-                # 如果是字典格式，提取所有地域名称
-                elif isinstance(data, dict):
-                    regions = []
-                    # 遍历所有省份
-                    for province, cities in data.items():
-                        regions.append(province)
-                        # 如果城市是字典形式（包含区县），提取所有城市和区县
-                        if isinstance(cities, dict):
-                            for city, districts in cities.items():
-                                regions.append(city)
-                                if isinstance(districts, list):
-                                    regions.extend(districts)
-                        # 如果城市是列表形式（直接列出城市），添加所有城市
-                        elif isinstance(cities, list):
-                            regions.extend(cities)
-                    return regions
-                else:
-                    app.logger.error(f"JSON file {REGIONS_FILE} format is invalid.")
-                    return []
-        except (json.JSONDecodeError, IOError) as e:
-            app.logger.error(f"Error reading {REGIONS_FILE}: {e}")
-            return []
-    return []
+    """获取展开后的地域名称列表"""
+    # 返回副本，调用方可以自由修改
+    return list(regions_store.get().names)
 
 
-def save_regions(regions_data):
-    """将地域名称保存到 JSON 文件"""
-    try:
-        # 如果传入的是列表，则转换为字典格式
-        if isinstance(regions_data, list):
-            # 尝试从现有文件加载结构化数据
-            structured_data = {}
-            if os.path.exists(REGIONS_FILE):
+class LRUCache:
+    """
+    线程安全的 LRU 缓存，按 sizeof 计算的总大小限制容量。
+    设置 disk_dir 时启用磁盘缓存层：内存未命中时从磁盘读取，磁盘上按最近使用时间保留 disk_max_entries 个条目。
+    """
+
+    def __init__(self, name, max_size, sizeof=None, disk_dir=None, disk_max_entries=CACHE_DISK_MAX_ENTRIES):
+        self.name = name
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.disk_dir = os.path.join(disk_dir, name) if disk_dir else None
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.pkl")
+
+    def get(self, key):
+        """返回缓存值，未命中时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        value = self._read_disk(key) if self.disk_dir else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        if self.disk_dir:
+            self._write_disk(key, value)
+
+    def _store(self, key, value):
+        """写入内存层并按 LRU 淘汰，调用方需持有锁"""
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old[1]
+        self._entries[key] = (value, size)
+        self._size += size
+        while self._size > self.max_size:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+            self.evictions += 1
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, value = pickle.load(f)
+            os.utime(path)  # 更新访问时间，用于磁盘层的 LRU 淘汰
+        except (OSError, pickle.PickleError, EOFError, ValueError):
+            return None
+        return value if stored_key == key else None
+
+    def _write_disk(self, key, value):
+        path = self._disk_path(key)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            app.logger.error(f"Error writing cache file {path}: {e}")
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def _evict_disk(self):
+        entries = [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith('.pkl')]
+        if len(entries) <= self.disk_max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.disk_max_entries]:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def invalidate(self, predicate):
+        """删除所有键满足 predicate 的条目（包括磁盘层）"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                _, size = self._entries.pop(key)
+                self._size -= size
+        if self.disk_dir:
+            for entry in os.scandir(self.disk_dir):
+                if not entry.name.endswith('.pkl'):
+                    continue
                 try:
-                    with open(REGIONS_FILE, 'r', encoding='utf-8') as f:
-                        existing_data = json.load(f)
-                        if isinstance(existing_data, dict):
-                            structured_data = existing_data
-                except:
+                    with open(entry.path, 'rb') as f:
+                        stored_key, _ = pickle.load(f)
+                    if predicate(stored_key):
+                        os.unlink(entry.path)
+                except (OSError, pickle.PickleError, EOFError, ValueError):
                     pass
-            
-            # 如果没有现有结构化数据，则使用默认结构
-            if not structured_data:
-                structured_data = {
-                    "省级": [],
-                    "市级": [],
-                    "区级": []
-                }
-                
-                # 简单分类，实际应用中可能需要更复杂的逻辑
-                for region in regions_data:
-                    if region not in structured_data["省级"] and region not in structured_data["市级"] and region not in structured_data["区级"]:
-                        # 这里只是一个简单的示例，实际应用中可能需要更好的分类方法
-                        structured_data["区级"].append(region)
-            
-            regions_data = structured_data
-        # 如果传入的是字典格式，直接使用
-        elif isinstance(regions_data, dict):
-            # 确保所有必要的键都存在
-            required_keys = ["省级", "市级", "区级"]
-            for key in required_keys:
-                if key not in regions_data:
-                    regions_data[key] = []
-        
-        # 在保存前清理可能存在的无效条目
-        for level in ["省级", "市级", "区级"]:
-            if level in regions_data:
-                # 过滤掉空字符串和仅包含问号的条目
-                regions_data[level] = [region for region in regions_data[level] 
-                                      if region and not region.isspace() and region != "???" and region != "？？？"]
-        
-        # 确保使用UTF-8编码并处理可能的编码问题
-        with open(REGIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(regions_data, f, ensure_ascii=False, indent=4)
-        return True
-    except IOError as e:
-        app.logger.error(f"Error saving to {REGIONS_FILE}: {e}")
-        return False
-    except Exception as e:
-        app.logger.error(f"Unexpected error saving to {REGIONS_FILE}: {e}")
-        return False
 
-
-class DocxTextExtractor:
-    """专门用于提取 docx 文本和页码信息的类"""
-
-    def __init__(self, docx_path):
-        self.doc = Document(docx_path)
-        self.page_breaks = self._find_page_breaks()
-        self.full_text = self._extract_full_text()
-
-    def _find_page_breaks(self):
-        """估算段落在文档中的页码位置"""
-        page_breaks = []
-        current_page = 1
-        current_line_count = 0
-        lines_per_page_estimate = 40  # 这是一个估算值，可根据需要调整
-
-        for i, paragraph in enumerate(self.doc.paragraphs):
-            text = paragraph.text
-            if text.strip():  # 忽略空段落
-                # 估算段落行数
-                lines_in_para = len(text) // 80 + text.count('\n') + 1  # 简单估算
-                current_line_count += lines_in_para
-
-                # 检查段落中是否有分页符
-                if 'w:br' in paragraph._p.xml and 'type="page"' in paragraph._p.xml:
-                    # 找到显式分页符
-                    page_breaks.append((i, current_page))
-                    current_page += 1
-                    current_line_count = lines_in_para  # 重置行数计数
-
-                # 检查是否因行数估算而翻页
-                if current_line_count > lines_per_page_estimate:
-                    page_breaks.append((i, current_page))
-                    current_page += 1
-                    current_line_count = lines_in_para  # 重置为当前段落的行数
-
-        return page_breaks
-
-    def _extract_full_text(self):
-        """提取完整文本"""
-        full_text = []
-        for para in self.doc.paragraphs:
-            # 保留换行符以便于上下文查找
-            full_text.append(para.text + "\n")
-        return ''.join(full_text)
-
-    def get_page_number(self, paragraph_index):
-        """根据段落索引估算页码"""
-        page_num = 1
-        for break_index, break_page in self.page_breaks:
-            if paragraph_index >= break_index:
-                page_num = break_page + 1  # 下一页开始
-            else:
-                break
-        return page_num
-
-    def find_keyword_occurrences(self, keywords):
-        """查找关键词并返回其页码和上下文"""
-        occurrences = []
-        context_length = 50  # 上下文字符数
-
-        # 为了提高查找效率，可以将列表转换为集合进行成员检查
-        keywords_set = set(kw.strip() for kw in keywords if kw.strip())
-
-        for kw_index, keyword in enumerate(keywords):
-            keyword = keyword.strip()
-            if not keyword:
-                continue
-            start = 0
-            while True:
-                pos = self.full_text.find(keyword, start)
-                if pos == -1:
-                    break
-
-                # 找到包含关键词的段落索引
-                para_index = 0
-                text_pos = 0
-                for i, para in enumerate(self.doc.paragraphs):
-                    para_end = text_pos + len(para.text) + 1  # +1 for \n
-                    if text_pos <= pos < para_end:
-                        para_index = i
-                        break
-                    text_pos = para_end
-
-                # 估算页码
-                page_num = self.get_page_number(para_index)
-
-                # 提取上下文
-                context_start = max(0, pos - context_length)
-                context_end = min(len(self.full_text), pos + len(keyword) + context_length)
-                context = self.full_text[context_start:context_end].strip()
-
-                occurrences.append({
-                    'keyword': keyword,
-                    'page': page_num,
-                    'context': context
-                })
-                start = pos + 1  # 从下一个位置继续查找
-
-        return occurrences
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self._size,
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# 文档模型缓存：文件内容哈希 -> 段落和分页模型
+document_cache = LRUCache(f'documents-v{DocxTextExtractor.MODEL_VERSION}', DOCUMENT_CACHE_MAX_CHARS,
+                          sizeof=lambda model: sum(len(text) for text in model['paragraphs']) + 1,
+                          disk_dir=CACHE_DIR)
+# 匹配结果缓存：(文件内容哈希, 检查类型, 关键词集合指纹, 匹配模式) -> 匹配结果
+result_cache = LRUCache(f'results-v{DocxTextExtractor.MODEL_VERSION}', RESULT_CACHE_MAX_OCCURRENCES,
+                        sizeof=lambda occurrences: len(occurrences) + 1,
+                        disk_dir=CACHE_DIR)
+
+
+# 增量检查的版本历史：(文档标识, 检查类型) -> 该文档最近一次检查的段落哈希、各段落的匹配和对比结果
+document_history = LRUCache(f'document-history-v{DocxTextExtractor.MODEL_VERSION}', DOCUMENT_HISTORY_MAX_ENTRIES,
+                            sizeof=lambda snapshot: len(snapshot['known']) + len(snapshot['hits']) + 1,
+                            disk_dir=CACHE_DIR)
+# 分组结果缓存：结果 ID -> (关键词统计, 片段列表)，供 /results 按游标翻页
+grouped_views = LRUCache('grouped-views', GROUPED_VIEW_CACHE_MAX_SNIPPETS, sizeof=lambda view: len(view[1]) + 1)
+
+
+def invalidate_region_results(version=None):
+    """地域名称变更后清除所有 china_regions 检查的缓存结果"""
+    result_cache.invalidate(lambda key: key[1] == 'china_regions')
+
+
+# 地域数据库第一次创建、且 REGIONS_FILE 也不存在时使用的默认数据
+DEFAULT_REGIONS = {
+    "省级": ["北京", "天津", "上海", "重庆", "香港", "澳门", "内蒙古", "广西", "西藏", "宁夏", "新疆",
+             "河北", "山西", "辽宁", "吉林", "黑龙江", "江苏", "浙江", "安徽", "福建", "江西", "山东",
+             "河南", "湖北", "湖南", "广东", "海南", "四川", "贵州", "云南", "陕西", "甘肃", "青海"],
+    "市级": ["石家庄", "唐山", "张家口", "太原", "沈阳", "大连", "辽阳", "长春", "松原", "延边",
+             "哈尔滨", "齐齐哈尔", "南京", "无锡", "徐州", "常州", "苏州", "南通", "连云港", "淮安",
+             "盐城", "扬州", "镇江", "泰州", "宿迁", "杭州", "宁波", "温州", "嘉兴", "湖州", "绍兴",
+             "金华", "衢州", "舟山", "台州", "丽水", "合肥", "六安", "亳州", "福州", "厦门", "南昌",
+             "赣州", "济南", "青岛", "淄博", "郑州", "开封", "洛阳", "焦作", "武汉", "黄石", "十堰",
+             "宜昌", "襄阳", "鄂州", "荆门", "孝感", "荆州", "黄冈", "咸宁", "随州", "恩施", "仙桃",
+             "潜江", "天门", "神农架林区", "长沙", "株洲", "湘潭", "岳阳", "广州", "深圳", "肇庆",
+             "惠州", "梅州", "海口", "三亚", "成都", "甘孜", "凉山", "贵阳", "黔西南", "黔东南", "黔南",
+             "昆明", "西安", "榆林", "兰州", "西宁"],
+    "区级": ["东城", "西城", "朝阳", "丰台", "石景山", "海淀", "门头沟", "房山", "通州", "顺义",
+             "昌平", "大兴", "怀柔", "平谷", "密云", "延庆", "和平", "河东", "河西", "南开", "河北",
+             "红桥", "东丽", "西青", "津南", "北辰", "武清", "宝坻", "滨海新", "宁河", "静海", "蓟州",
+             "黄浦", "徐汇", "长宁", "静安", "普陀", "虹口", "杨浦", "闵行", "宝山", "嘉定", "浦东",
+             "金山", "松江", "青浦", "奉贤", "崇明", "万州", "涪陵", "渝中", "大渡口", "江北", "沙坪坝",
+             "九龙坡", "南岸", "北碚", "綦江", "大足", "渝北", "巴南", "黔江", "长寿", "江津", "合川",
+             "永川", "南川", "璧山", "铜梁", "潼南", "荣昌", "开州", "梁平", "武隆", "城口", "丰都",
+             "垫江", "忠县", "云阳", "奉节", "巫山", "巫溪"]
+}
+
+# 地域名称存储：任一进程写入后版本号递增，各进程在下次读取时重建地域索引并清除缓存的地域检查结果；
+# 全国行政区划词典只加载一次，每次重建地域索引时与数据库中的名称一起编译进匹配器
+regions_store = SQLiteRegionsStore(REGIONS_DB, seed_file=REGIONS_FILE, default_data=DEFAULT_REGIONS,
+                                   divisions=load_divisions(DIVISIONS_FILE) if DIVISIONS_FILE else None)
+regions_store.add_listener(invalidate_region_results)
 
 
 def secure_filename(filename):
@@ -256,52 +312,719 @@ def secure_filename(filename):
 
 def allowed_file(filename):
     """检查文件扩展名是否被允许"""
-    try:
-        app.logger.info(f"Checking file: {filename}")
+    # 每次上传都会调用：细节只在 DEBUG 级别记录，且使用惰性格式化，日志关闭时不产生额外开销
+    if not filename or '.' not in filename:
+        app.logger.warning("Rejected filename without extension: %r", filename)
+        return False
+    extension = filename.rsplit('.', 1)[1].lower()
+    result = extension in ALLOWED_EXTENSIONS
+    app.logger.debug("Checking file: %s, extension: %s, allowed: %s", filename, extension, result)
+    return result
+
+
+# --- 性能指标 ---
+
+metrics_registry = Registry()
+STAGE_SECONDS = metrics_registry.histogram('checkdoc_stage_duration_seconds', '检查流程各阶段的耗时（秒）',
+                                           label_names=('stage',))
+STAGE_BYTES = metrics_registry.histogram('checkdoc_stage_bytes', '各阶段处理的字节数', BYTES_BUCKETS, ('stage',))
+DOCUMENT_PARAGRAPHS = metrics_registry.histogram('checkdoc_document_paragraphs', '每次解析的文档段落数',
+                                                 COUNT_BUCKETS)
+DOCUMENT_HITS = metrics_registry.histogram('checkdoc_document_hits', '每次匹配找到的匹配项数', COUNT_BUCKETS)
+REQUEST_SECONDS = metrics_registry.histogram('checkdoc_request_duration_seconds', '请求耗时（秒）',
+                                             label_names=('endpoint',))
+REQUESTS_TOTAL = metrics_registry.counter('checkdoc_requests_total', '请求数', ('endpoint', 'status'))
+PROFILES_TOTAL = metrics_registry.counter('checkdoc_profiles_total', '保存的 cProfile 分析结果数')
+ADMISSION_WAIT_SECONDS = metrics_registry.histogram('checkdoc_admission_wait_seconds', '上传请求排队等待处理的时间（秒）')
+ADMISSION_REJECTIONS = metrics_registry.counter('checkdoc_admission_rejections_total',
+                                                '系统繁忙时被拒绝（503）的上传请求数', ('reason',))
+UPLOADS_TOTAL = metrics_registry.counter('checkdoc_uploads_total', '处理完的上传文件数，按缓冲位置（memory/disk）区分',
+                                         ('buffer',))
+UPLOAD_BYTES_TOTAL = metrics_registry.counter('checkdoc_upload_bytes_total',
+                                              '处理完的上传文件字节数，按缓冲位置（memory/disk）区分', ('buffer',))
+metrics_registry.gauge('checkdoc_admission_queue_depth', '排队等待处理的上传请求数',
+                       lambda: upload_admission.stats()['queued'])
+metrics_registry.gauge('checkdoc_admission_inflight_cost_bytes', '正在处理的上传请求的代价之和（字节）',
+                       lambda: upload_admission.stats()['inflightCost'])
+profile_lock = threading.Lock()  # 同一时间只能有一个 cProfile 在运行
+# 由 create_app 填写：导入加预热的总耗时、预热耗时和执行预热的进程（fork 前的主进程或单进程服务器本身）
+startup_info = {'coldStartSeconds': None, 'warmUpSeconds': None, 'preloadedBy': None}
+metrics_registry.gauge('checkdoc_cold_start_seconds', '从导入应用到完成预热的耗时（秒）',
+                       lambda: startup_info['coldStartSeconds'])
+metrics_registry.gauge('checkdoc_process_resident_memory_bytes', '当前工作进程的常驻内存（字节）',
+                       lambda: process_memory()['rss'])
+metrics_registry.gauge('checkdoc_process_private_memory_bytes', '当前工作进程独占（未与主进程共享）的内存（字节）',
+                       lambda: process_memory()['private'])
+
+
+def record_trace(trace):
+    """把一次请求或任务的各阶段耗时、字节数、段落数和匹配数汇总到直方图"""
+    for span in trace.spans:
+        STAGE_SECONDS.observe(span['seconds'], stage=span['stage'])
+        if 'bytes' in span:
+            STAGE_BYTES.observe(span['bytes'], stage=span['stage'])
+        if 'paragraphs' in span:
+            DOCUMENT_PARAGRAPHS.observe(span['paragraphs'])
+        if 'hits' in span:
+            DOCUMENT_HITS.observe(span['hits'])
+
+
+@app.before_request
+def start_request_trace():
+    """开始记录请求的各阶段耗时；配置了 PROFILE_DIR 且请求带 X-Profile 头时同时用 cProfile 分析"""
+    g.trace = Trace()
+    if PROFILE_DIR and request.headers.get('X-Profile') and profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _stop_profiler():
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_lock.release()
+    return profiler
+
+
+@app.after_request
+def finish_request_trace(response):
+    """汇总请求指标；慢请求把各阶段耗时写入日志，耗时超过 PROFILE_MIN_SECONDS 的分析结果保存到 PROFILE_DIR"""
+    trace = g.pop('trace', None)
+    if trace is None:
+        return response
+    elapsed = trace.elapsed()
+    endpoint = request.endpoint or 'unknown'
+    record_trace(trace)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    REQUESTS_TOTAL.inc(endpoint=endpoint, status=response.status_code)
+    if elapsed >= SLOW_REQUEST_SECONDS:
+        app.logger.warning(f"Slow request {request.method} {request.path} took {elapsed:.3f}s: "
+                           f"{json.dumps(trace.spans, ensure_ascii=False)}")
+
+    profiler = _stop_profiler()
+    if profiler is not None and elapsed >= PROFILE_MIN_SECONDS:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}.prof"
+            profiler.dump_stats(os.path.join(PROFILE_DIR, profile_name))
+            PROFILES_TOTAL.inc()
+            response.headers['X-Profile-File'] = profile_name
+        except OSError as e:
+            app.logger.error(f"Error saving profile: {e}")
+    return response
+
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    """请求异常结束时 after_request 不会执行，也要停止分析并释放锁"""
+    _stop_profiler()
+
+
+def uploaded_files():
+    """返回 request.files；首次访问时才解析表单并缓冲上传文件，这部分耗时计入 save 阶段"""
+    with g.trace.span('save', bytes=request.content_length or 0):
+        return request.files
+
+
+def timed_jsonify(data):
+    """序列化 JSON 响应，耗时和字节数计入 serialize 阶段"""
+    with g.trace.span('serialize') as span:
+        response = jsonify(data)
+        span['bytes'] = response.content_length or 0
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """以 Prometheus 文本格式导出各阶段耗时等指标"""
+    return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.after_request
+def compress_response(response):
+    """按 Accept-Encoding 压缩较大的 JSON 响应：安装了 brotli 时优先使用 br，否则使用 gzip"""
+    if (response.direct_passthrough or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < RESPONSE_COMPRESSION_MIN_SIZE:
+        return response
+    started = time.perf_counter()
+    if brotli is not None and request.accept_encodings.quality('br'):
+        response.set_data(brotli.compress(data, quality=RESPONSE_COMPRESSION_LEVEL))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings.quality('gzip'):
+        response.set_data(gzip.compress(data, compresslevel=RESPONSE_COMPRESSION_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    if 'Content-Encoding' in response.headers and g.get('trace') is not None:
+        g.trace.add('compress', time.perf_counter() - started, bytes=len(data))
+    return response
+
+
+@app.route('/')
+def index():
+    return render_template('index.html')
 
-        # 检查文件名是否为空
-        if not filename:
-            app.logger.warning("Empty filename provided")
-            return False
 
-        # 检查是否包含点号
-        if '.' not in filename:
-            app.logger.warning(f"No dot found in filename: {filename}")
-            return False
+def parse_check_options(form):
+    """
+    从表单中解析检查类型、关键词和匹配模式。
+    返回 (options, error)，出错时 options 为 None，error 为 (错误信息, HTTP 状态码)。
+    """
+    # 获取关键词类型
+    check_type = form.get('checkType', 'custom')
+
+    if check_type == 'custom':
+        keywords_str = form.get('keywords', '')
+        if not keywords_str.strip():
+            return None, ('请输入至少一个关键词', 400)
+        keywords = keywords_str.split('，')  # 使用中文逗号分割
+    elif check_type == 'china_regions':
+        # 直接使用地域索引中预先编译好的匹配器
+        keywords = regions_store.get().matcher
+        if not keywords:
+            return None, ('地域名称列表为空或加载失败', 500)
+    else:
+        return None, ('无效的检查类型', 400)
 
-        # 获取文件扩展名
-        parts = filename.rsplit('.', 1)
-        # print(parts)
-        app.logger.info(f"Filename parts: {parts}")
+    # 匹配模式：all 报告所有（含重叠）匹配，longest 只报告最长匹配
+    longest_only = form.get('matchMode', 'all') == 'longest'
+    return {'check_type': check_type, 'keywords': keywords, 'longest_only': longest_only}, None
 
-        if len(parts) != 2:
-            app.logger.warning(f"Unexpected number of parts in filename: {filename}")
-            return False
 
-        extension = parts[1].lower()
-        app.logger.info(f"Extension: {extension}, Allowed: {ALLOWED_EXTENSIONS}")
+def load_extractor(docx_source, doc_hash, trace):
+    """从文档模型缓存重建提取器，未命中时解析文档并写入缓存"""
+    model = document_cache.get(doc_hash)
+    if model is not None:
+        extractor = DocxTextExtractor.from_model(model)
+    else:
+        extractor = DocxTextExtractor(docx_source)
+        document_cache.put(doc_hash, extractor.to_model())
+        trace.add('parse', extractor.stage_timings['parse'], paragraphs=len(extractor.paragraphs))
+        trace.add('pagination', extractor.stage_timings['pagination'])
+    trace.add('text', extractor.stage_timings['index'], chars=len(extractor.full_text))
+    return extractor
 
-        result = extension in ALLOWED_EXTENSIONS
-        app.logger.info(f"File allowed: {result}")
-        return result
-    except Exception as e:
-        # 记录异常但不中断程序
-        app.logger.error(f"Error checking file extension for filename '{filename}': {str(e)}")
-        return False
 
+def check_document(docx_source, check_type, keywords, longest_only=False, progress=None, trace=None, doc_hash=None):
+    """
+    检查一个 docx 文件（路径或可 seek 的文件对象），返回 (匹配项列表, 是否命中结果缓存)。
+    同一文件内容、同一关键词集合的结果直接从缓存返回；progress 的含义见 find_keyword_occurrences。
+    传入 trace 时记录哈希、解析、分页、文本构建和匹配各阶段的耗时；doc_hash 为调用方已经算好的文件哈希。
+    """
+    if trace is None:
+        trace = Trace()
+    if doc_hash is None:
+        with trace.span('hash'):
+            doc_hash = file_sha256(docx_source)
+    result_key = (doc_hash, check_type, keywords_fingerprint(keywords), longest_only)
+    occurrences = result_cache.get(result_key)
+    if occurrences is not None:
+        return occurrences, True
+
+    extractor = load_extractor(docx_source, doc_hash, trace)
+    with trace.span('match') as span:
+        occurrences = extractor.find_keyword_occurrences(keywords, longest_only=longest_only, progress=progress)
+        span['hits'] = len(occurrences)
+    result_cache.put(result_key, occurrences)
+    return occurrences, False
+
+
+def query_mode_args(form):
+    """
+    读取查询模式 mode（all、exists、counts、first_n，见 checkdoc.QUERY_MODES）及 first_n 模式返回的匹配项数 limit。
+    返回 ((模式, 数量), error)，出错时前者为 None，error 为 (错误信息, HTTP 状态码)。
+    """
+    mode = form.get('mode', MODE_ALL)
+    if mode not in QUERY_MODES:
+        return None, ('无效的查询模式', 400)
+    limit = form.get('limit', DEFAULT_FIRST_N, type=int)
+    return (mode, min(max(limit, 1), QUICK_FIRST_N_MAX)), None
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+
+def quick_check(docx_source, options, mode, limit, trace):
+    """
+    快速查询模式（exists、counts、first_n），返回响应字段。与分组结果一样不报告“省级”等级别名称本身。
+    文档模型已缓存时在缓存的模型上匹配，匹配项带有与完整检查相同的页码和上下文；
+    否则流式提取段落边提取边匹配，不解析版式、不计算分页，exists 和 first_n 找够匹配项即停止解析，
+    匹配项的页码为 null、pageConfidence 为 'unknown'。快速查询的结果不完整，不写入结果缓存和文档模型缓存。
+    """
+    keywords, longest_only = options['keywords'], options['longest_only']
+    exclude = excluded_keywords(options['check_type'])
+    with trace.span('hash'):
+        doc_hash = file_sha256(docx_source)
+    model = document_cache.get(doc_hash)
+    if model is not None:
+        extractor = DocxTextExtractor.from_model(model)
+        trace.add('text', extractor.stage_timings['index'], chars=len(extractor.full_text))
+        with trace.span('match'):
+            result = extractor.find_keyword_occurrences(keywords, longest_only=longest_only, mode=mode, limit=limit,
+                                                        exclude=exclude)
+    else:
+        with trace.span('quick_scan'):
+            result = quick_scan(docx_source, keywords, mode, limit=limit, longest_only=longest_only, exclude=exclude)
+
+    data = {'mode': mode}
+    if mode == MODE_COUNTS:
+        data.update(counts=result, total=sum(stat['count'] for stat in result))
+    elif mode == MODE_EXISTS:
+        data.update(exists=bool(result), occurrences=result)
+    else:
+        # complete 为 True 表示文档中的匹配项已全部返回
+        data.update(occurrences=result, limit=limit, complete=len(result) < limit)
+    return data
+
+
+def client_namespace():
+    """当前客户端的标识，随机生成后保存在签名的会话 Cookie 中，用于隔离不同客户端以文件名标识的文档历史"""
+    client_id = session.get('client_id')
+    if client_id is None:
+        client_id = session['client_id'] = uuid.uuid4().hex
+    return client_id
+
+
+def document_id_arg(form, filename):
+    """
+    增量检查的文档标识：客户端指定的 documentId（由调用方保证唯一），或在 compareWithPrevious 为 true 时
+    使用当前客户端命名空间下的文件名，不同用户上传的同名文件不会互相比较。不做增量检查时返回 None。
+    """
+    document_id = form.get('documentId', '').strip()
+    if not document_id and form.get('compareWithPrevious', '').lower() in ('1', 'true', 'on'):
+        document_id = f'{client_namespace()}/{filename}'
+    return document_id[:DOCUMENT_ID_MAX_LENGTH] or None
+
+
+def check_document_version(docx_source, document_id, check_type, keywords, longest_only=False, progress=None,
+                           trace=None, doc_hash=None):
+    """
+    增量检查同一文档（以 document_id 标识）的新版本：只扫描与上一版本相比新增或改动的段落，其余段落复用上一版本的匹配。
+    返回 (匹配项列表, 上一版本中已不存在的匹配项, 版本对比摘要, 是否命中结果缓存)，
+    匹配项带 change 字段：'new' 为本版本新增，'unchanged' 为所在段落未改动的匹配项。
+    关键词集合或匹配模式与上一版本不同时整篇扫描，但仍与上一版本对比。doc_hash 的含义见 check_document。
+    """
+    if trace is None:
+        trace = Trace()
+    if doc_hash is None:
+        with trace.span('hash'):
+            doc_hash = file_sha256(docx_source)
+    fingerprint = keywords_fingerprint(keywords)
+    history_key = (document_id, check_type)
+    previous = document_history.get(history_key)
+    same_keywords = (previous is not None and previous['fingerprint'] == fingerprint
+                     and previous['longestOnly'] == longest_only)
+    if same_keywords and previous['docHash'] == doc_hash:
+        # 重复上传同一版本：返回与上次相同的对比结果
+        occurrences = [dict(occurrence, change=change)
+                       for (_, occurrence), change in zip(previous['hits'], previous['changes'])]
+        removed = [dict(occurrence, change='removed') for occurrence in previous['removed']]
+        return occurrences, removed, previous['diff'], True
+
+    extractor = load_extractor(docx_source, doc_hash, trace)
+    with trace.span('diff'):
+        hashes = extractor.paragraph_hashes()
+    result_key = (doc_hash, check_type, fingerprint, longest_only)
+    occurrences = result_cache.get(result_key)
+    cached = occurrences is not None
+    scanned = 0
+    if occurrences is None:
+        with trace.span('match') as span:
+            if same_keywords:
+                occurrences, scanned = extractor.find_changed_occurrences(keywords, previous['known'], hashes,
+                                                                           longest_only=longest_only)
+            else:
+                occurrences = extractor.find_keyword_occurrences(keywords, longest_only=longest_only,
+                                                                 progress=progress)
+                scanned = len(hashes)
+            span['hits'] = len(occurrences)
+        result_cache.put(result_key, occurrences)
+
+    with trace.span('diff'):
+        known, identities = paragraph_matches(extractor, occurrences, hashes)
+        if previous is not None:
+            changes, removed = diff_occurrences(previous['hits'], identities)
+            changed_paragraphs = sum(1 for digest in hashes if digest not in previous['known'])
+            current_hashes = set(hashes)
+            removed_paragraphs = sum(1 for digest in previous['known'] if digest not in current_hashes)
+        else:
+            changes, removed = ['new'] * len(identities), []
+            changed_paragraphs, removed_paragraphs = len(hashes), 0
+        if cached:
+            # 匹配结果来自缓存：报告得出该结果需要扫描的段落数，与未命中缓存时一致
+            scanned = changed_paragraphs if same_keywords else len(hashes)
+        version = 1 if previous is None else previous['version'] + (previous['docHash'] != doc_hash)
+        diff = {
+            'documentId': document_id,
+            'version': version,
+            'previousVersion': previous['version'] if previous is not None else None,
+            'new': changes.count('new'),
+            'unchanged': changes.count('unchanged'),
+            'removed': len(removed),
+            # 段落：总数、实际扫描的、新增或改动的、上一版本中有而本版本已没有的
+            'paragraphs': {'total': len(hashes), 'scanned': scanned, 'changed': changed_paragraphs,
+                           'removed': removed_paragraphs},
+        }
+        document_history.put(history_key, {
+            'version': version, 'docHash': doc_hash, 'fingerprint': fingerprint, 'longestOnly': longest_only,
+            'known': known, 'hits': list(zip(identities, occurrences)), 'changes': changes,
+            'removed': removed, 'diff': diff,
+        })
+        occurrences = [dict(occurrence, change=change) for occurrence, change in zip(occurrences, changes)]
+    return occurrences, [dict(occurrence, change='removed') for occurrence in removed], diff, cached
+
+
+def spills_to_disk(size):
+    """
+    按大小判断一个上传缓冲区是否已溢出到磁盘。
+    上传和 spool_upload 都使用 max_size 为 UPLOAD_SPOOL_MAX_MEMORY 的 SpooledTemporaryFile，
+    它在写入后的长度超过 max_size 时转存到临时文件，且只增不减，因此最终大小即可判定。
+    """
+    return size > app.config['UPLOAD_SPOOL_MAX_MEMORY']
+
+
+class UploadSpoolStats:
+    """统计上传文件的缓冲情况：有多少上传及字节留在内存中，多少溢出写入了磁盘"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.spilled_uploads = 0
+        self.bytes_in_memory = 0
+        self.bytes_to_disk = 0
+
+    def record(self, stream):
+        """在上传文件处理完后记录其缓冲情况，返回文件大小"""
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        spilled = spills_to_disk(size)
+        with self._lock:
+            self.uploads += 1
+            if spilled:
+                self.spilled_uploads += 1
+                self.bytes_to_disk += size
+            else:
+                self.bytes_in_memory += size
+        buffer = 'disk' if spilled else 'memory'
+        UPLOADS_TOTAL.inc(buffer=buffer)
+        UPLOAD_BYTES_TOTAL.inc(size, buffer=buffer)
+        return size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'uploads': self.uploads,
+                'spilledUploads': self.spilled_uploads,
+                'bytesInMemory': self.bytes_in_memory,
+                'bytesToDisk': self.bytes_to_disk,
+                'spoolMaxMemory': app.config['UPLOAD_SPOOL_MAX_MEMORY'],
+            }
+
+
+upload_spool_stats = UploadSpoolStats()
+
+
+class AdmissionRejected(Exception):
+    """上传请求因系统繁忙未获准处理；reason 为 'queue_full' 或 'timeout'，retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    按代价控制同时处理的上传请求：正在处理的请求代价之和不超过 max_cost，超出时按到达顺序排队，
+    排队的请求数达到 queue_limit 或等待超过 timeout 秒时拒绝。按到达顺序放行，大文件不会被源源不断的小文件饿死；
+    代价超过 max_cost 的请求按 max_cost 计，即在没有其他请求处理时单独执行。
+    同步上传（/upload）、异步任务（/jobs，任务结束时归还名额）和批量检查（/batch）共用同一个实例。
+    名额只在本进程内统计：gunicorn 的每个工作进程各有一份，整台服务器的上限是工作进程数乘以这里的上限。
+    """
+
+    def __init__(self, max_cost, queue_limit, timeout):
+        self.max_cost = max_cost
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._waiting = deque()
+        self._inflight = 0
+        self._inflight_cost = 0
+        self._service_seconds = None  # 请求处理耗时的指数移动平均，用于估计 Retry-After
+        self.admitted = 0
+        self.rejected = 0
+
+    def _retry_after(self):
+        """估计排队的请求处理完所需的秒数（1 到 60 秒）"""
+        average = self._service_seconds if self._service_seconds is not None else 1.0
+        return max(1, min(60, math.ceil(average * (len(self._waiting) + 1))))
+
+    def check(self):
+        """不申请名额，只检查排队是否已满；已满时抛出 AdmissionRejected，可以在读取请求体之前调用"""
+        with self._condition:
+            if len(self._waiting) >= self.queue_limit:
+                self.rejected += 1
+                raise AdmissionRejected('queue_full', self._retry_after())
+
+    def acquire(self, cost):
+        """
+        申请处理一个代价为 cost 的请求，必要时排队等待，返回等待的秒数；未获准时抛出 AdmissionRejected。
+        获准的请求处理完后必须调用 release。
+        """
+        cost = min(cost, self.max_cost)
+        started = time.perf_counter()
+        with self._condition:
+            if not self._waiting and self._inflight_cost + cost <= self.max_cost:
+                self._admit(cost)
+                return 0.0
+            if len(self._waiting) >= self.queue_limit:
+                self.rejected += 1
+                raise AdmissionRejected('queue_full', self._retry_after())
+            entry = [cost]  # 以列表对象的身份区分排队的请求
+            self._waiting.append(entry)
+            try:
+                deadline = started + self.timeout
+                while self._waiting[0] is not entry or self._inflight_cost + cost > self.max_cost:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise AdmissionRejected('timeout', self._retry_after())
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting.remove(entry)
+                # 队首变了，让下一个排队的请求重新检查
+                self._condition.notify_all()
+            self._admit(cost)
+        return time.perf_counter() - started
+
+    def _admit(self, cost):
+        self._inflight += 1
+        self._inflight_cost += cost
+        self.admitted += 1
+
+    def release(self, cost, seconds):
+        """请求处理完毕，归还名额；seconds 为处理耗时"""
+        cost = min(cost, self.max_cost)
+        with self._condition:
+            self._inflight -= 1
+            self._inflight_cost -= cost
+            self._service_seconds = (seconds if self._service_seconds is None
+                                     else 0.8 * self._service_seconds + 0.2 * seconds)
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'inflight': self._inflight,
+                'inflightCost': self._inflight_cost,
+                'maxCost': self.max_cost,
+                'queued': len(self._waiting),
+                'queueLimit': self.queue_limit,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
+
+
+upload_admission = AdmissionController(ADMISSION_MAX_COST, ADMISSION_QUEUE_LIMIT, ADMISSION_QUEUE_TIMEOUT)
+
+
+def check_cost(size, keywords):
+    """检查一个文件的代价（按字节计）：文件大小加上关键词数乘以 ADMISSION_KEYWORD_COST"""
+    count = len(keywords.keywords) if isinstance(keywords, KeywordMatcher) else len(keywords)
+    return size + count * ADMISSION_KEYWORD_COST
+
+
+def upload_cost(stream, keywords):
+    """上传请求的处理代价，见 check_cost"""
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return check_cost(size, keywords)
+
+
+def admit(cost, description):
+    """
+    按代价申请处理名额：繁忙时排队，返回获准的时间（time.perf_counter()），处理完后调用 upload_admission.release。
+    排队已满或等待超时抛出 AdmissionRejected，调用方用 admission_rejected 返回 503。
+    """
+    waited = upload_admission.acquire(cost)
+    ADMISSION_WAIT_SECONDS.observe(waited)
+    g.trace.add('admission', waited)
+    if waited >= 1:
+        app.logger.info("%s (cost %d) waited %.2fs for admission, %d still queued", description, cost, waited,
+                        upload_admission.stats()['queued'])
+    return time.perf_counter()
+
+
+def admission_rejected(error):
+    """系统繁忙时的 503 响应，带 Retry-After 头"""
+    ADMISSION_REJECTIONS.inc(reason=error.reason)
+    app.logger.warning("Upload rejected (%s), retry after %ss: %s", error.reason, error.retry_after,
+                       upload_admission.stats())
+    response = jsonify({'success': False, 'message': '服务器繁忙，请稍后重试', 'retryAfter': error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+
+class SpooledUploadRequest(Request):
+    """
+    上传的文件先缓冲在内存中，超过 UPLOAD_SPOOL_MAX_MEMORY 后才溢出到匿名临时文件。
+    溢出文件在创建时即已从目录中删除，进程异常退出也不会遗留临时文件。
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_MAX_MEMORY'])
+
+
+app.request_class = SpooledUploadRequest
+
+
+def spool_upload(file):
+    """
+    把上传文件复制到一个独立的缓冲区，供请求结束后仍需读取文件的异步任务使用。
+    与上传本身一样，小文件留在内存中，超过阈值才写入磁盘。
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_MAX_MEMORY'])
+    file.stream.seek(0)
+    shutil.copyfileobj(file.stream, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+# --- 分组响应 ---
+
+def wants_grouped():
+    """请求是否要求分组响应（表单或查询参数 format=grouped）"""
+    return request.values.get('format') == 'grouped'
+
+
+def wants_annotated():
+    """请求是否要求返回标注了匹配项的文档（表单或查询参数 format=annotated）"""
+    return request.values.get('format') == 'annotated'
+
+
+class ClosingReader(io.BufferedReader):
+    """
+    关闭时调用 on_close 的只读文件。send_file 的响应直接交给服务器分块发送，
+    Werkzeug 不会调用这类响应的 call_on_close，只会在发送结束后关闭文件。
+    """
+
+    def __init__(self, raw, on_close):
+        super().__init__(raw)
+        self._on_close = on_close
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            self._on_close()
+
+
+def annotated_response(docx_source, doc_hash, filename, occurrences, check_type, on_close=None):
+    """
+    返回标注了匹配项（高亮加批注）的文档，与分组结果一样不标注“省级”等级别名称本身。
+    按匹配项的偏移直接定位，文档模型通常已在缓存中；标注结果写入匿名临时文件后分块发送，不在内存中保存整个文档。
+    on_close 在响应发送完毕、临时文件关闭时调用。
+    """
+    excluded = excluded_keywords(check_type)
+    occurrences = [occurrence for occurrence in occurrences if occurrence['keyword'] not in excluded]
+    extractor = load_extractor(docx_source, doc_hash, g.trace)
+    output = tempfile.TemporaryFile()
+    try:
+        with g.trace.span('annotate') as span:
+            stats = annotate_docx(docx_source, output, extractor, occurrences)
+            span['bytes'] = output.tell()
+    except Exception:
+        output.close()
+        raise
+    if on_close is not None:
+        output = ClosingReader(output.detach(), on_close)
+    output.seek(0)
+    app.logger.info("Annotated %s: %d occurrences, %d skipped", filename, stats['annotated'], stats['skipped'])
+    response = send_file(output, mimetype=DOCX_MIMETYPE, as_attachment=True,
+                         download_name=f'{os.path.splitext(filename)[0]}_标注.docx')
+    # 页眉、页脚、脚注和尾注中的匹配项不标注，计入 X-Annotation-Skipped
+    response.headers['X-Annotated'] = str(stats['annotated'])
+    response.headers['X-Annotation-Skipped'] = str(stats['skipped'])
+    return response
+
+
+def page_size_arg():
+    """读取每页片段数参数 pageSize，限制在 1 到 GROUPED_MAX_PAGE_SIZE 之间"""
+    page_size = request.values.get('pageSize', GROUPED_PAGE_SIZE, type=int)
+    return min(max(page_size, 1), GROUPED_MAX_PAGE_SIZE)
+
+
+def excluded_keywords(check_type):
+    """分组时不予报告的关键词：地域检查中“省级”、“市级”、“区级”等级别名称本身"""
+    return frozenset(regions_store.get().level_sets) if check_type == 'china_regions' else frozenset()
+
+
+def diff_response(diff, removed, check_type, grouped):
+    """增量检查的响应字段：版本对比摘要和已删除的匹配项（分组响应中同样按片段合并）"""
+    if grouped:
+        removed = group_occurrences(removed, exclude=excluded_keywords(check_type))[1]
+    return {'diff': diff, 'removed': removed}
+
+
+def create_grouped_view(occurrences, check_type):
+    """
+    对匹配结果分组并缓存，返回 (结果 ID, 分组结果)。
+    地域检查时去掉“省级”、“市级”、“区级”等级别名称本身的匹配。
+    """
+    with g.trace.span('group'):
+        view = group_occurrences(occurrences, exclude=excluded_keywords(check_type))
+    view_id = uuid.uuid4().hex
+    grouped_views.put(view_id, view)
+    return view_id, view
+
+
+def grouped_page(view_id, view, offset, page_size):
+    """
+    取分组结果从 offset 开始的一页片段，nextCursor 为下一页的游标，没有更多片段时为 None。
+    第一页同时返回结果 ID 和各关键词的匹配数、片段数及首个片段序号，客户端可以先显示汇总，
+    再用 “结果 ID.序号” 形式的游标按需获取任意位置（例如某个关键词）的片段。
+    """
+    keywords, snippets = view
+    items = snippets[offset:offset + page_size]
+    next_offset = offset + len(items)
+    data = {'items': items, 'nextCursor': f'{view_id}.{next_offset}' if next_offset < len(snippets) else None}
+    if offset == 0:
+        data.update(resultId=view_id, keywords=keywords, total=sum(stat['count'] for stat in keywords),
+                    snippetTotal=len(snippets))
+    return data
+
+
+@app.route('/results', methods=['GET'])
+def get_results_page():
+    """按游标获取分组结果的下一页片段"""
+    view_id, _, offset = request.args.get('cursor', '').partition('.')
+    if not view_id or not offset.isdigit():
+        return jsonify({'success': False, 'message': '无效的游标'}), 400
+    view = grouped_views.get(view_id)
+    if view is None:
+        return jsonify({'success': False, 'message': '结果已过期，请重新检查文件'}), 410
+    data = {'success': True}
+    data.update(grouped_page(view_id, view, int(offset), page_size_arg()))
+    return timed_jsonify(data)
 
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
+        # 排队已满时在读取上传内容之前就拒绝
+        try:
+            upload_admission.check()
+        except AdmissionRejected as e:
+            return admission_rejected(e)
+
         # 检查是否有文件部分
-        if 'file' not in request.files:
+        files = uploaded_files()
+        if 'file' not in files:
             return jsonify({'success': False, 'message': '没有选择文件'}), 400
-        file = request.files['file']
+        file = files['file']
 
         # 如果用户没有选择文件
         if file.filename == '':
@@ -311,53 +1034,76 @@ def upload_file():
         if file and allowed_file(file.filename):
             # 使用改进的secure_filename函数
             filename = secure_filename(file.filename)
-            app.logger.info(f"Original filename: {file.filename}, Secure filename: {filename}")
+            app.logger.debug("Original filename: %s, Secure filename: %s", file.filename, filename)
 
-            # 使用临时文件处理，避免磁盘写入
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1])
-            file.save(temp_file.name)
-            temp_file_path = temp_file.name
-            temp_file.close()  # 关闭文件以便后续读取
+            if not filename.lower().endswith('.docx'):
+                return jsonify({'success': False, 'message': '不支持的文件类型。请上传 .docx 文件。'}), 400
 
-            try:
-                # 获取关键词类型
-                check_type = request.form.get('checkType', 'custom')
-
-                keywords = []
-                if check_type == 'custom':
-                    keywords_str = request.form.get('keywords', '')
-                    if not keywords_str.strip():
-                        return jsonify({'success': False, 'message': '请输入至少一个关键词'}), 400
-                    keywords = keywords_str.split('，')  # 使用中文逗号分割
-                elif check_type == 'china_regions':
-                    keywords = load_regions()  # 从 JSON 文件加载地域名
-                    # 确保 keywords 是一个列表
-                    if keywords is None:
-                        keywords = []
-                    if not keywords:
-                        return jsonify({'success': False, 'message': '地域名称列表为空或加载失败'}), 500
-                else:
-                    return jsonify({'success': False, 'message': '无效的检查类型'}), 400
+            # 先校验参数，避免出错时遗留临时文件
+            options, error = parse_check_options(request.form)
+            if not error:
+                query, error = query_mode_args(request.form)
+            if error:
+                return jsonify({'success': False, 'message': error[0]}), error[1]
 
-                # 提取文本和查找关键词
-                if filename.lower().endswith('.docx'):
-                    extractor = DocxTextExtractor(temp_file_path)
-                    occurrences = extractor.find_keyword_occurrences(keywords)
-                    os.unlink(temp_file_path)  # 处理完立即删除临时文件
-                    return jsonify(
-                        {'success': True, 'filename': filename, 'occurrences': occurrences, 'checkType': check_type})
+            # 按文件大小和关键词数申请处理名额：繁忙时排队，排队已满或等待超时返回 503
+            cost = upload_cost(file.stream, options['keywords'])
+            try:
+                started = admit(cost, f"Upload {filename}")
+            except AdmissionRejected as e:
+                return admission_rejected(e)
 
+            # 直接从上传缓冲区读取，不再另存临时文件
+            release_on_close = False  # 标注文档在响应发送完毕后才释放名额
+            try:
+                if query[0] != MODE_ALL:
+                    # 快速查询模式只返回是否存在、各关键词的匹配数或前 N 个匹配项
+                    data = {'success': True, 'filename': filename, 'checkType': options['check_type']}
+                    data.update(quick_check(file.stream, options, *query, g.trace))
+                    return timed_jsonify(data)
+
+                # 提取文本和查找关键词；指定了文档标识时只扫描相对上一版本改动的段落
+                with g.trace.span('hash'):
+                    doc_hash = file_sha256(file.stream)
+                document_id = document_id_arg(request.form, filename)
+                if document_id:
+                    occurrences, removed, diff, cached = check_document_version(
+                        file.stream, document_id, options['check_type'], options['keywords'],
+                        longest_only=options['longest_only'], trace=g.trace, doc_hash=doc_hash)
                 else:
-                    os.unlink(temp_file_path)
-                    return jsonify({'success': False, 'message': '不支持的文件类型。请上传 .docx 文件。'}), 400
+                    occurrences, cached = check_document(file.stream, options['check_type'], options['keywords'],
+                                                         longest_only=options['longest_only'], trace=g.trace,
+                                                         doc_hash=doc_hash)
+                if wants_annotated():
+                    # 返回标注了匹配项的文档，而不是 JSON
+                    # 标注文档由 send_file 分块发送，名额和临时文件一样在发送完毕、文件关闭时才释放
+                    response = annotated_response(
+                        file.stream, doc_hash, filename, occurrences, options['check_type'],
+                        on_close=lambda: upload_admission.release(cost, time.perf_counter() - started))
+                    release_on_close = True
+                    return response
+                if wants_grouped():
+                    # 分组响应：先返回各关键词的匹配数和第一页片段，其余片段通过 /results 按游标获取
+                    view_id, view = create_grouped_view(occurrences, options['check_type'])
+                    data = {'success': True, 'filename': filename, 'checkType': options['check_type'],
+                            'cached': cached, 'format': 'grouped'}
+                    data.update(grouped_page(view_id, view, 0, page_size_arg()))
+                else:
+                    data = {'success': True, 'filename': filename, 'occurrences': occurrences,
+                            'checkType': options['check_type'], 'cached': cached}
+                if document_id:
+                    data.update(diff_response(diff, removed, options['check_type'], wants_grouped()))
+                return timed_jsonify(data)
 
             except Exception as e:
-                # 确保即使出错也删除临时文件
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
                 app.logger.error(f"Error processing file {filename}: {e}")
                 return jsonify({'success': False, 'message': f'处理文件时出错: {str(e)}'}), 500
 
+            finally:
+                upload_spool_stats.record(file.stream)
+                if not release_on_close:
+                    upload_admission.release(cost, time.perf_counter() - started)
+
         else:
             return jsonify({'success': False, 'message': '不支持的文件类型。请上传 .docx 文件。'}), 400
             
@@ -367,6 +1113,400 @@ def upload_file():
         return jsonify({'success': False, 'message': f'上传文件时发生错误: {str(e)}'}), 500
 
 
+# --- 异步任务 API ---
+
+class CheckJob:
+    """一个异步检查任务的状态、进度和（部分）结果"""
+
+    def __init__(self, filename, check_type, document_id=None):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.check_type = check_type
+        self.document_id = document_id  # 增量检查的文档标识
+        self.diff = None
+        self.removed = []
+        self.status = 'queued'  # queued -> running -> done / failed
+        self.processed = 0
+        self.total = None
+        self.occurrences = []
+        self.cached = False
+        self.message = None
+        self.view_id = None  # 分组结果的 ID，首次以 format=grouped 查询时生成
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update_progress(self, processed, total, new_occurrences):
+        """find_keyword_occurrences 的进度回调：记录进度并追加本段的匹配项"""
+        with self._lock:
+            self.processed = processed
+            self.total = total
+            self.occurrences.extend(new_occurrences)
+
+    def finish(self, occurrences, cached, removed=None, diff=None):
+        with self._lock:
+            # 最终结果与 /upload 的顺序一致，替换掉按文档顺序累积的部分结果
+            self.occurrences = occurrences
+            self.cached = cached
+            self.removed = removed or []
+            self.diff = diff
+            if self.total is None and diff is not None:
+                # 增量检查不按段报告进度，段落数取自版本对比摘要
+                self.total = diff['paragraphs']['total']
+            if self.total is not None:
+                self.processed = self.total
+            self.status = 'done'
+            self.finished_at = time.time()
+
+    def fail(self, message):
+        with self._lock:
+            self.status = 'failed'
+            self.message = message
+            self.finished_at = time.time()
+
+    def to_dict(self, since=0):
+        """返回任务状态，occurrences 只包含从 since 开始的匹配项"""
+        with self._lock:
+            data = {
+                'success': True,
+                'jobId': self.id,
+                'status': self.status,
+                'filename': self.filename,
+                'checkType': self.check_type,
+                'occurrences': self.occurrences[since:],
+                'nextIndex': len(self.occurrences),
+            }
+            # 命中结果缓存的任务没有扫描文档，不报告进度
+            if self.status != 'done' or self.total is not None:
+                data['progress'] = {'processed': self.processed, 'total': self.total}
+            if self.status == 'done':
+                data['cached'] = self.cached
+                if self.diff is not None:
+                    data.update(diff=self.diff, removed=self.removed)
+            if self.message:
+                data['message'] = self.message
+            return data
+
+
+jobs = {}
+jobs_lock = threading.Lock()
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='check-job')
+
+
+def _purge_finished_jobs():
+    """删除完成时间超过 JOB_RETENTION_SECONDS 的任务，调用方需持有 jobs_lock"""
+    expire_before = time.time() - JOB_RETENTION_SECONDS
+    for job_id in [job_id for job_id, job in jobs.items()
+                   if job.finished_at is not None and job.finished_at < expire_before]:
+        del jobs[job_id]
+
+
+def run_check_job(job, buffer, options, cost, admitted):
+    """在任务线程中执行检查，结束后释放文件缓冲区，并归还提交时申请的处理名额（代价 cost，获准时间 admitted）"""
+    job.status = 'running'
+    trace = Trace()
+    try:
+        if job.document_id:
+            occurrences, removed, diff, cached = check_document_version(
+                buffer, job.document_id, options['check_type'], options['keywords'],
+                longest_only=options['longest_only'], progress=job.update_progress, trace=trace)
+            job.finish(occurrences, cached, removed, diff)
+        else:
+            occurrences, cached = check_document(buffer, options['check_type'], options['keywords'],
+                                                 longest_only=options['longest_only'], progress=job.update_progress,
+                                                 trace=trace)
+            job.finish(occurrences, cached)
+    except Exception as e:
+        app.logger.error(f"Error processing job {job.id} ({job.filename}): {e}")
+        job.fail(f'处理文件时出错: {str(e)}')
+    finally:
+        buffer.close()
+        upload_admission.release(cost, time.perf_counter() - admitted)
+        record_trace(trace)
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    提交异步检查任务，返回任务 ID。任务与同步上传共用处理名额（见 AdmissionController），
+    名额不足时提交请求先排队，排队已满或等待超时返回 503；名额在任务结束时归还。
+    """
+    try:
+        upload_admission.check()
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    files = uploaded_files()
+    if 'file' not in files or files['file'].filename == '':
+        return jsonify({'success': False, 'message': '没有选择文件'}), 400
+    file = files['file']
+
+    if not allowed_file(file.filename):
+        return jsonify({'success': False, 'message': '不支持的文件类型。请上传 .docx 文件。'}), 400
+    filename = secure_filename(file.filename)
+
+    options, error = parse_check_options(request.form)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
+
+    cost = upload_cost(file.stream, options['keywords'])
+    try:
+        admitted = admit(cost, f"Job for {filename}")
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+
+    with jobs_lock:
+        _purge_finished_jobs()
+        pending = sum(1 for job in jobs.values() if job.finished_at is None)
+        if pending >= JOB_QUEUE_LIMIT:
+            upload_admission.release(cost, time.perf_counter() - admitted)
+            return jsonify({'success': False, 'message': '当前排队的任务过多，请稍后再试'}), 503
+        job = CheckJob(filename, options['check_type'], document_id_arg(request.form, filename))
+        jobs[job.id] = job
+
+    try:
+        with g.trace.span('spool') as span:
+            buffer = spool_upload(file)
+            span['bytes'] = upload_spool_stats.record(buffer)
+    except Exception as e:
+        upload_admission.release(cost, time.perf_counter() - admitted)
+        job.fail(f'保存文件时出错: {str(e)}')
+        app.logger.error(f"Error saving file for job {job.id}: {e}")
+        return jsonify({'success': False, 'message': f'保存文件时出错: {str(e)}'}), 500
+
+    job_executor.submit(run_check_job, job, buffer, options, cost, admitted)
+    return jsonify({'success': True, 'jobId': job.id, 'status': job.status}), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    查询任务状态、进度和已有结果。
+    since 参数用于增量获取：只返回从该序号开始的匹配项，下一次查询使用响应中的 nextIndex。
+    任务完成后 occurrences 会被替换为与 /upload 相同顺序的最终结果，应以 since=0 重新获取；
+    也可以用 format=grouped 获取分组后的第一页结果，再通过 /results 翻页。
+    """
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在或已过期'}), 404
+    if wants_grouped() and job.status == 'done':
+        view = grouped_views.get(job.view_id) if job.view_id else None
+        if view is None:
+            job.view_id, view = create_grouped_view(job.occurrences, job.check_type)
+        data = job.to_dict(since=len(job.occurrences))
+        del data['occurrences']
+        data['format'] = 'grouped'
+        data.update(grouped_page(job.view_id, view, 0, page_size_arg()))
+        if job.diff is not None:
+            data.update(diff_response(job.diff, job.removed, job.check_type, True))
+        return timed_jsonify(data)
+    since = request.args.get('since', 0, type=int)
+    return timed_jsonify(job.to_dict(since=max(since, 0)))
+
+
+# --- 批量检查 API ---
+
+def _is_batch_member(name):
+    """判断 zip 中的条目是否是需要检查的 docx 文件（跳过目录、Word 锁文件和 macOS 元数据）"""
+    base_name = name.rsplit('/', 1)[-1]
+    return (not name.endswith('/') and base_name.lower().endswith('.docx')
+            and not base_name.startswith('~$') and not name.startswith('__MACOSX/'))
+
+
+def collect_batch_files(uploaded_files, temp_dir):
+    """
+    把上传的 docx 文件和 zip 包中的 docx 文件保存到 temp_dir。
+    返回 [(显示用文件名, 本地路径或 None, 错误信息或 None), ...]。
+    """
+    entries = []
+    for file in uploaded_files:
+        if not file.filename:
+            continue
+        filename = secure_filename(file.filename)
+        extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        if extension == 'docx':
+            path = os.path.join(temp_dir, f"{len(entries)}.docx")
+            file.save(path)
+            entries.append((filename, path, None))
+        elif extension == 'zip':
+            try:
+                with zipfile.ZipFile(file.stream) as archive:
+                    members = [info for info in archive.infolist() if _is_batch_member(info.filename)]
+                    if sum(info.file_size for info in members) > BATCH_MAX_UNCOMPRESSED_SIZE:
+                        entries.append((filename, None, 'zip 包解压后过大'))
+                        continue
+                    for info in members:
+                        # 不使用 zip 中的路径写盘，避免路径穿越
+                        path = os.path.join(temp_dir, f"{len(entries)}.docx")
+                        with archive.open(info) as source, open(path, 'wb') as target:
+                            shutil.copyfileobj(source, target)
+                        entries.append((f"{filename}/{info.filename}", path, None))
+            except zipfile.BadZipFile:
+                entries.append((filename, None, '无效的 zip 文件'))
+        else:
+            entries.append((filename, None, '不支持的文件类型。请上传 .docx 文件或 .zip 包。'))
+    return entries
+
+
+batch_executor = None
+batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor():
+    """
+    批量检查共用的进程池，首次使用时创建，进程退出时关闭。Web 工作进程中有多个线程，
+    直接 fork 可能把其他线程持有的锁复制到子进程里，所以用 forkserver（不支持时用 spawn）启动工作进程。
+    """
+    global batch_executor
+    with batch_executor_lock:
+        if batch_executor is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            batch_executor = ProcessPoolExecutor(max_workers=BATCH_WORKERS,
+                                                 mp_context=multiprocessing.get_context(method))
+        return batch_executor
+
+
+def discard_batch_executor(executor):
+    """工作进程异常退出后进程池不再可用，丢弃它，下次批量检查时重新创建"""
+    global batch_executor
+    with batch_executor_lock:
+        if batch_executor is executor:
+            batch_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_batch_executor():
+    with batch_executor_lock:
+        if batch_executor is not None:
+            batch_executor.shutdown(wait=True, cancel_futures=True)
+
+
+@app.route('/batch', methods=['POST'])
+def batch_upload():
+    """
+    批量检查多个 docx 文件（字段 files，可多选），或 zip 包中的所有 docx 文件。
+    各文件分发到进程池并行处理，返回每个文件的结果和按关键词汇总的匹配数。
+    需要处理的文件（不含命中结果缓存的）按代价之和申请处理名额，与同步上传和异步任务共用，
+    名额不足时排队，排队已满或等待超时返回 503。
+    """
+    try:
+        upload_admission.check()
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    files = uploaded_files()
+    batch_files = files.getlist('files') or files.getlist('file')
+    if not batch_files:
+        return jsonify({'success': False, 'message': '没有选择文件'}), 400
+
+    options, error = parse_check_options(request.form)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
+
+    keywords = options['keywords']
+    matcher = keywords if isinstance(keywords, KeywordMatcher) else KeywordMatcher(keywords)
+    fingerprint = keywords_fingerprint(matcher)
+
+    temp_dir = tempfile.mkdtemp(prefix='checkdoc-batch-')
+    try:
+        entries = collect_batch_files(batch_files, temp_dir)
+        if not entries:
+            return jsonify({'success': False, 'message': '没有选择文件'}), 400
+        if len(entries) > BATCH_MAX_FILES:
+            return jsonify({'success': False, 'message': f'一次最多检查 {BATCH_MAX_FILES} 个文件'}), 400
+
+        results = [None] * len(entries)
+        pending = {}  # 结果缓存键 -> (路径, [结果序号, ...])，内容相同的文件只处理一次
+        for index, (filename, path, message) in enumerate(entries):
+            if message:
+                results[index] = {'filename': filename, 'success': False, 'message': message}
+                continue
+            result_key = (file_sha256(path), options['check_type'], fingerprint, options['longest_only'])
+            occurrences = result_cache.get(result_key)
+            if occurrences is not None:
+                results[index] = {'filename': filename, 'success': True, 'occurrences': occurrences, 'cached': True}
+            elif result_key in pending:
+                pending[result_key][1].append(index)
+            else:
+                pending[result_key] = (path, [index])
+
+        if pending:
+            cost = sum(check_cost(os.path.getsize(path), matcher) for path, _ in pending.values())
+            try:
+                admitted = admit(cost, f"Batch of {len(pending)} files")
+            except AdmissionRejected as e:
+                return admission_rejected(e)
+            try:
+                # 匹配器对整批文件只序列化一次，工作进程按摘要缓存，见 check_file_in_pool
+                payload = pickle.dumps(matcher, protocol=pickle.HIGHEST_PROTOCOL)
+                matcher_key = hashlib.sha256(payload).hexdigest()
+
+                def submit_all(executor):
+                    return {executor.submit(check_file_in_pool, path, matcher_key, payload, options['longest_only']):
+                            result_key for result_key, (path, _) in pending.items()}
+
+                executor = get_batch_executor()
+                try:
+                    futures = submit_all(executor)
+                except BrokenProcessPool:
+                    # 进程池在之前的请求中已损坏（例如工作进程被杀），换一个新的再提交
+                    discard_batch_executor(executor)
+                    executor = get_batch_executor()
+                    futures = submit_all(executor)
+                for future in as_completed(futures):
+                    result_key = futures[future]
+                    indexes = pending[result_key][1]
+                    try:
+                        occurrences = future.result()
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool):
+                            discard_batch_executor(executor)
+                        app.logger.error(f"Error processing file {entries[indexes[0]][0]} in batch: {e}")
+                        for index in indexes:
+                            results[index] = {'filename': entries[index][0], 'success': False,
+                                              'message': f'处理文件时出错: {str(e)}'}
+                        continue
+                    result_cache.put(result_key, occurrences)
+                    for index in indexes:
+                        results[index] = {'filename': entries[index][0], 'success': True,
+                                          'occurrences': occurrences, 'cached': False}
+            finally:
+                upload_admission.release(cost, time.perf_counter() - admitted)
+
+        # 按关键词汇总所有文件的匹配数
+        summary = {}
+        for result in results:
+            for occurrence in result.get('occurrences', ()):
+                summary[occurrence['keyword']] = summary.get(occurrence['keyword'], 0) + 1
+
+        return timed_jsonify({'success': True, 'checkType': options['check_type'], 'files': results,
+                              'summary': summary, 'totalOccurrences': sum(summary.values())})
+    except Exception as e:
+        app.logger.error(f"Error in batch_upload: {e}")
+        return jsonify({'success': False, 'message': f'批量检查时发生错误: {str(e)}'}), 500
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """获取文档缓存和结果缓存的命中统计"""
+    return jsonify({'success': True, 'documents': document_cache.stats(), 'results': result_cache.stats(),
+                    'groupedViews': grouped_views.stats(), 'documentHistory': document_history.stats()})
+
+
+@app.route('/api/upload/stats', methods=['GET'])
+def get_upload_stats():
+    """获取上传文件的缓冲统计（包括写入磁盘的字节数）和准入控制的当前状态"""
+    return jsonify({'success': True, 'uploads': upload_spool_stats.stats(), 'admission': upload_admission.stats()})
+
+
+@app.route('/api/server/stats', methods=['GET'])
+def get_server_stats():
+    """获取当前工作进程的冷启动耗时和内存占用，shared 为与 fork 前主进程仍共享的部分"""
+    return jsonify({'success': True, 'pid': os.getpid(), 'startup': startup_info, 'memory': process_memory()})
+
+
 # --- 地域名称管理 API ---
 
 @app.route('/api/regions', methods=['GET'])
@@ -385,18 +1525,18 @@ def add_region():
     if not new_region:
         return jsonify({'success': False, 'message': '地域名称不能为空'}), 400
 
-    regions = load_regions()
-    # 确保 regions 是一个列表
-    if regions is None:
-        regions = []
-    if new_region in regions:
+    # 通过名称索引检查，无需加载全部数据
+    if regions_store.contains(new_region):
         return jsonify({'success': False, 'message': '该地域名称已存在'}), 400
 
-    regions.append(new_region)
-    if save_regions(regions):
-        return jsonify({'success': True, 'message': '地域名称添加成功', 'region': new_region})
-    else:
+    try:
+        # 检查和插入在同一个事务中完成，并发添加同一名称时只有一个会成功
+        if not regions_store.add(DEFAULT_REGION_LEVEL, new_region, unique=True, create_level=True):
+            return jsonify({'success': False, 'message': '该地域名称已存在'}), 400
+    except sqlite3.Error as e:
+        app.logger.error(f"Error adding region: {e}")
         return jsonify({'success': False, 'message': '保存地域名称失败'}), 500
+    return jsonify({'success': True, 'message': '地域名称添加成功', 'region': new_region})
 
 
 @app.route('/api/regions/<region>', methods=['PUT'])
@@ -408,72 +1548,118 @@ def update_region(region):
     if not updated_region:
         return jsonify({'success': False, 'message': '新地域名称不能为空'}), 400
 
-    regions = load_regions()
-    # 确保 regions 是一个列表
-    if regions is None:
-        regions = []
-    if region not in regions:
+    if not regions_store.contains(region):
         return jsonify({'success': False, 'message': '要修改的地域名称不存在'}), 404
 
-    if updated_region in regions:
+    if regions_store.contains(updated_region):
         return jsonify({'success': False, 'message': '新地域名称已存在'}), 400
 
-    index = regions.index(region)
-    regions[index] = updated_region
-    if save_regions(regions):
-        return jsonify(
-            {'success': True, 'message': '地域名称修改成功', 'oldRegion': region, 'newRegion': updated_region})
-    else:
+    try:
+        renamed = regions_store.rename(region, updated_region)
+    except sqlite3.Error as e:
+        app.logger.error(f"Error updating region: {e}")
         return jsonify({'success': False, 'message': '保存地域名称失败'}), 500
+    if not renamed:
+        # 检查之后被其他请求抢先修改
+        return jsonify({'success': False, 'message': '地域名称已被修改，请刷新后重试'}), 409
+    return jsonify({'success': True, 'message': '地域名称修改成功', 'oldRegion': region, 'newRegion': updated_region})
 
 
 @app.route('/api/regions/<region>', methods=['DELETE'])
 def delete_region(region):
     """删除一个地域名称"""
-    regions = load_regions()
-    # 确保 regions 是一个列表
-    if regions is None:
-        regions = []
-    if region not in regions:
-        return jsonify({'success': False, 'message': '要删除的地域名称不存在'}), 404
-
-    regions.remove(region)
-    if save_regions(regions):
-        return jsonify({'success': True, 'message': '地域名称删除成功', 'region': region})
-    else:
+    try:
+        removed = regions_store.remove(region)
+    except sqlite3.Error as e:
+        app.logger.error(f"Error deleting region: {e}")
         return jsonify({'success': False, 'message': '保存地域名称失败'}), 500
+    if not removed:
+        return jsonify({'success': False, 'message': '要删除的地域名称不存在'}), 404
+    return jsonify({'success': True, 'message': '地域名称删除成功', 'region': region})
 
 
 @app.route('/api/regions/structured', methods=['GET'])
 def get_structured_regions():
     """获取结构化的地域名称"""
     regions = load_regions_structured()
-    return jsonify({'success': True, 'regions': regions})
+    return jsonify({'success': True, 'regions': regions, 'version': regions_store.version()})
+
+
+def request_password():
+    """从 JSON 或表单数据中获取管理密码"""
+    try:
+        data = request.get_json(silent=True)
+        if data is None:
+            return request.form.get('password', '')
+        return data.get('password', '')
+    except Exception:
+        return ''
+
+
+@app.route('/api/regions/export', methods=['GET'])
+def export_regions():
+    """以 china_regions.json 的格式下载全部地域名称"""
+    body = json.dumps(load_regions_structured(), ensure_ascii=False, indent=4)
+    return Response(body, mimetype='application/json',
+                    headers={'Content-Disposition': f'attachment; filename={REGIONS_FILE}',
+                             'X-Regions-Version': str(regions_store.version())})
+
+
+@app.route('/api/regions/import', methods=['POST'])
+def import_regions():
+    """
+    批量导入 china_regions.json 格式的地域名称，整个导入在一个事务中完成。
+    数据可以是 JSON 请求体中的 regions 字段，也可以是上传的 file 文件；
+    mode 为 replace（默认，替换全部数据）或 merge（与现有数据合并）。
+    """
+    if request_password() != REGIONS_ADMIN_PASSWORD:
+        return jsonify({'success': False, 'message': '密码错误'}), 403
+
+    data = request.get_json(silent=True)
+    if data is not None:
+        regions = data.get('regions')
+        mode = data.get('mode', 'replace')
+    else:
+        mode = request.form.get('mode', 'replace')
+        file = request.files.get('file')
+        if file is None:
+            return jsonify({'success': False, 'message': '没有提供地域数据'}), 400
+        try:
+            regions = json.load(file.stream)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            return jsonify({'success': False, 'message': f'地域数据不是有效的 JSON: {e}'}), 400
+    if mode not in ('replace', 'merge'):
+        return jsonify({'success': False, 'message': '无效的导入模式'}), 400
+
+    try:
+        added = regions_store.import_data(regions, replace=mode == 'replace')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except sqlite3.Error as e:
+        app.logger.error(f"Error importing regions: {e}")
+        return jsonify({'success': False, 'message': '导入地域名称失败'}), 500
+    return jsonify({'success': True, 'message': '地域名称导入成功', 'mode': mode, 'added': added,
+                    'total': regions_store.count(), 'version': regions_store.version()})
 
 
 @app.route('/api/regions/<level>', methods=['POST'])
 def add_region_by_level(level):
     """根据级别添加地域名称"""
     app.logger.info(f"Adding region to level: {level}")
-    
-    regions = load_regions_structured()
-    app.logger.info(f"Current regions: {regions}")
 
-    if level not in regions:
+    if not regions_store.has_level(level):
         app.logger.error(f"Invalid level: {level}")
         return jsonify({'success': False, 'message': '无效的级别'}), 400
 
     try:
         # 尝试多种方式获取数据
-        data = request.get_json(force=True)
+        data = request.get_json(force=True, silent=True)
         if data and 'name' in data:
             new_region = data['name']
         else:
             # 如果JSON解析失败或没有name字段，尝试从表单数据中获取
             new_region = request.form.get('name', '')
-        
-        app.logger.info(f"Raw received new region name: '{new_region}' (type: {type(new_region)})")
-        
+
         # 确保new_region是字符串类型
         new_region = str(new_region)
     except Exception as e:
@@ -488,100 +1674,87 @@ def add_region_by_level(level):
         app.logger.error("Empty region name provided")
         return jsonify({'success': False, 'message': '地域名称不能为空'}), 400
 
-    if new_region in regions[level]:
+    try:
+        # 唯一约束保证同一级别中不会出现重复名称，并发添加时只有一个会成功
+        added = regions_store.add(level, new_region)
+    except sqlite3.Error as e:
+        app.logger.error(f"Failed to save regions: {e}")
+        return jsonify({'success': False, 'message': '保存地域名称失败'}), 500
+    if not added:
         app.logger.error(f"Region '{new_region}' already exists in level '{level}'")
         return jsonify({'success': False, 'message': '该地域名称已存在'}), 400
 
-    regions[level].append(new_region)
-    app.logger.info(f"Added region '{new_region}' to level '{level}'. New list: {regions[level]}")
-
-    if save_regions(regions):
-        app.logger.info(f"Successfully saved regions. Returning region name: '{new_region}'")
-        return jsonify({'success': True, 'message': '地域名称添加成功', 'name': new_region})
-    else:
-        app.logger.error("Failed to save regions")
-        return jsonify({'success': False, 'message': '保存地域名称失败'}), 500
+    app.logger.info(f"Added region '{new_region}' to level '{level}'")
+    return jsonify({'success': True, 'message': '地域名称添加成功', 'name': new_region})
 
 
 @app.route('/api/regions/<level>/<name>', methods=['DELETE'])
 def delete_region_by_level(level, name):
     """根据级别删除地域名称"""
-    try:
-        # 尝试获取请求中的JSON数据
-        data = request.get_json()
-        if data is None:
-            # 如果没有JSON数据，尝试从表单数据中获取密码
-            password = request.form.get('password', '')
-        else:
-            password = data.get('password', '')
-    except:
-        password = ''
-
     # 验证密码
-    if password != '123456':
+    if request_password() != REGIONS_ADMIN_PASSWORD:
         return jsonify({'success': False, 'message': '密码错误'}), 403
 
     try:
-        regions = load_regions_structured()
-
-        if level not in regions:
+        if not regions_store.has_level(level):
             return jsonify({'success': False, 'message': '无效的级别'}), 400
 
-        if name not in regions[level]:
+        if not regions_store.remove(name, level):
             return jsonify({'success': False, 'message': '地域名称不存在'}), 404
 
-        regions[level].remove(name)
-
-        if save_regions(regions):
-            return jsonify({'success': True, 'message': '地域名称删除成功', 'name': name})
-        else:
-            return jsonify({'success': False, 'message': '保存地域名称失败'}), 500
+        return jsonify({'success': True, 'message': '地域名称删除成功', 'name': name})
     except Exception as e:
         app.logger.error(f"Error deleting region: {e}")
         return jsonify({'success': False, 'message': f'删除过程中发生错误: {str(e)}'}), 500
 
 
 def load_regions_structured():
-    """从 JSON 文件加载结构化的地域名称"""
-    if os.path.exists(REGIONS_FILE):
-        try:
-            with open(REGIONS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # 确保返回的是字典格式
-                if isinstance(data, dict):
-                    return data
-                else:
-                    app.logger.error(f"JSON file {REGIONS_FILE} format is invalid (not a dict).")
-                    return {"省级": [], "市级": [], "区级": []}
-        except (json.JSONDecodeError, IOError) as e:
-            app.logger.error(f"Error reading {REGIONS_FILE}: {e}")
-            return {"省级": [], "市级": [], "区级": []}
-    else:
-        # 如果文件不存在，创建一个带有默认数据的文件
-        default_regions = {
-            "省级": ["北京", "天津", "上海", "重庆", "香港", "澳门", "内蒙古", "广西", "西藏", "宁夏", "新疆",
-                     "河北", "山西", "辽宁", "吉林", "黑龙江", "江苏", "浙江", "安徽", "福建", "江西", "山东",
-                     "河南", "湖北", "湖南", "广东", "海南", "四川", "贵州", "云南", "陕西", "甘肃", "青海"],
-            "市级": ["石家庄", "唐山", "张家口", "太原", "沈阳", "大连", "辽阳", "长春", "松原", "延边",
-                     "哈尔滨", "齐齐哈尔", "南京", "无锡", "徐州", "常州", "苏州", "南通", "连云港", "淮安",
-                     "盐城", "扬州", "镇江", "泰州", "宿迁", "杭州", "宁波", "温州", "嘉兴", "湖州", "绍兴",
-                     "金华", "衢州", "舟山", "台州", "丽水", "合肥", "六安", "亳州", "福州", "厦门", "南昌",
-                     "赣州", "济南", "青岛", "淄博", "郑州", "开封", "洛阳", "焦作", "武汉", "黄石", "十堰",
-                     "宜昌", "襄阳", "鄂州", "荆门", "孝感", "荆州", "黄冈", "咸宁", "随州", "恩施", "仙桃",
-                     "潜江", "天门", "神农架林区", "长沙", "株洲", "湘潭", "岳阳", "广州", "深圳", "肇庆",
-                     "惠州", "梅州", "海口", "三亚", "成都", "甘孜", "凉山", "贵阳", "黔西南", "黔东南", "黔南",
-                     "昆明", "西安", "榆林", "兰州", "西宁"],
-            "区级": ["东城", "西城", "朝阳", "丰台", "石景山", "海淀", "门头沟", "房山", "通州", "顺义",
-                     "昌平", "大兴", "怀柔", "平谷", "密云", "延庆", "和平", "河东", "河西", "南开", "河北",
-                     "红桥", "东丽", "西青", "津南", "北辰", "武清", "宝坻", "滨海新", "宁河", "静海", "蓟州",
-                     "黄浦", "徐汇", "长宁", "静安", "普陀", "虹口", "杨浦", "闵行", "宝山", "嘉定", "浦东",
-                     "金山", "松江", "青浦", "奉贤", "崇明", "万州", "涪陵", "渝中", "大渡口", "江北", "沙坪坝",
-                     "九龙坡", "南岸", "北碚", "綦江", "大足", "渝北", "巴南", "黔江", "长寿", "江津", "合川",
-                     "永川", "南川", "璧山", "铜梁", "潼南", "荣昌", "开州", "梁平", "武隆", "城口", "丰都",
-                     "垫江", "忠县", "云阳", "奉节", "巫山", "巫溪"]
-        }
-        save_regions(default_regions)
-        return default_regions
+    """获取结构化的地域名称：{级别: [名称, ...]}"""
+    return regions_store.export_data()
+
+
+# --- 生产环境入口 ---
+
+def warm_up():
+    """加载地域索引并编译匹配器、编译页面模板，让第一个请求不再承担这些开销"""
+    index = regions_store.get()
+    # 冒烟测试：用前几个地域名称试跑一次匹配，确认索引和匹配器可用（并非遍历自动机的所有分支）
+    index.matcher.find_all(''.join(index.names[:100]))
+    app.jinja_env.get_template('index.html')
+    return index
+
+
+def create_app(started=None):
+    """
+    生产环境入口（见 wsgi.py 和 gunicorn.conf.py）：预热后返回 app。
+    应在多进程服务器 fork 工作进程之前调用（gunicorn 的 preload_app），
+    这样地域索引和匹配器只构建一次，由各工作进程以写时复制方式共享。
+    started 为进程开始导入应用时的 time.perf_counter()，用于计算冷启动耗时。
+    """
+    app.debug = False
+    # 在 gunicorn 下运行时沿用其日志配置
+    server_logger = logging.getLogger('gunicorn.error')
+    if server_logger.handlers:
+        app.logger.handlers = server_logger.handlers
+        app.logger.setLevel(server_logger.level)
+
+    warm_up_started = time.perf_counter()
+    index = warm_up()
+    finished = time.perf_counter()
+    startup_info['warmUpSeconds'] = round(finished - warm_up_started, 4)
+    startup_info['coldStartSeconds'] = round(finished - (started if started is not None else warm_up_started), 4)
+    startup_info['preloadedBy'] = os.getpid()
+    # 数据库连接不能跨 fork 使用，工作进程会各自重新连接
+    regions_store.close()
+    # 把预加载的对象移出垃圾回收的跟踪范围，避免工作进程中的 GC 改写这些对象所在的页面而破坏写时复制共享
+    gc.freeze()
+
+    memory = process_memory()
+    app.logger.info("CheckDoc ready in %.3fs (warm-up %.3fs, %d region names, %d region patterns), pid %d, "
+                    "rss %.1f MB", startup_info['coldStartSeconds'], startup_info['warmUpSeconds'], len(index.names),
+                    len(index.matcher.keywords), os.getpid(), (memory['rss'] or 0) / 1024 / 1024)
+    return app
+
 
 if __name__ == '__main__':
     app.run(debug=True, port=5003)#生产环境中请设置 debug=False
\ No newline at end of file
@@ -0,0 +1,363 @@
+# benchmark.py
+"""
+文本提取和关键词匹配流程的基准测试。
+按预设（或命令行参数）用 china_regions.json 中的地域名称生成合成 docx 语料，分别测量各阶段耗时、
+峰值内存和通过 Flask 测试客户端的 /upload 吞吐量，结果以 JSON 输出，可保存为基线并与之比较：
+
+    python benchmark.py                                   # 运行默认预设，结果输出到标准输出
+    python benchmark.py --preset medium --save-baseline benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json # 与基线比较，有退化时返回码为 1
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from xml.sax.saxutils import escape
+
+from checkdoc import (DEFAULT_REGIONS_FILE, DocxTextExtractor, KeywordMatcher, RegionsIndex, flatten_regions,
+                      group_occurrences)
+from divisions import load_divisions
+
+logger = logging.getLogger('benchmark')
+
+BASELINE_FORMAT_VERSION = 1
+
+# 语料预设：段落数、每段字符数、表格占块级元素的比例、每千字的关键词命中数
+PRESETS = {
+    'small': {'paragraphs': 500, 'paragraph_chars': 80, 'table_density': 0.05, 'hit_density': 5},
+    'medium': {'paragraphs': 5000, 'paragraph_chars': 120, 'table_density': 0.05, 'hit_density': 5},
+    'large': {'paragraphs': 50000, 'paragraph_chars': 120, 'table_density': 0.05, 'hit_density': 5},
+    'tables': {'paragraphs': 2000, 'paragraph_chars': 60, 'table_density': 0.5, 'hit_density': 5},
+    'dense': {'paragraphs': 5000, 'paragraph_chars': 120, 'table_density': 0.05, 'hit_density': 50},
+}
+DEFAULT_PRESETS = ('small', 'medium', 'tables')
+
+# 填充文本使用的常用汉字，不含地域名称中常见的字，避免产生意外的命中
+FILLER_CHARS = '的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会'
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>')
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>')
+SECTION_XML = ('<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+               '<w:pgMar w:top="1440" w:right="1800" w:bottom="1440" w:left="1800"/></w:sectPr>')
+
+
+def load_region_names(regions_file=DEFAULT_REGIONS_FILE):
+    """读取地域名称作为命中关键词，去掉“省级”等级别名称"""
+    with open(regions_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    levels = set(data) if isinstance(data, dict) else set()
+    return [name for name in flatten_regions(data) if name and name not in levels]
+
+
+def _random_text(rng, length, names, hit_density):
+    """生成约 length 个字符的文本，按每千字 hit_density 个的密度随机插入地域名称"""
+    text = ''.join(rng.choices(FILLER_CHARS, k=length))
+    expected = length * hit_density / 1000
+    hits = int(expected) + (rng.random() < expected - int(expected))
+    for _ in range(hits):
+        position = rng.randrange(len(text) + 1)
+        text = text[:position] + rng.choice(names) + text[position:]
+    return text
+
+
+def _paragraph_xml(text, rendered_break=False):
+    marker = '<w:lastRenderedPageBreak/>' if rendered_break else ''
+    return f'<w:p><w:r>{marker}<w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def generate_docx(target, paragraphs, paragraph_chars=100, table_density=0.05, hit_density=5,
+                  table_rows=5, table_cols=4, rendered_every=0, names=None, seed=0):
+    """
+    直接写出 WordprocessingML 生成合成 docx，不依赖 python-docx，大文档也能快速生成。
+    target 可以是路径或二进制文件对象；paragraphs 为正文段落数（不含表格），表格按 table_density 的比例穿插其中，
+    每个单元格一个短段落；rendered_every 大于 0 时每隔这么多段落插入一个 lastRenderedPageBreak 标记。
+    返回语料描述。
+    """
+    rng = random.Random(seed)
+    names = names or load_region_names()
+    tables = 0
+    chars = 0
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as docx_zip:
+        docx_zip.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        docx_zip.writestr('_rels/.rels', ROOT_RELS_XML)
+        with docx_zip.open('word/document.xml', 'w') as document:
+            document.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                           f'<w:document xmlns:w="{W_NS}"><w:body>'.encode('utf-8'))
+            for index in range(paragraphs):
+                text = _random_text(rng, paragraph_chars, names, hit_density)
+                chars += len(text)
+                rendered_break = rendered_every > 0 and index > 0 and index % rendered_every == 0
+                blocks = [_paragraph_xml(text, rendered_break)]
+                if rng.random() < table_density:
+                    tables += 1
+                    rows = []
+                    for _ in range(table_rows):
+                        cells = []
+                        for _ in range(table_cols):
+                            cell_text = _random_text(rng, 10, names, hit_density)
+                            chars += len(cell_text)
+                            cells.append(f'<w:tc>{_paragraph_xml(cell_text)}</w:tc>')
+                        rows.append(f'<w:tr>{"".join(cells)}</w:tr>')
+                    blocks.append(f'<w:tbl>{"".join(rows)}</w:tbl>')
+                document.write(''.join(blocks).encode('utf-8'))
+            document.write(f'{SECTION_XML}</w:body></w:document>'.encode('utf-8'))
+    return {'paragraphs': paragraphs, 'tables': tables, 'chars': chars, 'paragraphChars': paragraph_chars,
+            'tableDensity': table_density, 'hitDensity': hit_density, 'rendered': rendered_every > 0}
+
+
+def _median_time(func, repeat):
+    """运行 repeat 次，返回耗时中位数（秒）和最后一次的返回值"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def bench_pipeline(path, names, repeat):
+    """
+    分别测量提取各阶段、匹配器构建、匹配和分组的耗时，以及一次完整流程的峰值内存；
+    另外测量加入全国行政区划词典后地域索引的构建和匹配耗时
+    """
+    results = {}
+    stage_runs = {'parse': [], 'pagination': [], 'index': []}
+
+    def extract():
+        extractor = DocxTextExtractor(path)
+        for stage, seconds in extractor.stage_timings.items():
+            stage_runs[stage].append(seconds)
+        return extractor
+
+    results['extract_total_seconds'], extractor = _median_time(extract, repeat)
+    for stage, runs in stage_runs.items():
+        results[f'extract_{stage}_seconds'] = statistics.median(runs)
+
+    results['matcher_build_seconds'], matcher = _median_time(lambda: KeywordMatcher(names), repeat)
+    results['match_seconds'], occurrences = _median_time(
+        lambda: extractor.find_keyword_occurrences(matcher), repeat)
+    results['match_longest_seconds'], _ = _median_time(
+        lambda: extractor.find_keyword_occurrences(matcher, longest_only=True), repeat)
+    results['group_seconds'], _ = _median_time(lambda: group_occurrences(occurrences), repeat)
+    results['occurrences'] = len(occurrences)
+
+    divisions = load_divisions()
+    if divisions is not None:
+        results['regions_index_build_seconds'], index = _median_time(lambda: RegionsIndex(names, divisions), repeat)
+        results['regions_match_seconds'], region_occurrences = _median_time(
+            lambda: extractor.find_keyword_occurrences(index.matcher), repeat)
+        results['regions_patterns'] = len(index.matcher.keywords)
+        results['regions_occurrences'] = len(region_occurrences)
+
+    # 峰值内存单独测一次，tracemalloc 会拖慢执行，不与计时混在一起
+    tracemalloc.start()
+    try:
+        DocxTextExtractor(path).find_keyword_occurrences(matcher)
+        results['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def bench_upload(path, uploads):
+    """
+    通过 Flask 测试客户端测量 /upload 端到端吞吐量（文档数/秒）。
+    cold 在每次请求前清空文档和结果缓存，测量完整的解析和匹配；warm 测量命中结果缓存时的开销。
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    # app 按相对路径读取地域文件和上传目录，需要在仓库目录中运行，结束后恢复工作目录
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return _bench_upload(content, uploads)
+    finally:
+        os.chdir(cwd)
+
+
+def _bench_upload(content, uploads):
+    import app as webapp
+
+    client = webapp.app.test_client()
+
+    def post():
+        response = client.post('/upload', data={'file': (io.BytesIO(content), 'benchmark.docx'),
+                                                'checkType': 'china_regions'},
+                               content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f'/upload 返回 {response.status_code}: {response.get_data(as_text=True)[:200]}')
+
+    def clear_caches():
+        webapp.document_cache.invalidate(lambda key: True)
+        webapp.result_cache.invalidate(lambda key: True)
+
+    started = time.perf_counter()
+    for _ in range(uploads):
+        clear_caches()
+        post()
+    cold = uploads / (time.perf_counter() - started)
+
+    post()
+    started = time.perf_counter()
+    for _ in range(uploads):
+        post()
+    warm = uploads / (time.perf_counter() - started)
+    clear_caches()
+    return {'upload_cold_per_second': cold, 'upload_warm_per_second': warm,
+            'upload_bytes': len(content)}
+
+
+def run_suite(corpora, repeat=3, uploads=5, keep_dir=None, names=None):
+    """依次生成各语料并运行全部基准，返回可保存为基线的结果"""
+    names = names or load_region_names()
+    report = {
+        'formatVersion': BASELINE_FORMAT_VERSION,
+        'modelVersion': DocxTextExtractor.MODEL_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': repeat,
+        'uploads': uploads,
+        'corpora': {},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, options in corpora.items():
+            path = os.path.join(keep_dir or temp_dir, f'benchmark-{name}.docx')
+            logger.info(f'生成语料 {name}: {options}')
+            corpus = generate_docx(path, names=names, **options)
+            corpus['bytes'] = os.path.getsize(path)
+            report['corpora'][name] = corpus
+
+            logger.info(f'测量 {name} ...')
+            results = bench_pipeline(path, names, repeat)
+            if uploads > 0:
+                results.update(bench_upload(path, uploads))
+            report['results'][name] = results
+    return report
+
+
+def _is_metric(name):
+    return name.endswith(('_seconds', '_bytes', '_per_second')) and name != 'upload_bytes'
+
+
+def compare_reports(baseline, current, tolerance=0.25):
+    """
+    逐项比较当前结果与基线，返回 [(语料, 指标, 基线值, 当前值, 变化比例, 是否退化), ...]。
+    耗时和内存越低越好，吞吐量越高越好；变化比例为按“越大越差”换算后的 当前/基线 - 1。
+    """
+    rows = []
+    for corpus, metrics in current['results'].items():
+        base_metrics = baseline.get('results', {}).get(corpus)
+        if not base_metrics:
+            continue
+        for metric, value in sorted(metrics.items()):
+            base_value = base_metrics.get(metric)
+            if not _is_metric(metric) or not base_value or not value:
+                continue
+            if metric.endswith('_per_second'):
+                change = base_value / value - 1
+            else:
+                change = value / base_value - 1
+            rows.append((corpus, metric, base_value, value, change, change > tolerance))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='docx 文本提取和关键词匹配基准测试')
+    parser.add_argument('--preset', nargs='+', choices=sorted(PRESETS),
+                        help=f'运行的语料预设，默认为 {" ".join(DEFAULT_PRESETS)}')
+    parser.add_argument('--paragraphs', type=int, help='自定义语料的段落数（指定后只运行自定义语料）')
+    parser.add_argument('--paragraph-chars', type=int, default=100, help='自定义语料每段的字符数')
+    parser.add_argument('--table-density', type=float, default=0.05, help='自定义语料中表格占块级元素的比例')
+    parser.add_argument('--hit-density', type=float, default=5, help='自定义语料每千字的关键词命中数')
+    parser.add_argument('--rendered', action='store_true', help='在语料中插入 lastRenderedPageBreak 分页标记')
+    parser.add_argument('--repeat', type=int, default=3, help='每项计时的重复次数，取中位数')
+    parser.add_argument('--uploads', type=int, default=5, help='/upload 吞吐量测试的请求数，0 表示跳过')
+    parser.add_argument('--seed', type=int, default=0, help='语料生成的随机种子')
+    parser.add_argument('--keep-corpus', metavar='DIR', help='把生成的语料保存到该目录')
+    parser.add_argument('--output', metavar='FILE', help='结果写入该文件，默认输出到标准输出')
+    parser.add_argument('--save-baseline', metavar='FILE', help='把本次结果保存为基线')
+    parser.add_argument('--compare', metavar='FILE', help='与基线比较，有指标退化超过容差时返回码为 1')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允许的退化比例，默认 0.25（25%%）')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stderr)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    if args.paragraphs:
+        corpora = {'custom': {'paragraphs': args.paragraphs, 'paragraph_chars': args.paragraph_chars,
+                              'table_density': args.table_density, 'hit_density': args.hit_density}}
+    elif args.preset:
+        corpora = {name: dict(PRESETS[name]) for name in args.preset}
+    elif baseline is not None:
+        # 与基线比较时默认运行基线中包含的语料
+        corpora = {name: dict(PRESETS[name]) for name in baseline.get('results', {}) if name in PRESETS}
+    else:
+        corpora = {name: dict(PRESETS[name]) for name in DEFAULT_PRESETS}
+    for options in corpora.values():
+        options['seed'] = args.seed
+        options['rendered_every'] = 30 if args.rendered else 0
+    if args.keep_corpus:
+        os.makedirs(args.keep_corpus, exist_ok=True)
+
+    report = run_suite(corpora, repeat=max(args.repeat, 1), uploads=max(args.uploads, 0),
+                       keep_dir=os.path.abspath(args.keep_corpus) if args.keep_corpus else None)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        logger.info(f'基线已保存到 {args.save_baseline}')
+
+    if baseline is not None:
+        if baseline.get('modelVersion') != report['modelVersion']:
+            # 文档模型版本不同时解析的内容和方式可能不同，结果不一定可比
+            logger.warning(f'基线的文档模型版本为 {baseline.get("modelVersion")}，当前为 {report["modelVersion"]}，'
+                           f'比较结果仅供参考，建议用 --save-baseline 重新保存基线')
+        regressions = 0
+        for corpus, metric, base_value, value, change, regressed in compare_reports(baseline, report,
+                                                                                      args.tolerance):
+            regressions += regressed
+            logger.info(f'{"退化" if regressed else "正常"}  {corpus:<8} {metric:<28} '
+                        f'{base_value:.6g} -> {value:.6g} ({change:+.1%})')
+        if regressions:
+            logger.error(f'{regressions} 项指标退化超过 {args.tolerance:.0%}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2511 @@
+# checkdoc.py
+"""
+文档关键词检查的核心逻辑：docx 文本提取、多关键词匹配和地域名称索引。
+不依赖 Flask，可以作为普通 Python 库导入，也可以作为命令行工具离线批量扫描：
+
+    python checkdoc.py 目录或文件 ... [--keywords 北京，上海] [--per-file] [--checkpoint 文件]
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import pickle
+import posixpath
+import re
+import sqlite3
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from copy import deepcopy
+from xml.sax.saxutils import escape, quoteattr
+from lxml import etree
+
+from divisions import DEFAULT_DIVISIONS_FILE, load_divisions
+
+try:
+    import opencc
+except ImportError:  # opencc 为可选依赖，未安装时只使用内置的常用繁简字表
+    opencc = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'china_regions.json')
+# Web 应用的地域名称数据库，通过界面和接口所做的修改都保存在这里；china_regions.json 只是它的初始数据
+DEFAULT_REGIONS_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regions.db')
+
+
+def flatten_regions(data):
+    """把 JSON 中的地域数据展开为名称列表"""
+    # 如果是列表格式，直接返回
+    if isinstance(data, list):
+        return list(data)
+    regions = []
+    # 遍历所有省份
+    for province, cities in data.items():
+        regions.append(province)
+        # 如果城市是字典形式（包含区县），提取所有城市和区县
+        if isinstance(cities, dict):
+            for city, districts in cities.items():
+                regions.append(city)
+                if isinstance(districts, list):
+                    regions.extend(districts)
+        # 如果城市是列表形式（直接列出城市），添加所有城市
+        elif isinstance(cities, list):
+            regions.extend(cities)
+    return regions
+
+
+# --- 文本规范化 ---
+# 匹配在规范化后的文本上进行：全角字母和数字转为半角、繁体字转为简体字（逐字一一对应，不改变长度），
+# 并去掉空白字符（换行符除外，它是段落分隔符），这样“北 京”、“北　京”、“北京”的繁体写法都能匹配“北京”。
+# 常用繁体字（覆盖行政区划名称中的用字），与 SIMPLIFIED_CHARS 逐字对应；安装了 opencc 时再补充其完整字表
+TRADITIONAL_CHARS = (
+    '東門華廣灣遼寧龍蘇慶內貴雲陝肅莊張瀋連長邊爾濱齊無錫遷溫興紹麗廈贛濟島鄭陽漢黃荊'
+    '岡隨潛農區亞涼蘭豐澱頭溝順懷紅寶靜薊匯楊閔萬壩銅榮墊縣節鎮鄉維壯臺嶺嶼滬閩晉粵瓊'
+    '隴為與會國關陸鄰濰煙臨棗萊蕪銀紮烏魯衛鶴雞綏撫蘆錦營鐵盤雙馬饒聖頂許峽駐婁遠欽賀'
+    '來賓綿瀘樂達資義畢滄納薩則吳瑪倫彥鴨鄲運呂蒼滿廳歸鹽揚陰蔣湯鳳軍團場園灘橋嶽澤濤'
+    '蓮廟禮縉麥醫廠車學兩條號總衝這個們時說對發後過還從動種樣現經開問進點實體當聲產論'
+    '親將議書見話機氣業員電記變題權報質計認調據術處備務復陳劉趙錢孫鄧葉蕭羅鄒謝韓馮譚'
+    '盧龔顧於裡裏')
+SIMPLIFIED_CHARS = (
+    '东门华广湾辽宁龙苏庆内贵云陕肃庄张沈连长边尔滨齐无锡迁温兴绍丽厦赣济岛郑阳汉黄荆'
+    '冈随潜农区亚凉兰丰淀头沟顺怀红宝静蓟汇杨闵万坝铜荣垫县节镇乡维壮台岭屿沪闽晋粤琼'
+    '陇为与会国关陆邻潍烟临枣莱芜银扎乌鲁卫鹤鸡绥抚芦锦营铁盘双马饶圣顶许峡驻娄远钦贺'
+    '来宾绵泸乐达资义毕沧纳萨则吴玛伦彦鸭郸运吕苍满厅归盐扬阴蒋汤凤军团场园滩桥岳泽涛'
+    '莲庙礼缙麦医厂车学两条号总冲这个们时说对发后过还从动种样现经开问进点实体当声产论'
+    '亲将议书见话机气业员电记变题权报质计认调据术处备务复陈刘赵钱孙邓叶萧罗邹谢韩冯谭'
+    '卢龚顾于里里')
+# 规范化时删除的空白字符，包括全角空格、不换行空格和零宽字符
+IGNORED_CHARS = ' \t\r\u00a0\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u200b\u200c\u200d\u202f\u205f\u3000\ufeff'
+IGNORED_RE = re.compile('[' + IGNORED_CHARS + ']+')
+
+
+def _build_normalize_table():
+    """str.translate 使用的字符映射表：全角转半角、繁体转简体"""
+    # 全角标点在中文文档中随处可见，且不影响关键词匹配，保持不变以免无谓地改写文本
+    table = {code: code - 0xFEE0 for code in (*range(0xFF10, 0xFF1A), *range(0xFF21, 0xFF3B), *range(0xFF41, 0xFF5B))}
+    table.update(zip(map(ord, TRADITIONAL_CHARS), map(ord, SIMPLIFIED_CHARS)))
+    if opencc is not None:
+        try:
+            converter = opencc.OpenCC('t2s')
+            chars = [chr(code) for code in range(0x4E00, 0xA000)]
+            # 逐字转换（以换行分隔，避免按词组转换），只保留一对一的结果
+            for char, converted in zip(chars, converter.convert('\n'.join(chars)).split('\n')):
+                if len(converted) == 1 and converted != char:
+                    table[ord(char)] = ord(converted)
+        except Exception as e:
+            logger.warning(f"opencc conversion table unavailable: {e}")
+    return table
+
+
+NORMALIZE_TABLE = _build_normalize_table()
+
+
+def _char_class(codes):
+    """把字符码集合写成正则字符类的内容，连续的字符合并为区间"""
+    ranges = []
+    for code in sorted(codes):
+        if ranges and ranges[-1][1] == code - 1:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    return ''.join(re.escape(chr(first)) if first == last else f'{re.escape(chr(first))}-{re.escape(chr(last))}'
+                   for first, last in ranges)
+
+
+# 规范化时需要改动的字符（需要替换的和需要删除的），规范化只处理与之匹配的片段，其余文本原样保留
+CHANGED_RE = re.compile('[' + IGNORED_CHARS + _char_class(NORMALIZE_TABLE) + ']+')
+
+
+def normalize_text(text):
+    """规范化一个字符串（用于关键词），规则与 NormalizedText 相同"""
+    return IGNORED_RE.sub('', text.translate(NORMALIZE_TABLE))
+
+
+class NormalizedText:
+    """
+    规范化后的文本缓冲区，以及它与原文之间的偏移映射。
+    字符替换不改变长度，只有删除的空白会造成偏移；映射只记录每段被删除的空白之后的位置和累计删除的字符数，
+    大小与空白段数成正比，换算时二分查找。原文不需要规范化时 text 就是原文本身，不占额外内存。
+    """
+
+    def __init__(self, text):
+        # breaks[i] 为第 i 段空白之后第一个字符在规范化文本中的位置，shifts[i] 为到此为止累计删除的字符数
+        self.breaks = array('I')
+        self.shifts = array('I')
+        pieces = []
+        last = 0
+        removed = 0
+        # 一次线性扫描：只有需要改动的片段才逐段替换字符、删除空白
+        for match in CHANGED_RE.finditer(text):
+            start, end = match.span()
+            segment = match.group()
+            pieces.append(text[last:start])
+            last = end
+            kept = 0
+            for run in IGNORED_RE.finditer(segment):
+                pieces.append(segment[kept:run.start()].translate(NORMALIZE_TABLE))
+                self.breaks.append(start + run.start() - removed)
+                removed += run.end() - run.start()
+                self.shifts.append(removed)
+                kept = run.end()
+            pieces.append(segment[kept:].translate(NORMALIZE_TABLE))
+        if pieces:
+            pieces.append(text[last:])
+            self.text = ''.join(pieces)
+        else:
+            self.text = text
+
+    def to_original(self, pos):
+        """规范化文本中的位置 -> 原文中的位置"""
+        index = bisect_right(self.breaks, pos) - 1
+        return pos + self.shifts[index] if index >= 0 else pos
+
+    def to_normalized(self, pos):
+        """原文中的位置 -> 规范化文本中的位置；位于被删除的空白中时取其后第一个字符的位置"""
+        if not self.breaks:
+            return pos
+        # 原文中第 i 段空白之后的位置为 breaks[i] + shifts[i]，按此二分查找
+        low, high = 0, len(self.breaks)
+        while low < high:
+            mid = (low + high) // 2
+            if self.breaks[mid] + self.shifts[mid] <= pos:
+                low = mid + 1
+            else:
+                high = mid
+        index = low - 1
+        normalized = pos - self.shifts[index] if index >= 0 else pos
+        if index + 1 < len(self.breaks):
+            normalized = min(normalized, self.breaks[index + 1])
+        return normalized
+
+    def original_span(self, start, length):
+        """规范化文本中 [start, start + length) 对应的原文范围 (起始位置, 结束位置)"""
+        return self.to_original(start), self.to_original(start + length - 1) + 1
+
+
+class KeywordMatcher:
+    """
+    基于 Aho-Corasick 自动机的多关键词匹配器，一次线性扫描即可找出所有关键词。
+    自动机由规范化后的关键词（见 normalize_text）构建，应在同样规范化的文本（NormalizedText）上扫描；
+    报告的位置和长度都以规范化文本为准，keywords 保留原始写法。
+    annotations 为 {关键词: 附加字段字典}，匹配项生成时合并进去（例如地域检查中命中的行政区划）。
+
+    全部转移存放在一个以 状态 * 字母表大小 + 字符编码 为键的字典中，失败指针和输出链存放在整数数组中，
+    不为每个状态创建字典和输出列表：几千个关键词的自动机只占 1 MB 左右，构建只需几十毫秒，
+    扫描的耗时与关键词数量基本无关。
+    """
+
+    def __init__(self, keywords, annotations=None):
+        # 去除首尾空白、空串和重复项（规范化后相同的视为重复），保留关键词首次出现的顺序
+        self.keywords = []
+        self.patterns = []
+        seen = set()
+        for kw in keywords:
+            kw = kw.strip()
+            pattern = normalize_text(kw)
+            if pattern and pattern not in seen:
+                seen.add(pattern)
+                self.keywords.append(kw)
+                self.patterns.append(pattern)
+        self.annotations = [annotations.get(kw) for kw in self.keywords] if annotations else None
+        self.fingerprint = None  # 由 keywords_fingerprint 计算后缓存
+        self._build()
+
+    def _build(self):
+        """插入所有关键词构建 trie，再按深度逐层计算失败指针和输出链"""
+        patterns = self.patterns
+        # 字符编码从 1 开始；状态 s 经编码 c 的转移存放在 goto[s * width + c]
+        self._codes = codes = {char: index + 1 for index, char in enumerate(sorted(set(''.join(patterns))))}
+        self._width = width = len(codes) + 1
+        goto = {}
+        terminal = array('i', [-1])
+        levels = []  # levels[d] 为深度 d + 1 的状态的 (父状态, 字符编码, 状态)
+        for kw_index, pattern in enumerate(patterns):
+            state = 0
+            for depth, char in enumerate(pattern):
+                code = codes[char]
+                key = state * width + code
+                next_state = goto.get(key)
+                if next_state is None:
+                    next_state = goto[key] = len(terminal)
+                    terminal.append(-1)
+                    if depth == len(levels):
+                        levels.append([])
+                    levels[depth].append((state, code, next_state))
+                state = next_state
+            terminal[state] = kw_index
+
+        # fail[s] 为 s 的最长真后缀状态；link[s] 为失败链上最近的有关键词结束的状态，0 表示没有
+        count = len(terminal)
+        fail = array('i', bytes(4 * count))
+        link = array('i', bytes(4 * count))
+        emits = bytearray(count)
+        for edges in levels:
+            for state, code, next_state in edges:
+                target = 0
+                fallback = fail[state] if state else -1
+                while fallback >= 0:
+                    target = goto.get(fallback * width + code)
+                    if target is not None:
+                        break
+                    target = 0
+                    fallback = fail[fallback] if fallback else -1
+                fail[next_state] = target
+                link[next_state] = target if terminal[target] >= 0 else link[target]
+                emits[next_state] = terminal[next_state] >= 0 or link[next_state] > 0
+        self._goto, self._fail = goto, fail
+        self._terminal, self._link, self._emits = terminal, link, emits
+        # 根状态的转移另按字符存放：扫描时大部分位置处于根状态，一次查找即可，与字母表覆盖多少常用字无关
+        self._root = {char: goto[code] for char, code in codes.items() if code in goto}
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+    def scan(self, text, start=0, end=None, state=0):
+        """
+        扫描 text[start:end]，返回 ([(起始位置, 关键词序号), ...], 结束时的自动机状态)，包含相互重叠的匹配。
+        把返回的状态传给下一次调用即可分段连续扫描，跨段的匹配不会丢失。
+        """
+        root = self._root
+        codes = self._codes
+        width = self._width
+        goto = self._goto
+        fail = self._fail
+        terminal = self._terminal
+        link = self._link
+        emits = self._emits
+        patterns = self.patterns
+        matches = []
+        if end is None:
+            end = len(text)
+        for pos in range(start, end):
+            char = text[pos]
+            if not state:
+                state = root.get(char, 0)
+                if not state:
+                    continue
+            else:
+                code = codes.get(char)
+                if code is None:
+                    # 不出现在任何关键词中的字符：直接回到根状态
+                    state = 0
+                    continue
+                while True:
+                    next_state = goto.get(state * width + code)
+                    if next_state is not None:
+                        state = next_state
+                        break
+                    state = fail[state]
+                    if not state:
+                        state = root.get(char, 0)
+                        break
+            if emits[state]:
+                # 先报告在当前状态结束的关键词，再沿输出链报告更短的后缀关键词
+                output = state if terminal[state] >= 0 else link[state]
+                while output:
+                    kw_index = terminal[output]
+                    matches.append((pos - len(patterns[kw_index]) + 1, kw_index))
+                    output = link[output]
+        return matches, state
+
+    def select_longest(self, matches):
+        """最左最长选择：被更长关键词覆盖的子匹配不再报告，例如匹配到“石景山”后不再报告其中的“景山”"""
+        longest_at = {}
+        for start, kw_index in matches:
+            current = longest_at.get(start)
+            if current is None or len(self.patterns[kw_index]) > len(self.patterns[current]):
+                longest_at[start] = kw_index
+        selected = []
+        covered_until = 0
+        for start in sorted(longest_at):
+            if start >= covered_until:
+                kw_index = longest_at[start]
+                selected.append((start, kw_index))
+                covered_until = start + len(self.patterns[kw_index])
+        return selected
+
+    def find_all(self, text, longest_only=False):
+        """
+        返回按 (关键词顺序, 位置) 排序的 (起始位置, 关键词序号) 列表。
+        longest_only 为 True 时只保留最左最长匹配。
+        """
+        matches, _ = self.scan(text)
+        if longest_only:
+            matches = self.select_longest(matches)
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+
+
+# WordprocessingML 命名空间及常用标签
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_DOCUMENT = f'{{{W_NS}}}document'
+W_BODY = f'{{{W_NS}}}body'
+W_HDR = f'{{{W_NS}}}hdr'
+W_FTR = f'{{{W_NS}}}ftr'
+W_FOOTNOTE = f'{{{W_NS}}}footnote'
+W_ENDNOTE = f'{{{W_NS}}}endnote'
+W_P = f'{{{W_NS}}}p'
+W_R = f'{{{W_NS}}}r'
+W_T = f'{{{W_NS}}}t'
+W_TAB = f'{{{W_NS}}}tab'
+W_PTAB = f'{{{W_NS}}}ptab'
+W_BR = f'{{{W_NS}}}br'
+W_CR = f'{{{W_NS}}}cr'
+W_NO_BREAK_HYPHEN = f'{{{W_NS}}}noBreakHyphen'
+W_HYPERLINK = f'{{{W_NS}}}hyperlink'
+W_LAST_RENDERED_PAGE_BREAK = f'{{{W_NS}}}lastRenderedPageBreak'
+W_TBL = f'{{{W_NS}}}tbl'
+W_TR = f'{{{W_NS}}}tr'
+W_TC = f'{{{W_NS}}}tc'
+W_SDT = f'{{{W_NS}}}sdt'
+W_SDT_CONTENT = f'{{{W_NS}}}sdtContent'
+W_TXBX_CONTENT = f'{{{W_NS}}}txbxContent'
+W_FOOTNOTE_REFERENCE = f'{{{W_NS}}}footnoteReference'
+W_ENDNOTE_REFERENCE = f'{{{W_NS}}}endnoteReference'
+W_TYPE = f'{{{W_NS}}}type'
+W_ID = f'{{{W_NS}}}id'
+W_VAL = f'{{{W_NS}}}val'
+W_PPR = f'{{{W_NS}}}pPr'
+W_RPR = f'{{{W_NS}}}rPr'
+W_PSTYLE = f'{{{W_NS}}}pStyle'
+W_SPACING = f'{{{W_NS}}}spacing'
+W_SZ = f'{{{W_NS}}}sz'
+W_PAGE_BREAK_BEFORE = f'{{{W_NS}}}pageBreakBefore'
+W_SECT_PR = f'{{{W_NS}}}sectPr'
+W_PG_SZ = f'{{{W_NS}}}pgSz'
+W_PG_MAR = f'{{{W_NS}}}pgMar'
+W_STYLE = f'{{{W_NS}}}style'
+W_STYLE_ID = f'{{{W_NS}}}styleId'
+W_BASED_ON = f'{{{W_NS}}}basedOn'
+W_DEFAULT = f'{{{W_NS}}}default'
+W_DOC_DEFAULTS = f'{{{W_NS}}}docDefaults'
+W_RPR_DEFAULT = f'{{{W_NS}}}rPrDefault'
+W_PPR_DEFAULT = f'{{{W_NS}}}pPrDefault'
+W_HIGHLIGHT = f'{{{W_NS}}}highlight'
+W_COMMENTS = f'{{{W_NS}}}comments'
+W_COMMENT = f'{{{W_NS}}}comment'
+W_COMMENT_RANGE_START = f'{{{W_NS}}}commentRangeStart'
+W_COMMENT_RANGE_END = f'{{{W_NS}}}commentRangeEnd'
+W_COMMENT_REFERENCE = f'{{{W_NS}}}commentReference'
+W_AUTHOR = f'{{{W_NS}}}author'
+W_DATE = f'{{{W_NS}}}date'
+W_INITIALS = f'{{{W_NS}}}initials'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+OFFICE_DOCUMENT_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+RELATIONSHIP_TYPE_PREFIX = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+CONTENT_TYPES_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
+
+# 文档部件类型：正文（含表格）、页眉、页脚、脚注、尾注；文本框算作其所在部件的一部分
+PART_BODY, PART_HEADER, PART_FOOTER, PART_FOOTNOTE, PART_ENDNOTE = range(5)
+PART_NAMES = ('body', 'header', 'footer', 'footnote', 'endnote')
+# 各部件 XML 中直接包含段落和表格的容器元素
+PART_CONTAINERS = {
+    PART_BODY: (W_BODY,),
+    PART_HEADER: (W_HDR,),
+    PART_FOOTER: (W_FTR,),
+    PART_FOOTNOTE: (W_FOOTNOTE,),
+    PART_ENDNOTE: (W_ENDNOTE,),
+}
+# 正文末尾的 w:sectPr 是最后一节的页面设置，与段落、表格一样作为块级元素产出
+BLOCK_TAGS = (W_P, W_TBL, W_SDT, W_SECT_PR)
+# 主文档关系中需要解析的部件类型，按此顺序依次解析
+RELATED_PART_KINDS = (('header', PART_HEADER), ('footer', PART_FOOTER), ('footnotes', PART_FOOTNOTE),
+                      ('endnotes', PART_ENDNOTE))
+NO_CELL = (-1, -1, -1)  # 不在表格中的段落的 (表格, 行, 单元格)
+# 脚注/尾注中的分隔符等特殊条目，不是正文内容
+SPECIAL_NOTE_TYPES = {'separator', 'continuationSeparator', 'continuationNotice'}
+# 标记 “正文流” 中的段落：参与分页估算，其余段落通过锚点借用正文段落的页码
+FLOW = object()
+# 单倍行距的行高与字号之比（中文字体的单倍行距约为字号的 1.3 倍）
+LINE_HEIGHT_FACTOR = 1.3
+# 查询模式：all 报告全部匹配项；exists 只判断有没有匹配；counts 只统计各关键词的匹配数，不生成上下文和页码；
+# first_n 只报告按文档顺序排在最前的 N 个匹配项。exists 和 first_n 找够结果即停止匹配
+MODE_ALL, MODE_EXISTS, MODE_COUNTS, MODE_FIRST_N = 'all', 'exists', 'counts', 'first_n'
+QUERY_MODES = (MODE_ALL, MODE_EXISTS, MODE_COUNTS, MODE_FIRST_N)
+DEFAULT_FIRST_N = 10
+QUICK_SCAN_CHUNK_CHARS = 64 * 1024  # 流式统计（counts）每累积这么多字符的段落匹配一次
+QUICK_FIND_CHUNK_CHARS = 4 * 1024  # 流式 exists/first_n 每累积这么多字符的段落匹配一次，找够即停止解析
+# 流式快速查询不计算分页，匹配项的 pageConfidence 为此值（page 为 None）
+PAGE_UNKNOWN = 'unknown'
+# 标注文档：批注作者及其缩写、匹配的高亮颜色，以及新建批注部件的内容类型
+ANNOTATION_AUTHOR = 'CheckDoc'
+ANNOTATION_INITIALS = 'CD'
+ANNOTATION_HIGHLIGHT = 'yellow'
+COMMENTS_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.comments+xml'
+# w:rPr 中排在 w:highlight 之后的子元素：OOXML 规定了 w:rPr 子元素的顺序，Word 不接受乱序的文档
+RPR_AFTER_HIGHLIGHT = frozenset(f'{{{W_NS}}}{name}' for name in (
+    'u', 'effect', 'bdr', 'shd', 'fitText', 'vertAlign', 'rtl', 'cs', 'em', 'lang', 'eastAsianLayout',
+    'specVanish', 'oMath', 'rPrChange'))
+ANNOTATION_WRITE_BUFFER = 1024 * 1024  # 重写主文档时输出缓冲区的大小
+ANNOTATION_COMPRESS_LEVEL = 1  # 标注文档的压缩级别：级别 1 比默认的 6 快数倍，文件只大约三成
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+
+
+def _find_main_document_part(docx_zip):
+    """通过 _rels/.rels 找到主文档部件路径，找不到时退回 word/document.xml"""
+    try:
+        with docx_zip.open('_rels/.rels') as rels_file:
+            for rel in etree.parse(rels_file).getroot().iter(f'{{{REL_NS}}}Relationship'):
+                if rel.get('Type') == OFFICE_DOCUMENT_REL_TYPE:
+                    return rel.get('Target', '').lstrip('/')
+    except (KeyError, etree.XMLSyntaxError):
+        pass
+    return 'word/document.xml'
+
+
+def _relationships_path(part):
+    """部件的关系文件路径，例如 word/document.xml -> word/_rels/document.xml.rels"""
+    return posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+
+
+def _find_relationships(docx_zip, main_part):
+    """读取主文档的关系文件，返回 {关系类型: [部件路径, ...]}，例如 header、footer、footnotes、styles"""
+    part_dir = posixpath.dirname(main_part)
+    rels_path = _relationships_path(main_part)
+    related = {}
+    try:
+        with docx_zip.open(rels_path) as rels_file:
+            for rel in etree.parse(rels_file).getroot().iter(f'{{{REL_NS}}}Relationship'):
+                rel_type = rel.get('Type', '')
+                if not rel_type.startswith(RELATIONSHIP_TYPE_PREFIX) or rel.get('TargetMode') == 'External':
+                    continue
+                kind = rel_type[len(RELATIONSHIP_TYPE_PREFIX):]
+                target = rel.get('Target', '')
+                path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(
+                    posixpath.join(part_dir, target))
+                related.setdefault(kind, []).append(path)
+    except (KeyError, etree.XMLSyntaxError):
+        pass
+    return {kind: sorted(paths) for kind, paths in related.items()}
+
+
+def _document_parts(main_part, related):
+    """需要提取文本的部件 [(部件类型, 路径), ...]：主文档在前，其后依次为页眉、页脚、脚注和尾注"""
+    parts = [(PART_BODY, main_part)]
+    for kind, part in RELATED_PART_KINDS:
+        parts.extend((part, path) for path in related.get(kind, ()))
+    return parts
+
+
+def _iter_part_blocks(xml_file, containers):
+    """
+    流式解析一个部件，依次产出 (容器元素, 块级元素)，块级元素为容器的直接子级段落、表格或内容控件。
+    调用方处理完一个块后它就会被清除，内存占用不随部件大小增长。
+    """
+    for _, element in etree.iterparse(xml_file, events=('end',), tag=BLOCK_TAGS + containers, huge_tree=True):
+        parent = element.getparent()
+        if element.tag in containers:
+            # 容器（例如一条脚注）处理完毕，同样清除
+            element.clear()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+            continue
+        if parent is None or parent.tag not in containers:
+            continue
+        yield parent, element
+        element.clear()
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def _run_text(run):
+    """与 python-docx 的 Run.text 规则一致地提取 w:r 的文本"""
+    parts = []
+    for child in run:
+        tag = child.tag
+        if tag == W_T:
+            parts.append(child.text or '')
+        elif tag == W_TAB or tag == W_PTAB:
+            parts.append('\t')
+        elif tag == W_BR:
+            # 只有换行符（textWrapping，默认值）对应 "\n"，分页/分栏符不产生文本
+            if child.get(W_TYPE, 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        elif tag == W_CR:
+            parts.append('\n')
+        elif tag == W_NO_BREAK_HYPHEN:
+            parts.append('-')
+    return ''.join(parts)
+
+
+def _paragraph_text(paragraph):
+    """与 python-docx 的 Paragraph.text 规则一致：只取直接子级 w:r 和 w:hyperlink 中的 w:r"""
+    parts = []
+    for child in paragraph:
+        if child.tag == W_R:
+            parts.append(_run_text(child))
+        elif child.tag == W_HYPERLINK:
+            parts.extend(_run_text(run) for run in child if run.tag == W_R)
+    return ''.join(parts)
+
+
+def _scan_nested(element, seen_text, breaks, textboxes, note_refs):
+    """
+    _scan_paragraph 的辅助函数：扫描段落中不产生文本的子树（绘图、修订、域等），返回更新后的 seen_text。
+    文本框内容只记录下来、不深入：其中的文字、分页标记和脚注引用属于文本框自己的段落，不计入所在段落；
+    兼容性回退内容（mc:Fallback）与主内容重复，整个跳过。
+    """
+    stack = [element]
+    while stack:
+        node = stack.pop()
+        tag = node.tag
+        if tag == W_TXBX_CONTENT:
+            textboxes.append(node)
+            continue
+        if tag == MC_FALLBACK:
+            continue
+        if tag == W_T:
+            if node.text:
+                seen_text = True
+        elif tag == W_BR:
+            if node.get(W_TYPE) == 'page':
+                breaks[seen_text] += 1
+        elif tag == W_LAST_RENDERED_PAGE_BREAK:
+            breaks[2 + seen_text] += 1
+        elif tag == W_FOOTNOTE_REFERENCE:
+            note_refs.append((PART_FOOTNOTE, node.get(W_ID)))
+        elif tag == W_ENDNOTE_REFERENCE:
+            note_refs.append((PART_ENDNOTE, node.get(W_ID)))
+        elif len(node):
+            stack.extend(reversed(node.getchildren()))
+    return seen_text
+
+
+def _scan_paragraph(paragraph):
+    """
+    一次遍历段落子树，返回 (文本, 直接格式, 分页标记, 文本框内容列表, 脚注/尾注引用列表)。
+    文本与 _paragraph_text 一致；直接格式为 (样式 ID, w:spacing, 首个设置了字号的文本块的 w:sz, 是否段前分页,
+    段落中的 w:sectPr)。分页标记为 (文字前的显式分页符数, 文字后的显式分页符数, 文字前的 lastRenderedPageBreak 数,
+    文字后的 lastRenderedPageBreak 数)：文字前的分页让段落本身落在新页，文字后的分页让后续段落落在新页；
+    文本框中的分页标记不计入所在段落。每个段落都要调用一次，这里把文本、格式和分页标记合并在同一次遍历中读取，每个元素只访问一次。
+    lxml 为 for 循环创建子元素迭代器的开销比元素本身还大，热点循环里都用 getchildren() 直接取子元素列表。
+    """
+    parts = []
+    style_id = spacing = size = sect_pr = None
+    page_break_before = False
+    breaks = [0, 0, 0, 0]
+    seen_text = False
+    textboxes = []
+    note_refs = []
+    for child in paragraph.getchildren():
+        tag = child.tag
+        if tag == W_R or tag == W_HYPERLINK:
+            for run in ((child,) if tag == W_R else child.getchildren()):
+                if run.tag != W_R:
+                    seen_text = _scan_nested(run, seen_text, breaks, textboxes, note_refs)
+                    continue
+                for item in run.getchildren():
+                    item_tag = item.tag
+                    if item_tag == W_T:
+                        text = item.text
+                        if text:
+                            parts.append(text)
+                            seen_text = True
+                    elif item_tag == W_RPR:
+                        if size is None and tag == W_R:
+                            for prop in item.getchildren():
+                                if prop.tag == W_SZ:
+                                    size = prop
+                                    break
+                    elif item_tag == W_TAB or item_tag == W_PTAB:
+                        parts.append('\t')
+                    elif item_tag == W_BR:
+                        # 只有换行符（textWrapping，默认值）对应 "\n"，分页/分栏符不产生文本
+                        break_type = item.get(W_TYPE)
+                        if break_type is None or break_type == 'textWrapping':
+                            parts.append('\n')
+                        elif break_type == 'page':
+                            breaks[seen_text] += 1
+                    elif item_tag == W_CR:
+                        parts.append('\n')
+                    elif item_tag == W_NO_BREAK_HYPHEN:
+                        parts.append('-')
+                    else:
+                        seen_text = _scan_nested(item, seen_text, breaks, textboxes, note_refs)
+        elif tag == W_PPR:
+            for prop in child.getchildren():
+                prop_tag = prop.tag
+                if prop_tag == W_PSTYLE:
+                    style_id = prop.get(W_VAL)
+                elif prop_tag == W_SPACING:
+                    spacing = prop
+                elif prop_tag == W_PAGE_BREAK_BEFORE:
+                    page_break_before = _is_on(prop)
+                elif prop_tag == W_SECT_PR:
+                    sect_pr = prop
+        else:
+            seen_text = _scan_nested(child, seen_text, breaks, textboxes, note_refs)
+    return (''.join(parts), (style_id, spacing, size, page_break_before, sect_pr), tuple(breaks), textboxes,
+            note_refs)
+
+
+def _int_attr(element, name, default):
+    """读取整数属性，缺失或格式不对时返回默认值"""
+    value = element.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def _is_on(element):
+    """OOXML 开关属性：元素存在且 w:val 不是 0/false/off 时为开"""
+    return element is not None and element.get(W_VAL, 'true') not in ('0', 'false', 'off')
+
+
+def _apply_format(fmt, size, spacing):
+    """在 (字号半磅, 行距, 行距规则, 段前, 段后) 上叠加 w:sz 和 w:spacing 的设置"""
+    font_size, line, line_rule, before, after = fmt
+    if size is not None:
+        font_size = _int_attr(size, W_VAL, font_size)
+    if spacing is not None:
+        if spacing.get(f'{{{W_NS}}}line') is not None:
+            line = _int_attr(spacing, f'{{{W_NS}}}line', line)
+            line_rule = spacing.get(f'{{{W_NS}}}lineRule', 'auto')
+        before = _int_attr(spacing, f'{{{W_NS}}}before', before)
+        after = _int_attr(spacing, f'{{{W_NS}}}after', after)
+    return font_size, line, line_rule, before, after
+
+
+def _line_metrics(fmt):
+    """把格式换算为 (字号, 行高, 段前段后间距)，单位为磅"""
+    font_size, line, line_rule, before, after = fmt
+    font_pt = max(font_size, 2) / 2
+    natural = font_pt * LINE_HEIGHT_FACTOR
+    if line_rule == 'exact':
+        line_pt = line / 20
+    elif line_rule == 'atLeast':
+        line_pt = max(line / 20, natural)
+    else:
+        line_pt = natural * line / 240
+    return font_pt, max(line_pt, 1.0), max(before + after, 0) / 20
+
+
+def _section_geometry(sect_pr):
+    """从 w:sectPr 读取 (起始方式, 版心宽度, 版心高度)，单位为磅；未设置的项按 A4 纸和 Word 默认页边距"""
+    start = 'nextPage'
+    width, height = 11906, 16838
+    top = bottom = 1440
+    left = right = 1800
+    if sect_pr is not None:
+        section_type = sect_pr.find(W_TYPE)
+        if section_type is not None:
+            start = section_type.get(W_VAL, start)
+        size = sect_pr.find(W_PG_SZ)
+        if size is not None:
+            width = _int_attr(size, f'{{{W_NS}}}w', width)
+            height = _int_attr(size, f'{{{W_NS}}}h', height)
+        margin = sect_pr.find(W_PG_MAR)
+        if margin is not None:
+            top = abs(_int_attr(margin, f'{{{W_NS}}}top', top))
+            bottom = abs(_int_attr(margin, f'{{{W_NS}}}bottom', bottom))
+            left = _int_attr(margin, f'{{{W_NS}}}left', left)
+            right = _int_attr(margin, f'{{{W_NS}}}right', right)
+    # 版心至少保留半英寸，避免异常的页面设置导致除零或死循环
+    return start, max(width - left - right, 720) / 20, max(height - top - bottom, 720) / 20
+
+
+def _text_width(text):
+    """估算文本宽度（以字号为单位）：汉字等全角字符记 1，ASCII 字符记 0.5"""
+    # 中日韩字符的 UTF-8 编码占 3 字节，借此在 C 层面统计全角字符数：
+    # 全角字符数 wide = (字节数 - 字符数) / 2，宽度 (字符数 + wide) / 2 即 (字符数 + 字节数) / 4
+    return (len(text) + len(text.encode('utf-8'))) / 4
+
+
+def _line_count(text, line_width):
+    """估算段落在给定行宽（以字号为单位）下占用的行数，空段落占一行"""
+    if '\n' not in text:
+        # 每个段落都要调用一次，这里直接计算宽度，不再调用 _text_width
+        return math.ceil((len(text) + len(text.encode('utf-8'))) / 4 / line_width) or 1
+    return sum(math.ceil(_text_width(segment) / line_width) or 1 for segment in text.split('\n'))
+
+
+class StyleSheet:
+    """word/styles.xml 中与分页估算有关的格式：文档默认格式以及段落样式（含 basedOn 继承）的字号、行距和段间距"""
+
+    # 样式中未设置字号时按五号字（10.5 磅）估算，单位为半磅
+    DEFAULT_FONT_SIZE = 21
+
+    def __init__(self, root=None):
+        # 格式为 (字号半磅, 行距, 行距规则, 段前, 段后)，行距和段间距的单位与 w:spacing 相同
+        self._defaults = (self.DEFAULT_FONT_SIZE, 240, 'auto', 0, 0)
+        self._styles = {}  # 样式 ID -> (basedOn, w:sz, w:spacing)
+        self._resolved = {}
+        self._metrics = {}
+        self._layouts = {}
+        self.default_style = None
+        if root is None:
+            return
+        defaults = root.find(W_DOC_DEFAULTS)
+        if defaults is not None:
+            self._defaults = _apply_format(self._defaults, defaults.find(f'{W_RPR_DEFAULT}/{W_RPR}/{W_SZ}'),
+                                           defaults.find(f'{W_PPR_DEFAULT}/{W_PPR}/{W_SPACING}'))
+        for style in root.iterchildren(W_STYLE):
+            if style.get(W_TYPE) != 'paragraph':
+                continue
+            style_id = style.get(W_STYLE_ID)
+            based_on = style.find(W_BASED_ON)
+            self._styles[style_id] = (based_on.get(W_VAL) if based_on is not None else None,
+                                      style.find(f'{W_RPR}/{W_SZ}'), style.find(f'{W_PPR}/{W_SPACING}'))
+            if style.get(W_DEFAULT) in ('1', 'true', 'on'):
+                self.default_style = style_id
+
+    @classmethod
+    def load(cls, docx_zip, paths):
+        """从 docx 中读取样式部件，缺失或损坏时使用默认格式"""
+        for path in paths:
+            try:
+                with docx_zip.open(path) as styles_file:
+                    return cls(etree.parse(styles_file).getroot())
+            except (KeyError, etree.XMLSyntaxError):
+                continue
+        return cls()
+
+    def paragraph_metrics(self, style_id, size=None, spacing=None):
+        """返回段落的 (字号, 行高, 段间距)，没有直接格式的段落按样式缓存"""
+        if size is None and spacing is None:
+            metrics = self._metrics.get(style_id)
+            if metrics is None:
+                metrics = self._metrics[style_id] = _line_metrics(self.resolve(style_id))
+            return metrics
+        return _line_metrics(_apply_format(self.resolve(style_id), size, spacing))
+
+    def paragraph_layout(self, style_id, size, spacing, breaks, page_break_before):
+        """返回正文流段落的版式 (字号, 行高, 段间距, 分页标记, 是否段前分页)，没有直接格式的段落共用缓存的元组"""
+        if size is None and spacing is None:
+            key = (style_id, breaks, page_break_before)
+            layout = self._layouts.get(key)
+            if layout is None:
+                layout = self._layouts[key] = self.paragraph_metrics(style_id) + (breaks, page_break_before)
+            return layout
+        return self.paragraph_metrics(style_id, size, spacing) + (breaks, page_break_before)
+
+    def resolve(self, style_id):
+        """返回段落样式沿 basedOn 链继承后的格式，未知样式按默认段落样式处理"""
+        if style_id not in self._styles:
+            style_id = self.default_style
+        fmt = self._resolved.get(style_id)
+        if fmt is not None:
+            return fmt
+        chain = []
+        current = style_id
+        while current in self._styles and current not in chain:
+            chain.append(current)
+            current = self._styles[current][0]
+        fmt = self._defaults
+        for current in reversed(chain):
+            _, size, spacing = self._styles[current]
+            fmt = _apply_format(fmt, size, spacing)
+        self._resolved[style_id] = fmt
+        return fmt
+
+
+class DocxTextExtractor:
+    """
+    专门用于提取 docx 文本和页码信息的类。
+    除正文段落外，还提取表格、页眉、页脚、脚注、尾注和文本框中的文本，
+    所有文本拼接在同一个 full_text 中，每个段落在 locations 中记录其位置。
+    """
+
+    # 段落/分页模型和匹配结果的格式版本，格式变化时递增，使磁盘缓存中的旧数据失效
+    MODEL_VERSION = 6
+
+    def __init__(self, docx_path):
+        # docx_path 可以是文件路径，也可以是可 seek 的二进制文件对象（如上传文件的内存缓冲区）
+        # 段落文本：前 flow_count 个是按文档顺序排列的正文段落（含表格中的段落），参与分页；
+        # 其后是文本框、页眉、页脚、脚注和尾注中的段落，通过 _anchors 借用正文段落的页码
+        self.paragraphs = []
+        self.rendered_page_breaks = []
+        # 每个段落的位置：(部件类型, 部件内段落序号, 表格序号, 行, 单元格, 是否在文本框中)
+        self.locations = []
+        self._anchors = []
+        self.flow_count = 0
+        # 正文流段落的页码表，以及页码来源：'rendered'（Word 排版标记）或 'estimated'（版式估算）
+        self.page_map = array('I')
+        self.page_source = 'estimated'
+        started = time.perf_counter()
+        self._parse_document(docx_path)
+        parsed = time.perf_counter()
+        self._build_page_map()
+        paginated = time.perf_counter()
+        self._build_indexes()
+        # 各阶段耗时（秒），供基准测试和性能监控使用
+        self.stage_timings = {'parse': parsed - started, 'pagination': paginated - parsed,
+                              'index': time.perf_counter() - paginated}
+
+    @classmethod
+    def from_model(cls, model):
+        """根据 to_model 导出的段落和分页模型重建提取器，无需再次解析文档"""
+        extractor = cls.__new__(cls)
+        extractor.paragraphs = model['paragraphs']
+        extractor.rendered_page_breaks = model['rendered_page_breaks']
+        extractor.locations = model['locations']
+        extractor._anchors = model['anchors']
+        extractor.flow_count = model['flow_count']
+        extractor.page_map = model['page_map']
+        extractor.page_source = model['page_source']
+        started = time.perf_counter()
+        extractor._build_indexes()
+        extractor.stage_timings = {'index': time.perf_counter() - started}
+        return extractor
+
+    def to_model(self):
+        """导出段落和分页模型，用于缓存"""
+        return {
+            'paragraphs': self.paragraphs,
+            'rendered_page_breaks': self.rendered_page_breaks,
+            'locations': self.locations,
+            'anchors': self._anchors,
+            'flow_count': self.flow_count,
+            'page_map': self.page_map,
+            'page_source': self.page_source,
+        }
+
+    def _build_indexes(self):
+        """构建段落偏移、完整文本和用于匹配的规范化文本"""
+        # 每个段落在 full_text 中的起始偏移，由 _extract_full_text 一并构建
+        self.paragraph_offsets = []
+        self.full_text = self._extract_full_text()
+        self.normalized = NormalizedText(self.full_text)
+        self._normalized_offsets = None
+
+    def _parse_document(self, docx_path):
+        """
+        依次流式解析正文、页眉、页脚、脚注和尾注部件，一次扫描收集段落文本、位置，
+        以及正文流段落的分页标记和版式（字号、行距、段间距）、各节的页面设置。
+        每处理完一个块级元素就将其清除，内存占用不随文档大小增长。
+        """
+        self._part_paragraphs = [0] * len(PART_NAMES)
+        self._part_tables = [0] * len(PART_NAMES)
+        self._note_anchors = {}
+        # 正文流段落的版式：(字号, 行高, 段间距, 分页标记, 是否段前分页)；各节：(最后一个段落索引, 起始方式, 版心宽, 版心高)
+        self._layout = []
+        self._sections = []
+        last_section = None
+        anchored = []  # 非正文流段落：(文本, 位置, 锚点)
+        with zipfile.ZipFile(docx_path) as docx_zip:
+            main_part = _find_main_document_part(docx_zip)
+            related = _find_relationships(docx_zip, main_part)
+            self._styles = StyleSheet.load(docx_zip, related.get('styles', ()))
+            for part, path in _document_parts(main_part, related):
+                try:
+                    xml_file = docx_zip.open(path)
+                except KeyError:
+                    continue
+                with xml_file:
+                    for container, block in _iter_part_blocks(xml_file, PART_CONTAINERS[part]):
+                        if block.tag == W_SECT_PR:
+                            # 正文末尾的节属性描述最后一节
+                            if part == PART_BODY:
+                                last_section = _section_geometry(block)
+                            continue
+                        if part == PART_BODY:
+                            anchor = FLOW
+                        elif part in (PART_FOOTNOTE, PART_ENDNOTE):
+                            if container.get(W_TYPE) in SPECIAL_NOTE_TYPES:
+                                continue
+                            anchor = (part, container.get(W_ID))
+                        else:
+                            anchor = None
+                        self._walk_block(block, part, NO_CELL, False, anchor, anchored)
+
+        self.flow_count = len(self.paragraphs)
+        self._sections.append((self.flow_count,) + (last_section or _section_geometry(None)))
+        for text, location, anchor in anchored:
+            # 脚注、尾注借用引用它的正文段落的页码；页眉页脚没有确定的页码
+            if isinstance(anchor, tuple):
+                anchor = self._note_anchors.get(anchor)
+            self.paragraphs.append(text)
+            self.locations.append(location)
+            self._anchors.append(anchor)
+        del self._part_paragraphs, self._part_tables, self._note_anchors, self._styles
+
+    def _walk_block(self, element, part, cell, in_textbox, anchor, anchored):
+        """处理一个块级元素：段落直接记录，表格和内容控件递归处理其中的段落"""
+        tag = element.tag
+        if tag == W_P:
+            self._add_paragraph(element, part, cell, in_textbox, anchor, anchored)
+        elif tag == W_TBL:
+            # 表格较多的文档中单元格段落占大多数，这里直接处理单元格中的段落，只有嵌套的表格和内容控件才递归
+            table_index = self._part_tables[part]
+            self._part_tables[part] += 1
+            row_index = 0
+            for row in element.getchildren():
+                if row.tag != W_TR:
+                    continue
+                cell_index = 0
+                for table_cell in row.getchildren():
+                    if table_cell.tag != W_TC:
+                        continue
+                    cell = (table_index, row_index, cell_index)
+                    for child in table_cell.getchildren():
+                        if child.tag == W_P:
+                            self._add_paragraph(child, part, cell, in_textbox, anchor, anchored)
+                        else:
+                            self._walk_block(child, part, cell, in_textbox, anchor, anchored)
+                    cell_index += 1
+                row_index += 1
+        elif tag == W_SDT:
+            for content in element.getchildren():
+                if content.tag == W_SDT_CONTENT:
+                    for child in content.getchildren():
+                        self._walk_block(child, part, cell, in_textbox, anchor, anchored)
+
+    def _add_paragraph(self, paragraph, part, cell, in_textbox, anchor, anchored):
+        text, fmt, breaks, textboxes, note_refs = _scan_paragraph(paragraph)
+        location = (part, self._part_paragraphs[part]) + cell + (in_textbox,)
+        self._part_paragraphs[part] += 1
+        if anchor is FLOW:
+            host = len(self.paragraphs)
+            if breaks[2] or breaks[3]:
+                self.rendered_page_breaks.append(host)
+            style_id, spacing, size, page_break_before, sect_pr = fmt
+            self._layout.append(self._styles.paragraph_layout(style_id, size, spacing, breaks, page_break_before))
+            if sect_pr is not None:
+                # 段落中的节属性描述以该段落结束的一节
+                self._sections.append((host,) + _section_geometry(sect_pr))
+            self.paragraphs.append(text)
+            self.locations.append(location)
+        else:
+            anchored.append((text, location, anchor))
+            host = anchor
+        for note in note_refs:
+            self._note_anchors.setdefault(note, host)
+        # 文本框中的段落不参与正文分页，借用所在段落的页码
+        for textbox in textboxes:
+            for child in textbox:
+                self._walk_block(child, part, cell, True, host, anchored)
+
+    def _build_page_map(self):
+        """
+        一次线性扫描为每个正文流段落计算页码，存入紧凑数组 page_map，之后的页码查询都是 O(1) 的数组访问。
+        文档带有 Word 排版时保存的 lastRenderedPageBreak 标记时按标记分页，没有对应标记的显式分页符、段前分页和
+        非连续分节符（文档保存后又被其他程序修改时会出现）仍各自分页，与标记落在同一处的只算一次；
+        否则按各节的纸张大小和页边距、段落的字号、行距和段间距估算每页容纳的内容，并处理显式分页符、段前分页和分节符。
+        """
+        layout, sections = self._layout, self._sections
+        del self._layout, self._sections
+        count = self.flow_count
+        page_map = array('I', [1]) * count
+        page = 1
+        if self.rendered_page_breaks:
+            self.page_source = 'rendered'
+            section = 0
+            pending = 0  # 上一段文字后的显式分页符，段内没有对应的排版标记
+            for i, (_, _, _, breaks, page_break_before) in enumerate(layout):
+                explicit_before, explicit_after, rendered_before, rendered_after = breaks
+                # 段落开头的显式分页：上一段末尾的分页符、本段文字前的分页符或段前分页、非连续分节符，
+                # Word 排版时在这里留下的标记与它们是同一次分页
+                explicit = max(pending, explicit_before or int(page_break_before))
+                while section + 1 < len(sections) and sections[section][0] < i:
+                    section += 1
+                    if sections[section][1] != 'continuous':
+                        explicit = max(explicit, 1)
+                page += max(rendered_before, explicit)
+                page_map[i] = page
+                page += rendered_after
+                pending = 0 if rendered_after else explicit_after
+            self.page_map = page_map
+            return
+
+        self.page_source = 'estimated'
+        paragraphs, locations = self.paragraphs, self.locations
+        section = 0
+        _, _, width, height = sections[0]
+        used = 0.0  # 当前页已占用的高度（磅）
+        pending = 0  # 下一段开始前需要翻过的页数
+        parity = None  # 奇数页/偶数页分节符要求的页码奇偶性
+        i = 0
+        while i < count:
+            # 同一表格行的段落并排排列：按单元格分别累计高度，行高取最高的单元格
+            table, row = locations[i][2:4]
+            j = i + 1
+            if table >= 0:
+                while j < count and locations[j][2] == table and locations[j][3] == row:
+                    j += 1
+
+            font_pt, line_pt, space_pt, breaks, page_break_before = layout[i]
+            pending += breaks[0] or int(page_break_before)
+            if pending:
+                page += pending
+                used = 0.0
+                pending = 0
+            if parity is not None:
+                if page % 2 != parity:
+                    page += 1
+                    used = 0.0
+                parity = None
+
+            if j - i == 1:
+                block_height = _line_count(paragraphs[i], width / font_pt) * line_pt + space_pt
+            else:
+                # 同一行中各单元格的段落依次排列，先数出单元格数，再逐个单元格累计高度
+                cell_count = 1
+                for k in range(i + 1, j):
+                    if locations[k][4] != locations[k - 1][4]:
+                        cell_count += 1
+                cell_width = width / cell_count
+                block_height = cell_height = 0
+                last_cell = locations[i][4]
+                for k in range(i, j):
+                    cell = locations[k][4]
+                    if cell != last_cell:
+                        block_height = max(block_height, cell_height)
+                        cell_height = 0
+                        last_cell = cell
+                    cell_font_pt, cell_line_pt, cell_space_pt = layout[k][:3]
+                    cell_height += _line_count(paragraphs[k], cell_width / cell_font_pt) * cell_line_pt + cell_space_pt
+                block_height = max(block_height, cell_height)
+
+            # 当前页放不下第一行时从下一页开始；放得下则从本页开始，超出部分依次延续到后面的页
+            if used > 0 and used + line_pt > height:
+                page += 1
+                used = 0.0
+            for k in range(i, j):
+                page_map[k] = page
+                pending += layout[k][3][1]
+            used += block_height
+            while used > height:
+                page += 1
+                used -= height
+
+            # 跨过节的末尾时切换到下一节的页面设置，非连续分节符另起一页
+            while section + 1 < len(sections) and sections[section][0] < j:
+                section += 1
+                start, width, height = sections[section][1:]
+                if start != 'continuous':
+                    pending = max(pending, 1)
+                    parity = {'oddPage': 1, 'evenPage': 0}.get(start)
+            i = j
+
+        self.page_map = page_map
+
+    def _extract_full_text(self):
+        """提取完整文本，同时记录每个段落的起始偏移"""
+        full_text = []
+        offset = 0
+        for text in self.paragraphs:
+            self.paragraph_offsets.append(offset)
+            # 保留换行符以便于上下文查找
+            text = text + "\n"
+            full_text.append(text)
+            offset += len(text)
+        return ''.join(full_text)
+
+    def normalized_paragraph_offsets(self):
+        """每个段落在规范化文本中的起始偏移，首次使用时计算"""
+        if self._normalized_offsets is None:
+            if self.normalized.breaks:
+                to_normalized = self.normalized.to_normalized
+                self._normalized_offsets = [to_normalized(offset) for offset in self.paragraph_offsets]
+            else:
+                self._normalized_offsets = self.paragraph_offsets
+        return self._normalized_offsets
+
+    def get_paragraph_index(self, pos):
+        """根据 full_text 中的偏移二分查找所在段落索引"""
+        return max(bisect_right(self.paragraph_offsets, pos) - 1, 0)
+
+    def get_page_number(self, paragraph_index):
+        """根据段落索引查页码表，页眉页脚等没有确定页码的段落返回 None"""
+        if paragraph_index >= self.flow_count:
+            paragraph_index = self._anchors[paragraph_index - self.flow_count]
+            if paragraph_index is None:
+                return None
+        return self.page_map[paragraph_index]
+
+    def find_keyword_occurrences(self, keywords, longest_only=False, progress=None, chunk_paragraphs=500,
+                                 mode=MODE_ALL, limit=None, exclude=()):
+        """
+        查找关键词并返回其页码和上下文。
+        keywords 可以是关键词列表，也可以是预先构建好的 KeywordMatcher；
+        longest_only 为 True 时只报告最长匹配，不再报告被覆盖的子关键词。
+        传入 progress 时按每 chunk_paragraphs 个段落分段扫描，每段结束后调用
+        progress(已处理段落数, 段落总数, 本段新增的匹配项)，本段匹配项按文档顺序排列。
+        mode 为其他查询模式（见 QUERY_MODES）时改由 _find_quick 处理，不报告进度。
+        """
+        matcher = keywords if isinstance(keywords, KeywordMatcher) else KeywordMatcher(keywords)
+        if mode != MODE_ALL:
+            return self._find_quick(matcher, mode, limit, longest_only, exclude, chunk_paragraphs)
+
+        # 匹配在规范化文本上进行，_build_occurrence 再把位置换算回原文
+        text = self.normalized.text
+        if progress is None:
+            # 一次扫描全文找出所有关键词，结果按关键词顺序、再按位置排列
+            return [self._build_occurrence(matcher, pos, kw_index)
+                    for pos, kw_index in matcher.find_all(text, longest_only=longest_only)]
+
+        built = {}
+        matches = []
+        state = 0
+        start = 0
+        total = len(self.paragraphs)
+        offsets = self.normalized_paragraph_offsets()
+        for first in range(0, total, chunk_paragraphs):
+            last = min(first + chunk_paragraphs, total)
+            end = offsets[last] if last < total else len(text)
+            chunk_matches, state = matcher.scan(text, start, end, state)
+            if longest_only:
+                chunk_matches = matcher.select_longest(chunk_matches)
+            chunk_matches.sort()
+            matches.extend(chunk_matches)
+            for match in chunk_matches:
+                built[match] = self._build_occurrence(matcher, *match)
+            progress(last, total, [built[match] for match in chunk_matches])
+            start = end
+
+        # 最终结果与一次性扫描保持一致：重新做最长选择并按关键词顺序、再按位置排列
+        if longest_only:
+            matches = matcher.select_longest(matches)
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return [built.get(match) or self._build_occurrence(matcher, *match) for match in matches]
+
+    def _find_quick(self, matcher, mode, limit, longest_only, exclude, chunk_paragraphs):
+        """
+        快速查询模式：counts 返回各关键词的匹配数 [{'keyword', 'count', ...}]，不生成匹配项；
+        exists 和 first_n 按每 chunk_paragraphs 个段落分段扫描，找到 1 个或 limit 个匹配就停止，
+        返回按文档顺序排列的匹配项。exclude 中的关键词不予报告。
+        """
+        wanted = _quick_limit(mode, limit)
+        excluded = _excluded_indexes(matcher, exclude)
+        text = self.normalized.text
+        if mode == MODE_COUNTS:
+            matches, _ = matcher.scan(text)
+            if longest_only:
+                matches = matcher.select_longest(matches)
+            return _keyword_counts(matcher, Counter(kw_index for _, kw_index in matches if kw_index not in excluded))
+
+        found = []
+        total = len(self.paragraphs)
+        offsets = self.normalized_paragraph_offsets()
+        for first in range(0, total, chunk_paragraphs):
+            last = min(first + chunk_paragraphs, total)
+            matches, _ = matcher.scan(text, offsets[first], offsets[last] if last < total else len(text))
+            found.extend(_first_matches(matcher, matches, longest_only, excluded, wanted - len(found)))
+            if len(found) >= wanted:
+                break
+        return [self._build_occurrence(matcher, *match) for match in found]
+
+    def paragraph_hashes(self):
+        """各段落文本的内容哈希（8 字节），用于在同一文档的不同版本之间识别未改动的段落"""
+        return [hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest() for text in self.paragraphs]
+
+    def find_changed_occurrences(self, keywords, known, hashes=None, longest_only=False):
+        """
+        结果与 find_keyword_occurrences 相同，但只扫描内容哈希不在 known 中的段落，其余段落直接复用 known 中的匹配。
+        known 为 {段落哈希: [(段内偏移, 关键词), ...]}（见 paragraph_matches），必须来自同一关键词集合和匹配模式；
+        关键词不含换行符，匹配不会跨越段落，所以逐段复用与整篇扫描等价。返回 (匹配项列表, 扫描的段落数)。
+        """
+        matcher = keywords if isinstance(keywords, KeywordMatcher) else KeywordMatcher(keywords)
+        if hashes is None:
+            hashes = self.paragraph_hashes()
+        kw_indexes = {keyword: kw_index for kw_index, keyword in enumerate(matcher.keywords)}
+        # known 中的段内偏移以原文为准，扫描和匹配位置以规范化文本为准
+        text = self.normalized.text
+        to_normalized = self.normalized.to_normalized
+        offsets = self.normalized_paragraph_offsets()
+        total = len(self.paragraphs)
+        matches = []
+        scanned = 0
+        run_start = None  # 连续的待扫描段落合并为一次扫描
+        for para_index in range(total + 1):
+            hits = known.get(hashes[para_index]) if para_index < total else ()
+            if hits is None:
+                if run_start is None:
+                    run_start = para_index
+                scanned += 1
+                continue
+            if run_start is not None:
+                end = offsets[para_index] if para_index < total else len(text)
+                run_matches, _ = matcher.scan(text, offsets[run_start], end)
+                if longest_only:
+                    run_matches = matcher.select_longest(run_matches)
+                matches.extend(run_matches)
+                run_start = None
+            if hits:
+                start = self.paragraph_offsets[para_index]
+                matches.extend((to_normalized(start + local), kw_indexes[keyword]) for local, keyword in hits)
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return [self._build_occurrence(matcher, *match) for match in matches], scanned
+
+    def _build_occurrence(self, matcher, pos, kw_index):
+        """根据规范化文本中的匹配位置生成包含页码和上下文的匹配项，位置和上下文都取自原文"""
+        context_length = 50  # 上下文字符数
+        keyword = matcher.keywords[kw_index]
+        # 原文中的匹配可能含有被规范化去掉的空白，长度不一定等于关键词长度
+        start, end = self.normalized.original_span(pos, len(matcher.patterns[kw_index]))
+
+        # 找到包含关键词的段落索引并估算页码
+        para_index = self.get_paragraph_index(start)
+        page_num = self.get_page_number(para_index)
+
+        # 提取上下文；页眉、脚注等非正文段落的上下文不跨出该段落
+        context_start = max(0, start - context_length)
+        context_end = min(len(self.full_text), end + context_length)
+        if para_index >= self.flow_count:
+            context_start = max(context_start, self.paragraph_offsets[para_index])
+            if para_index + 1 < len(self.paragraph_offsets):
+                context_end = min(context_end, self.paragraph_offsets[para_index + 1])
+        raw_context = self.full_text[context_start:context_end]
+        context = raw_context.strip()
+
+        occurrence = {
+            'keyword': keyword,
+            'page': page_num,
+            'pageConfidence': self.page_source if page_num is not None else None,
+            'context': context,
+            'location': self.get_location(para_index),
+            # 匹配和上下文在原文中的起始偏移及匹配长度，用于合并相互重叠的上下文和标出匹配
+            'offset': start,
+            'length': end - start,
+            'contextStart': context_start + len(raw_context) - len(raw_context.lstrip()),
+        }
+        if matcher.annotations and matcher.annotations[kw_index]:
+            occurrence.update(matcher.annotations[kw_index])
+        return occurrence
+
+    def get_location(self, paragraph_index):
+        """返回段落的位置描述：所在部件、部件内段落序号，以及表格/行/单元格和是否在文本框中"""
+        return _location_dict(self.locations[paragraph_index])
+
+
+def _quick_limit(mode, limit):
+    """快速查询模式最多报告的匹配项数，counts 不限"""
+    if mode == MODE_EXISTS:
+        return 1
+    if mode == MODE_FIRST_N:
+        return max(limit or DEFAULT_FIRST_N, 1)
+    if mode == MODE_COUNTS:
+        return math.inf
+    raise ValueError(f'未知的查询模式: {mode}')
+
+
+def _excluded_indexes(matcher, exclude):
+    return {kw_index for kw_index, keyword in enumerate(matcher.keywords) if keyword in exclude} if exclude else set()
+
+
+def _first_matches(matcher, matches, longest_only, excluded, count):
+    """一段文本的匹配中按位置排在最前的 count 个 (起始位置, 关键词序号)，不含 excluded 中的关键词"""
+    if longest_only:
+        matches = matcher.select_longest(matches)
+    else:
+        matches.sort()
+    return [match for match in matches if match[1] not in excluded][:count]
+
+
+def _keyword_counts(matcher, counts):
+    """各关键词的匹配数 [{'keyword', 'count', ...附加字段}]，按关键词顺序排列，不含没有匹配的关键词"""
+    stats = []
+    for kw_index in sorted(counts):
+        stat = {'keyword': matcher.keywords[kw_index], 'count': counts[kw_index]}
+        if matcher.annotations and matcher.annotations[kw_index]:
+            stat.update(matcher.annotations[kw_index])
+        stats.append(stat)
+    return stats
+
+
+def _count_paragraph_batch(matcher, batch, longest_only, excluded, counts):
+    """匹配一批段落文本，把各关键词的匹配数累加到 counts"""
+    matches, _ = matcher.scan(NormalizedText('\n'.join(batch) + '\n').text)
+    if longest_only:
+        matches = matcher.select_longest(matches)
+    counts.update(kw_index for _, kw_index in matches if kw_index not in excluded)
+
+
+def _paragraph_occurrence(matcher, kw_index, paragraph, location, paragraph_offset, local, length):
+    """流式快速查询的匹配项：格式与 DocxTextExtractor._build_occurrence 一致，但页码未知，上下文不跨出所在段落"""
+    context_length = 50
+    context_start = max(0, local - context_length)
+    raw_context = paragraph[context_start:local + length + context_length]
+    occurrence = {
+        'keyword': matcher.keywords[kw_index],
+        'page': None,
+        'pageConfidence': PAGE_UNKNOWN,
+        'context': raw_context.strip(),
+        'location': _location_dict(location),
+        'offset': paragraph_offset + local,
+        'length': length,
+        'contextStart': paragraph_offset + context_start + len(raw_context) - len(raw_context.lstrip()),
+    }
+    if matcher.annotations and matcher.annotations[kw_index]:
+        occurrence.update(matcher.annotations[kw_index])
+    return occurrence
+
+
+def _find_paragraph_batch(matcher, batch, longest_only, excluded, count):
+    """匹配一批段落 [(文本, 位置, 在 full_text 中的偏移), ...]，返回按文档顺序排在最前的 count 个匹配项"""
+    normalized = NormalizedText('\n'.join(text for text, _, _ in batch) + '\n')
+    matches, _ = matcher.scan(normalized.text)
+    starts = []
+    start = 0
+    for text, _, _ in batch:
+        starts.append(start)
+        start += len(text) + 1
+    found = []
+    for pos, kw_index in _first_matches(matcher, matches, longest_only, excluded, count):
+        start, end = normalized.original_span(pos, len(matcher.patterns[kw_index]))
+        index = bisect_right(starts, start) - 1
+        text, location, offset = batch[index]
+        found.append(_paragraph_occurrence(matcher, kw_index, text, location, offset, start - starts[index],
+                                           end - start))
+    return found
+
+
+def quick_scan(docx_source, keywords, mode, limit=None, longest_only=False, exclude=(), chunk_chars=None):
+    """
+    快速查询模式的流式实现，用于文档模型没有缓存的情况：边提取段落边匹配，不收集版式、不计算分页。
+    counts 的结果与 DocxTextExtractor.find_keyword_occurrences 的结果一致，段落每累积 chunk_chars
+    （默认 QUICK_SCAN_CHUNK_CHARS）个字符匹配一次。exists 和 first_n 每累积 chunk_chars（默认 QUICK_FIND_CHUNK_CHARS）
+    个字符匹配一次，找够匹配项即关闭文档，不再解析其余部分；页码取决于整篇文档的分页标记和版式，
+    因此匹配项的 page 为 None、pageConfidence 为 'unknown'，上下文不跨出所在段落。
+    """
+    matcher = keywords if isinstance(keywords, KeywordMatcher) else KeywordMatcher(keywords)
+    wanted = _quick_limit(mode, limit)
+    excluded = _excluded_indexes(matcher, exclude)
+    if mode == MODE_COUNTS:
+        chunk_chars = chunk_chars or QUICK_SCAN_CHUNK_CHARS
+        counts = Counter()
+        batch = []
+        batch_chars = 0
+        for text, _ in iter_document_paragraphs(docx_source):
+            batch.append(text)
+            batch_chars += len(text) + 1
+            if batch_chars >= chunk_chars:
+                _count_paragraph_batch(matcher, batch, longest_only, excluded, counts)
+                batch, batch_chars = [], 0
+        if batch:
+            _count_paragraph_batch(matcher, batch, longest_only, excluded, counts)
+        return _keyword_counts(matcher, counts)
+
+    chunk_chars = chunk_chars or QUICK_FIND_CHUNK_CHARS
+    found = []
+    batch = []
+    batch_chars = 0
+    offset = 0  # 段落在 DocxTextExtractor.full_text 中的偏移
+    paragraphs = iter_document_paragraphs(docx_source)
+    try:
+        for text, location in paragraphs:
+            batch.append((text, location, offset))
+            offset += len(text) + 1
+            batch_chars += len(text) + 1
+            if batch_chars >= chunk_chars:
+                found.extend(_find_paragraph_batch(matcher, batch, longest_only, excluded, wanted - len(found)))
+                batch, batch_chars = [], 0
+                if len(found) >= wanted:
+                    break
+        else:
+            if batch:
+                found.extend(_find_paragraph_batch(matcher, batch, longest_only, excluded, wanted - len(found)))
+    finally:
+        # 关闭生成器即关闭文档，其余部分不再解析
+        paragraphs.close()
+    return found
+
+
+def _location_dict(location):
+    part, paragraph, table, row, cell, in_textbox = location
+    result = {'part': PART_NAMES[part], 'paragraph': paragraph}
+    if table >= 0:
+        result.update(table=table, row=row, cell=cell)
+    if in_textbox:
+        result['textbox'] = True
+    return result
+
+
+def group_occurrences(occurrences, exclude=()):
+    """
+    把 find_keyword_occurrences 的结果按关键词分组，并把同一关键词在同一段落中上下文相互重叠的匹配项
+    合并为一个片段，避免相邻的匹配项各自携带一份几乎相同的上下文。exclude 中的关键词不予报告。
+    返回 (关键词统计, 片段列表)：关键词统计为 [{'keyword', 'count', 'snippets', 'start'}, ...]，按结果中首次出现的顺序，
+    同一关键词的片段在片段列表中连续排列，start 为其中第一个片段的序号；
+    片段为 {'keyword', 'context', 'hits', 'lengths', 'page', 'pageConfidence', 'location'}，
+    hits 和 lengths 是各匹配项在 context 中的起始位置和长度（原文中的匹配可能含有空白，长度不一定等于关键词长度）。
+    匹配项带有增量检查的 change 字段时，片段也带 change，关键词统计另有 new（新增的匹配项数）；
+    匹配项带有地域检查的 region 字段（同一关键词相同）时，关键词统计也带 region。
+    """
+    keywords = []
+    snippets = []
+    stats = {}
+    current = None
+    current_start = current_end = 0
+    for occurrence in occurrences:
+        keyword = occurrence['keyword']
+        if keyword in exclude:
+            continue
+        stat = stats.get(keyword)
+        if stat is None:
+            stat = stats[keyword] = {'keyword': keyword, 'count': 0, 'snippets': 0, 'start': len(snippets)}
+            if 'change' in occurrence:
+                stat['new'] = 0
+            if 'region' in occurrence:
+                stat['region'] = occurrence['region']
+            keywords.append(stat)
+        stat['count'] += 1
+
+        context = occurrence['context']
+        context_start = occurrence.get('contextStart')
+        offset = occurrence.get('offset')
+        if (current is not None and context_start is not None and current['keyword'] == keyword
+                and current['location'] == occurrence['location']
+                and current_start <= context_start <= current_end):
+            # 上下文与当前片段重叠或相接：只追加超出当前片段的部分
+            context_end = context_start + len(context)
+            if context_end > current_end:
+                current['context'] += context[current_end - context_start:]
+                current_end = context_end
+            current['hits'].append(offset - current_start)
+            current['lengths'].append(occurrence.get('length', len(keyword)))
+            if occurrence.get('change') == 'new':
+                current['change'] = 'new'
+                stat['new'] += 1
+            continue
+
+        current = {
+            'keyword': keyword,
+            'context': context,
+            'hits': [offset - context_start] if context_start is not None else [context.find(keyword)],
+            'lengths': [occurrence.get('length', len(keyword))],
+            'page': occurrence['page'],
+            'pageConfidence': occurrence.get('pageConfidence'),
+            'location': occurrence['location'],
+        }
+        if 'change' in occurrence:
+            # 增量检查的结果：合并后的片段中只要有一处是新增的，片段就标记为新增
+            current['change'] = occurrence['change']
+            stat['new'] += occurrence['change'] == 'new'
+        current_start = context_start or 0
+        current_end = current_start + len(context)
+        snippets.append(current)
+        stat['snippets'] += 1
+    return keywords, snippets
+
+
+def paragraph_matches(extractor, occurrences, hashes):
+    """
+    按段落内容归类匹配项，返回 (known, identities)。
+    known 为 {段落哈希: [(段内偏移, 关键词), ...]}，没有匹配的段落对应空列表，可传给 find_changed_occurrences；
+    identities 为各匹配项的身份 (段落哈希, 段内偏移, 关键词)，段落内容不变时身份在版本之间保持不变。
+    """
+    known = {}
+    first_paragraph = {}
+    for para_index, digest in enumerate(hashes):
+        if digest not in known:
+            known[digest] = []
+            first_paragraph[digest] = para_index
+    identities = []
+    for occurrence in occurrences:
+        para_index = extractor.get_paragraph_index(occurrence['offset'])
+        digest = hashes[para_index]
+        local = occurrence['offset'] - extractor.paragraph_offsets[para_index]
+        identities.append((digest, local, occurrence['keyword']))
+        # 内容相同的段落只记录一次
+        if first_paragraph[digest] == para_index:
+            known[digest].append((local, occurrence['keyword']))
+    return known, identities
+
+
+def diff_occurrences(previous, identities):
+    """
+    对比两个版本的匹配项。previous 为上一版本的 [(身份, 匹配项), ...]，identities 为本版本各匹配项的身份。
+    返回 (本版本各匹配项的状态 'new' 或 'unchanged', 上一版本中已不存在的匹配项列表)；
+    同一身份出现多次（例如内容重复的段落）时按次数对应。
+    """
+    remaining = Counter(identity for identity, _ in previous)
+    changes = []
+    for identity in identities:
+        if remaining[identity] > 0:
+            remaining[identity] -= 1
+            changes.append('unchanged')
+        else:
+            changes.append('new')
+    removed = []
+    for identity, occurrence in previous:
+        if remaining[identity] > 0:
+            remaining[identity] -= 1
+            removed.append(occurrence)
+    return changes, removed
+
+
+def _iter_block_paragraphs(element, cell=NO_CELL, in_textbox=False, tables=None):
+    """
+    依次产出块级元素中的 (段落, (表格, 行, 单元格), 是否在文本框中)，顺序和表格编号与 DocxTextExtractor._walk_block 一致：
+    段落本身在前，其中文本框的段落紧随其后；表格按行、单元格展开，内容控件展开其内容。
+    tables 为部件内已经出现的表格数（单元素列表），遍历时递增。
+    """
+    if tables is None:
+        tables = [0]
+    tag = element.tag
+    if tag == W_P:
+        yield element, cell, in_textbox
+        for textbox in _scan_paragraph(element)[3]:
+            for child in textbox:
+                yield from _iter_block_paragraphs(child, cell, True, tables)
+    elif tag == W_TBL:
+        table_index = tables[0]
+        tables[0] += 1
+        for row_index, row in enumerate(child for child in element if child.tag == W_TR):
+            for cell_index, table_cell in enumerate(child for child in row if child.tag == W_TC):
+                for child in table_cell:
+                    yield from _iter_block_paragraphs(child, (table_index, row_index, cell_index), in_textbox, tables)
+    elif tag == W_SDT:
+        for content in element:
+            if content.tag == W_SDT_CONTENT:
+                for child in content:
+                    yield from _iter_block_paragraphs(child, cell, in_textbox, tables)
+
+
+def iter_document_paragraphs(docx_source):
+    """
+    流式产出文档各段落的 (文本, 位置)，顺序和位置与 DocxTextExtractor 的 paragraphs、locations 一致：
+    先是正文段落，然后是正文中文本框的段落（在正文解析完后产出），最后是页眉、页脚、脚注和尾注的段落。
+    不收集版式、不计算分页；调用方提前结束迭代（关闭生成器）后，文档的其余部分不再解析。
+    """
+    part_paragraphs = [0] * len(PART_NAMES)
+    part_tables = [[0] for _ in PART_NAMES]
+    with zipfile.ZipFile(docx_source) as docx_zip:
+        main_part = _find_main_document_part(docx_zip)
+        for part, path in _document_parts(main_part, _find_relationships(docx_zip, main_part)):
+            try:
+                xml_file = docx_zip.open(path)
+            except KeyError:
+                continue
+            textbox_paragraphs = []
+            with xml_file:
+                for container, block in _iter_part_blocks(xml_file, PART_CONTAINERS[part]):
+                    if block.tag == W_SECT_PR:
+                        continue
+                    if part in (PART_FOOTNOTE, PART_ENDNOTE) and container.get(W_TYPE) in SPECIAL_NOTE_TYPES:
+                        continue
+                    for paragraph, cell, in_textbox in _iter_block_paragraphs(block, NO_CELL, False,
+                                                                              part_tables[part]):
+                        location = (part, part_paragraphs[part]) + cell + (in_textbox,)
+                        part_paragraphs[part] += 1
+                        if part == PART_BODY and in_textbox:
+                            textbox_paragraphs.append((_paragraph_text(paragraph), location))
+                        else:
+                            yield _paragraph_text(paragraph), location
+            yield from textbox_paragraphs
+
+
+def _run_child_length(child):
+    """w:r 的子元素在 _run_text 中对应的字符数"""
+    tag = child.tag
+    if tag == W_T:
+        return len(child.text or '')
+    if tag == W_TAB or tag == W_PTAB or tag == W_CR or tag == W_NO_BREAK_HYPHEN:
+        return 1
+    if tag == W_BR:
+        return 1 if child.get(W_TYPE, 'textWrapping') == 'textWrapping' else 0
+    return 0
+
+
+def _paragraph_runs(paragraph):
+    """段落中构成 _paragraph_text 的 w:r（直接子级及 w:hyperlink 中的），按文本顺序排列"""
+    runs = []
+    for child in paragraph:
+        if child.tag == W_R:
+            runs.append(child)
+        elif child.tag == W_HYPERLINK:
+            runs.extend(run for run in child if run.tag == W_R)
+    return runs
+
+
+def _text_element(run, text):
+    element = run.makeelement(W_T, {XML_SPACE: 'preserve'})
+    element.text = text
+    return element
+
+
+def _split_run(run, cuts):
+    """
+    在 cuts（相对于文本块开头的偏移，升序，均在文本块内部）处把文本块拆成相邻的几个文本块。
+    w:t 的文本在切分处断开，各块复制原来的 w:rPr，第一块沿用原来的 w:r 元素。
+    """
+    rpr = run.find(W_RPR)
+    segments = [[]]
+    pos = 0
+    cut_index = 0
+    for child in list(run):
+        if child is rpr:
+            continue
+        run.remove(child)
+        length = _run_child_length(child)
+        if length:
+            while cut_index < len(cuts) and cuts[cut_index] <= pos:
+                segments.append([])
+                cut_index += 1
+            if child.tag == W_T:
+                start = 0
+                while cut_index < len(cuts) and cuts[cut_index] < pos + length:
+                    cut = cuts[cut_index] - pos
+                    segments[-1].append(_text_element(run, child.text[start:cut]))
+                    segments.append([])
+                    start = cut
+                    cut_index += 1
+                if start:
+                    child = _text_element(run, child.text[start:])
+            pos += length
+        segments[-1].append(child)
+    run.extend(segments[0])
+    previous = run
+    for segment in segments[1:]:
+        piece = run.makeelement(W_R, run.attrib)
+        if rpr is not None:
+            piece.append(deepcopy(rpr))
+        piece.extend(segment)
+        previous.addnext(piece)
+        previous = piece
+
+
+def _set_highlight(run, color):
+    """给文本块加高亮，已有的高亮改为 color"""
+    rpr = run.find(W_RPR)
+    if rpr is None:
+        rpr = run.makeelement(W_RPR, {})
+        run.insert(0, rpr)
+    highlight = rpr.find(W_HIGHLIGHT)
+    if highlight is None:
+        highlight = rpr.makeelement(W_HIGHLIGHT, {})
+        for index, child in enumerate(rpr):
+            if child.tag in RPR_AFTER_HIGHLIGHT:
+                rpr.insert(index, highlight)
+                break
+        else:
+            rpr.append(highlight)
+    highlight.set(W_VAL, color)
+
+
+def _annotate_paragraph(paragraph, hits, highlight):
+    """
+    标注一个段落，hits 为 [(段内起始偏移, 结束偏移, 批注 ID), ...]，偏移以 _paragraph_text 为准。
+    先在各匹配的起止位置拆分文本块，再给匹配范围内的文本块加高亮，在匹配前后插入批注范围标记和批注引用。
+    """
+    bounds = sorted({bound for start, end, _ in hits for bound in (start, end)})
+    pos = 0
+    for run in _paragraph_runs(paragraph):
+        length = sum(_run_child_length(child) for child in run)
+        first = bisect_right(bounds, pos)
+        last = bisect_left(bounds, pos + length, first)
+        if first < last:
+            _split_run(run, [bound - pos for bound in bounds[first:last]])
+        pos += length
+
+    # 匹配范围可能相互重叠，高亮它们的并集
+    covered = []
+    for start, end, _ in sorted(hits):
+        if covered and start <= covered[-1][1]:
+            covered[-1][1] = max(covered[-1][1], end)
+        else:
+            covered.append([start, end])
+    starts = [start for start, _ in covered]
+    first_run = {}
+    last_run = {}
+    pos = 0
+    for run in _paragraph_runs(paragraph):
+        length = sum(_run_child_length(child) for child in run)
+        if not length:
+            continue
+        index = bisect_right(starts, pos) - 1
+        if index >= 0 and pos + length <= covered[index][1]:
+            _set_highlight(run, highlight)
+        first_run.setdefault(pos, run)
+        pos += length
+        last_run[pos] = run
+
+    for start, end, comment_id in hits:
+        first, last = first_run.get(start), last_run.get(end)
+        if first is None or last is None:
+            continue
+        first.addprevious(first.makeelement(W_COMMENT_RANGE_START, {W_ID: str(comment_id)}))
+        reference = last.makeelement(W_R, {})
+        reference.append(reference.makeelement(W_COMMENT_REFERENCE, {W_ID: str(comment_id)}))
+        last.addnext(reference)
+        last.addnext(last.makeelement(W_COMMENT_RANGE_END, {W_ID: str(comment_id)}))
+
+
+def _namespace_declarations(element):
+    """元素上可见的命名空间声明按 lxml 序列化后的形式，例如 b' xmlns:w="..."'"""
+    shell = element.makeelement(element.tag, nsmap=element.nsmap)
+    return re.findall(rb' xmlns(?::[^\s=]+)?="[^"]*"', etree.tostring(shell))
+
+
+def _serialize(element, declarations):
+    """
+    序列化一个子树。lxml 会在子树的根元素上重复声明所有可见的命名空间，
+    其中与文档根元素相同的声明（declarations）已经写在根元素上，从第一个开始标签中去掉。
+    """
+    data = etree.tostring(element, encoding='utf-8')
+    end = data.index(b'>')
+    head = data[:end]
+    for declaration in declarations:
+        head = head.replace(declaration, b'', 1)
+    return head + data[end:]
+
+
+def _start_tag(element, declarations=()):
+    """元素的开始标签和结束标签（不含子元素）"""
+    data = _serialize(element.makeelement(element.tag, element.attrib, nsmap=element.nsmap), declarations)
+    name = re.match(rb'<([^\s/>]+)', data).group(1)
+    return data[:-2] + b'>', b'</' + name + b'>'
+
+
+def _comment_text(occurrence):
+    """批注内容：关键词；地域检查时加上区划名称、级别和上级区划，格式与页面上的显示一致"""
+    region = occurrence.get('region')
+    if not region:
+        return f"关键词：{occurrence['keyword']}"
+    text = ' · '.join(part for part in (region.get('name'), region.get('level'), region.get('parent')) if part)
+    if region.get('candidates', 0) > 1:
+        text += f"（共 {region['candidates']} 个可能的区划）"
+    return f"{occurrence['keyword']}：{text}"
+
+
+def _comment_xml(comment_id, text, author, date, namespace=''):
+    """一条批注的 XML，使用 w 前缀；批注部件的根元素没有把 w 绑定到 W_NS 时由 namespace 另行声明"""
+    return (f'<w:comment{namespace} w:id="{comment_id}" w:author={quoteattr(author)} w:date="{date}" '
+            f'w:initials="{ANNOTATION_INITIALS}"><w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+            '</w:p></w:comment>').encode('utf-8')
+
+
+def _annotate_document_part(xml_file, out, hits, comments, comment_namespace, first_id, author, highlight):
+    """
+    流式重写主文档部件：逐个读入正文的块级元素，标注其中有匹配的段落后立即写出并清除，内存占用不随文档大小增长。
+    hits 为 {正文段落序号: (提取时的段落文本, [(段内起始偏移, 结束偏移, 批注内容), ...])}，段落序号与
+    DocxTextExtractor.locations 中的部件内段落序号一致；段落文本与提取结果不一致时不标注该段落。
+    批注依次写入 comments，ID 从 first_id 开始，comment_namespace 见 _comment_xml。返回 (标注的匹配数, 未标注的匹配数)。
+    """
+    date = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    next_id = first_id
+    skipped = 0
+    paragraph_number = 0
+    root = body = None
+    declarations = ()
+    end_tags = []
+    for event, element in etree.iterparse(xml_file, events=('start', 'end'), tag=(W_DOCUMENT, W_BODY) + BLOCK_TAGS,
+                                          huge_tree=True):
+        if event == 'start':
+            if root is None and element.tag == W_DOCUMENT:
+                root = element
+                declarations = _namespace_declarations(root)
+                start_tag, end_tag = _start_tag(root)
+                out.write(XML_DECLARATION + start_tag)
+                end_tags.append(end_tag)
+            elif body is None and element.tag == W_BODY and element.getparent() is root:
+                body = element
+                # 正文之前的元素（例如 w:background）原样写出
+                while root[0] is not body:
+                    out.write(_serialize(root[0], declarations))
+                    del root[0]
+                start_tag, end_tag = _start_tag(body, declarations)
+                out.write(start_tag)
+                end_tags.append(end_tag)
+            continue
+        if element is body or element is root:
+            for child in element:
+                out.write(_serialize(child, declarations))
+            out.write(end_tags.pop())
+            element.clear()
+            continue
+        if body is None or element.getparent() is not body:
+            continue
+        if element.tag != W_SECT_PR:
+            for paragraph, _, _ in list(_iter_block_paragraphs(element)):
+                entry = hits.get(paragraph_number)
+                paragraph_number += 1
+                if entry is None:
+                    continue
+                text, paragraph_hits = entry
+                if _paragraph_text(paragraph) != text:
+                    skipped += len(paragraph_hits)
+                    continue
+                with_ids = []
+                for start, end, comment in paragraph_hits:
+                    comments.write(_comment_xml(next_id, comment, author, date, comment_namespace))
+                    with_ids.append((start, end, next_id))
+                    next_id += 1
+                _annotate_paragraph(paragraph, with_ids, highlight)
+        # 块之前的其他元素（例如正文级别的书签）原样写出
+        while body[0] is not element:
+            out.write(_serialize(body[0], declarations))
+            del body[0]
+        out.write(_serialize(element, declarations))
+        element.clear()
+        del body[0]
+    if root is None:
+        raise ValueError('不是有效的 Word 文档')
+    return next_id - first_id, skipped
+
+
+def _add_relationship(data, rel_type, target):
+    """在关系文件（data 为 None 时新建）中添加一个关系，返回新的关系文件内容"""
+    if data is None:
+        root = etree.Element(f'{{{REL_NS}}}Relationships', nsmap={None: REL_NS})
+    else:
+        root = etree.fromstring(data)
+    ids = {rel.get('Id') for rel in root}
+    number = len(ids) + 1
+    while f'rId{number}' in ids:
+        number += 1
+    etree.SubElement(root, f'{{{REL_NS}}}Relationship', Id=f'rId{number}', Type=rel_type, Target=target)
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True)
+
+
+def _add_content_type(data, part, content_type):
+    """在 [Content_Types].xml 中为部件添加内容类型（Override），返回新的内容"""
+    root = etree.fromstring(data)
+    part_name = '/' + part
+    if not any(override.get('PartName') == part_name for override in root):
+        etree.SubElement(root, f'{{{CONTENT_TYPES_NS}}}Override', PartName=part_name, ContentType=content_type)
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True)
+
+
+def _copy_zip_info(info):
+    copied = zipfile.ZipInfo(info.filename, info.date_time)
+    copied.compress_type = info.compress_type
+    copied.external_attr = info.external_attr
+    copied.file_size = info.file_size
+    return copied
+
+
+def annotate_docx(source, target, extractor, occurrences, author=ANNOTATION_AUTHOR, highlight=ANNOTATION_HIGHLIGHT):
+    """
+    生成标注了匹配项的文档：正文中的每个匹配项加高亮，并附一条批注，内容为关键词，地域检查时还有区划名称、级别和上级区划。
+    source 为原文档（路径或可 seek 的文件对象），extractor 和 occurrences 为对它的检查结果，直接按匹配项的偏移定位，
+    不再重新匹配；target 为输出的路径或可写文件对象。主文档部件流式重写，批注先写入临时文件，其余部件原样复制。
+    Word 不支持页眉页脚中的批注，页眉、页脚、脚注和尾注中的匹配项不标注。
+    返回 {'annotated': 标注的匹配项数, 'skipped': 未标注的匹配项数}。
+    """
+    hits = {}
+    skipped = 0
+    for occurrence in occurrences:
+        para_index = extractor.get_paragraph_index(occurrence['offset'])
+        part, number = extractor.locations[para_index][:2]
+        if part != PART_BODY:
+            skipped += 1
+            continue
+        entry = hits.get(number)
+        if entry is None:
+            entry = hits[number] = (extractor.paragraphs[para_index], [])
+        start = occurrence['offset'] - extractor.paragraph_offsets[para_index]
+        entry[1].append((start, start + occurrence['length'], _comment_text(occurrence)))
+
+    with zipfile.ZipFile(source) as docx_zip, tempfile.TemporaryFile() as comments, \
+            zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, compresslevel=ANNOTATION_COMPRESS_LEVEL) as out_zip:
+        main_part = _find_main_document_part(docx_zip)
+        rels_path = _relationships_path(main_part)
+        names = set(docx_zip.namelist())
+        existing = [path for path in _find_relationships(docx_zip, main_part).get('comments', ()) if path in names]
+        if existing:
+            # 文档已有批注：新批注追加在原有批注之后，ID 接着原有的最大 ID
+            comments_part = existing[0]
+            comments_data = docx_zip.read(comments_part)
+            comments_root = etree.fromstring(comments_data)
+            first_id = max((_int_attr(comment, W_ID, -1) for comment in comments_root.iter(W_COMMENT)),
+                           default=-1) + 1
+            comment_namespace = '' if comments_root.nsmap.get('w') == W_NS else f' xmlns:w="{W_NS}"'
+        else:
+            comments_part = posixpath.join(posixpath.dirname(main_part), 'comments.xml')
+            comments_data = None
+            first_id = 0
+            comment_namespace = ''
+        add_part = comments_data is None and bool(hits)
+
+        annotated = 0
+        for info in docx_zip.infolist():
+            name = info.filename
+            if name == comments_part and comments_data is not None:
+                continue
+            if name == main_part:
+                # 重写时的小块输出先合并再压缩
+                with docx_zip.open(info) as xml_file, out_zip.open(_copy_zip_info(info), 'w') as part_file, \
+                        io.BufferedWriter(part_file, ANNOTATION_WRITE_BUFFER) as out:
+                    annotated, mismatched = _annotate_document_part(xml_file, out, hits, comments, comment_namespace,
+                                                                    first_id, author, highlight)
+                skipped += mismatched
+            elif add_part and name == '[Content_Types].xml':
+                out_zip.writestr(_copy_zip_info(info), _add_content_type(docx_zip.read(info), comments_part,
+                                                                         COMMENTS_CONTENT_TYPE))
+            elif add_part and name == rels_path:
+                out_zip.writestr(_copy_zip_info(info), _add_relationship(
+                    docx_zip.read(info), RELATIONSHIP_TYPE_PREFIX + 'comments', posixpath.basename(comments_part)))
+            else:
+                with docx_zip.open(info) as src, out_zip.open(_copy_zip_info(info), 'w') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+        if add_part and rels_path not in names:
+            out_zip.writestr(rels_path, _add_relationship(None, RELATIONSHIP_TYPE_PREFIX + 'comments',
+                                                          posixpath.basename(comments_part)))
+
+        if comments_data is not None:
+            # 新批注插入在原有批注部件根元素的结束标签之前，根元素为空元素标签时先把它展开
+            closing = re.search(rb'(/>|</[^>]+>)\s*$', comments_data)
+            if closing.group(1) == b'/>':
+                head = comments_data[:closing.start()] + b'>'
+                tail = b'</' + re.search(rb'<([^\s/>?!]+)[^<]*$', head).group(1) + b'>'
+            else:
+                head, tail = comments_data[:closing.start()], comments_data[closing.start():]
+        elif add_part:
+            head = XML_DECLARATION + f'<w:comments xmlns:w="{W_NS}">'.encode()
+            tail = b'</w:comments>'
+        if comments_data is not None or add_part:
+            with out_zip.open(comments_part, 'w') as dst:
+                dst.write(head)
+                comments.seek(0)
+                shutil.copyfileobj(comments, dst, 1024 * 1024)
+                dst.write(tail)
+    return {'annotated': annotated, 'skipped': skipped}
+
+
+def file_sha256(source):
+    """分块计算文件内容的 SHA-256，source 可以是路径或可 seek 的二进制文件对象"""
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(chunk)
+        source.seek(0)
+    return digest.hexdigest()
+
+
+def keywords_fingerprint(keywords):
+    """关键词集合的指纹，与关键词顺序和重复无关；匹配器的指纹计算一次后缓存在匹配器上"""
+    if isinstance(keywords, KeywordMatcher):
+        if keywords.fingerprint is None:
+            keywords.fingerprint = keywords_fingerprint(keywords.keywords)
+        return keywords.fingerprint
+    normalized = sorted(set(kw.strip() for kw in keywords if kw.strip()))
+    return hashlib.sha256('\n'.join(normalized).encode('utf-8')).hexdigest()
+
+
+class RegionsIndex:
+    """
+    某一版本地域文件的只读索引：展开的名称列表、成员集合、按级别的集合和编译好的匹配器。
+    给出 divisions（divisions.DivisionDictionary）时，匹配器还包括全国行政区划的全称和变体，
+    每个关键词都附带解析出的区划（名称、级别、代码和上级），地域名称中的简称按所在级别解析。
+    """
+
+    def __init__(self, data=None, divisions=None):
+        self.structured = data if isinstance(data, dict) else None
+        self.names = flatten_regions(data) if isinstance(data, (list, dict)) else []
+        self.name_set = frozenset(self.names)
+        self.level_sets = {}
+        if self.structured is not None:
+            self.level_sets = {level: frozenset(names) for level, names in self.structured.items()
+                               if isinstance(names, list)}
+        self.divisions = divisions
+        keywords = self.names
+        annotations = None
+        if divisions is not None:
+            annotations = dict(divisions.annotations())
+            annotations.update(self._name_annotations(divisions))
+            keywords = self.names + list(annotations)
+        self.matcher = KeywordMatcher(keywords, annotations)
+        self.fingerprint = keywords_fingerprint(self.matcher)
+
+    def _name_annotations(self, divisions):
+        """地域名称的附加字段：以所在级别为提示解析为区划，解析不到时只给出名称和级别"""
+        annotations = {}
+        for level, names in (self.structured or {}).items():
+            if not isinstance(names, list):
+                continue
+            for name in names:
+                name = name.strip()
+                if name in annotations or name in self.level_sets:
+                    continue
+                region = divisions.resolve(normalize_text(name), level)
+                annotations[name] = {'region': region or {'name': name, 'level': level}}
+        return annotations
+
+    def contains(self, name):
+        return name in self.name_set
+
+    def level_contains(self, level, name):
+        return name in self.level_sets.get(level, ())
+
+
+class RegionsStore:
+    """进程内共享的地域名称存储，只在文件的修改时间或大小变化时重新解析"""
+
+    def __init__(self, path, divisions=None):
+        self.path = path
+        self.divisions = divisions
+        self._lock = threading.Lock()
+        self._signature = None
+        self._index = RegionsIndex()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self):
+        """返回当前的地域索引，必要时重新加载"""
+        signature = self._file_signature()
+        with self._lock:
+            if signature != self._signature:
+                self._index = self._load() if signature is not None else RegionsIndex(divisions=self.divisions)
+                self._signature = signature
+            return self._index
+
+    def invalidate(self):
+        """强制下次访问时重新加载，用于本进程写入文件之后"""
+        with self._lock:
+            self._signature = ('invalidated',)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"Error reading {self.path}: {e}")
+            return RegionsIndex(divisions=self.divisions)
+        if not isinstance(data, (list, dict)):
+            logger.error(f"JSON file {self.path} format is invalid.")
+            return RegionsIndex(divisions=self.divisions)
+        return RegionsIndex(data, self.divisions)
+
+
+def normalize_regions_data(data):
+    """
+    把 JSON 中的地域数据整理为 {级别: [名称, ...]}，用于导入数据库。
+    列表格式整体归入“区级”；某一级别下是嵌套字典（省 -> 市 -> 区县）时展开为该级别的名称列表。
+    """
+    if isinstance(data, list):
+        data = {'省级': [], '市级': [], '区级': data}
+    if not isinstance(data, dict):
+        raise ValueError('地域数据必须是对象或数组')
+    levels = {}
+    for level, names in data.items():
+        level = str(level).strip()
+        if not level:
+            continue
+        if isinstance(names, dict):
+            names = flatten_regions(names)
+        elif not isinstance(names, list):
+            names = []
+        cleaned = levels.setdefault(level, [])
+        seen = set(cleaned)
+        for name in names:
+            name = str(name).strip()
+            # 过滤掉空字符串和仅包含问号的条目
+            if name and name not in seen and name != '???' and name != '？？？':
+                seen.add(name)
+                cleaned.append(name)
+    return levels
+
+
+class SQLiteRegionsStore:
+    """
+    基于 SQLite 的地域名称存储，get() 的用法与 RegionsStore 相同。
+    名称按级别和名称建有索引，每次增删改都在一个事务中完成：并发编辑不会互相覆盖，写到一半崩溃也不会损坏数据。
+    每次写入都由触发器递增 meta 表中的 version；get() 和 add_listener 注册的回调据此判断地域索引、匹配器和缓存是否过期，
+    多个进程（例如 gunicorn 的工作进程）共用同一个数据库文件时也能看到彼此的修改。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS levels (
+            name TEXT PRIMARY KEY,
+            position INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS regions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            level TEXT NOT NULL REFERENCES levels (name) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            UNIQUE (level, name)
+        );
+        CREATE INDEX IF NOT EXISTS regions_name ON regions (name);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+        CREATE TRIGGER IF NOT EXISTS regions_insert_version AFTER INSERT ON regions
+            BEGIN UPDATE meta SET value = value + 1 WHERE key = 'version'; END;
+        CREATE TRIGGER IF NOT EXISTS regions_update_version AFTER UPDATE ON regions
+            BEGIN UPDATE meta SET value = value + 1 WHERE key = 'version'; END;
+        CREATE TRIGGER IF NOT EXISTS regions_delete_version AFTER DELETE ON regions
+            BEGIN UPDATE meta SET value = value + 1 WHERE key = 'version'; END;
+        CREATE TRIGGER IF NOT EXISTS levels_insert_version AFTER INSERT ON levels
+            BEGIN UPDATE meta SET value = value + 1 WHERE key = 'version'; END;
+        CREATE TRIGGER IF NOT EXISTS levels_delete_version AFTER DELETE ON levels
+            BEGIN UPDATE meta SET value = value + 1 WHERE key = 'version'; END;
+    """
+
+    def __init__(self, path, seed_file=None, default_data=None, timeout=10.0, divisions=None):
+        """
+        数据库第一次创建时，从 seed_file（china_regions.json 格式）导入初始数据，文件不存在时使用 default_data。
+        timeout 为等待其他连接释放写锁的秒数；divisions 为一起编译进匹配器的全国行政区划词典（见 RegionsIndex）。
+        """
+        self.path = path
+        self.divisions = divisions
+        self.seed_file = seed_file
+        self.default_data = default_data
+        self.timeout = timeout
+        self._local = threading.local()  # 每个线程（以及 fork 出的每个进程）使用自己的连接
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._version = None
+        self._index = RegionsIndex()
+        self._listeners = []
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # isolation_level=None：由 _transaction 显式控制事务的开始和提交
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA foreign_keys = ON')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            if not self._schema_ready:
+                self._create_schema(conn)
+        return conn
+
+    def _create_schema(self, conn):
+        with self._lock:
+            if self._schema_ready:
+                return
+            # WAL 模式下读取不会被写入阻塞
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.executescript('BEGIN IMMEDIATE;' + self.SCHEMA + 'COMMIT;')
+            with self._transaction(conn):
+                # 只在数据库第一次创建时导入；之后即使删光所有名称也不会再导入
+                if conn.execute("SELECT 1 FROM meta WHERE key = 'seeded'").fetchone() is None:
+                    seed = self._seed_data()
+                    if seed is not None:
+                        self._import(conn, normalize_regions_data(seed), replace=True)
+                    conn.execute("INSERT INTO meta (key, value) VALUES ('seeded', 1)")
+            self._schema_ready = True
+
+    def _seed_data(self):
+        if self.seed_file and os.path.exists(self.seed_file):
+            try:
+                with open(self.seed_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                logger.error(f"Error reading {self.seed_file}: {e}")
+        return self.default_data
+
+    @contextmanager
+    def _transaction(self, conn=None):
+        """写事务：BEGIN IMMEDIATE 在开始时就取得写锁，事务内的“先检查后写入”不会与其他写入交错"""
+        conn = conn or self._connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def close(self):
+        """关闭当前线程的连接，例如在 fork 工作进程之前"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def add_listener(self, func):
+        """注册在数据变化后调用的回调 func(version)，由发现版本变化的那次 get() 调用"""
+        self._listeners.append(func)
+
+    def version(self):
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0]
+
+    def get(self):
+        """返回当前的地域索引；版本号变化后才重新读取数据并重建索引"""
+        version = self.version()
+        with self._lock:
+            if version == self._version:
+                return self._index
+        conn = self._connection()
+        # 在同一个读事务中读取版本号和数据，保证两者一致
+        conn.execute('BEGIN')
+        try:
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            data = self._export(conn)
+        finally:
+            conn.execute('COMMIT')
+        index = RegionsIndex(data, self.divisions)
+        with self._lock:
+            changed = self._version is not None and self._version != version
+            self._index, self._version = index, version
+        if changed:
+            for listener in self._listeners:
+                listener(version)
+        return index
+
+    def levels(self):
+        return [row[0] for row in self._connection().execute('SELECT name FROM levels ORDER BY position')]
+
+    def has_level(self, level):
+        return self._connection().execute('SELECT 1 FROM levels WHERE name = ?', (level,)).fetchone() is not None
+
+    def contains(self, name):
+        return self._connection().execute('SELECT 1 FROM regions WHERE name = ? LIMIT 1', (name,)).fetchone() is not None
+
+    def level_contains(self, level, name):
+        return self._connection().execute('SELECT 1 FROM regions WHERE level = ? AND name = ?',
+                                          (level, name)).fetchone() is not None
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM regions').fetchone()[0]
+
+    def add(self, level, name, unique=False, create_level=False):
+        """
+        向级别 level 添加名称，成功返回 True；名称在该级别（unique=True 时在任一级别）已存在时返回 False。
+        级别不存在时，create_level=True 会先创建该级别，否则返回 False。
+        """
+        with self._transaction() as conn:
+            if unique and conn.execute('SELECT 1 FROM regions WHERE name = ? LIMIT 1', (name,)).fetchone():
+                return False
+            if create_level:
+                self._ensure_level(conn, level)
+            try:
+                conn.execute('INSERT INTO regions (level, name) VALUES (?, ?)', (level, name))
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def rename(self, old_name, new_name):
+        """把所有级别中的 old_name 改为 new_name，返回修改的条目数；new_name 已存在时不做修改并返回 0"""
+        with self._transaction() as conn:
+            if conn.execute('SELECT 1 FROM regions WHERE name = ? LIMIT 1', (new_name,)).fetchone():
+                return 0
+            return conn.execute('UPDATE regions SET name = ? WHERE name = ?', (new_name, old_name)).rowcount
+
+    def remove(self, name, level=None):
+        """删除名称（指定 level 时只删除该级别中的），返回删除的条目数"""
+        with self._transaction() as conn:
+            if level is None:
+                return conn.execute('DELETE FROM regions WHERE name = ?', (name,)).rowcount
+            return conn.execute('DELETE FROM regions WHERE level = ? AND name = ?', (level, name)).rowcount
+
+    def import_data(self, data, replace=True):
+        """
+        批量导入 china_regions.json 格式的数据，在一个事务中完成，返回新增的名称数。
+        replace=True 时先清空现有数据；否则与现有数据合并，已存在的名称会被跳过。
+        """
+        levels = normalize_regions_data(data)
+        with self._transaction() as conn:
+            return self._import(conn, levels, replace)
+
+    def export_data(self):
+        """导出为 china_regions.json 格式：{级别: [名称, ...]}，级别和名称保持添加时的顺序"""
+        return self._export(self._connection())
+
+    def _ensure_level(self, conn, level):
+        conn.execute('INSERT OR IGNORE INTO levels (name, position) '
+                     'SELECT ?, COALESCE(MAX(position), -1) + 1 FROM levels', (level,))
+
+    def _import(self, conn, levels, replace):
+        if replace:
+            conn.execute('DELETE FROM regions')
+            conn.execute('DELETE FROM levels')
+        before = conn.execute('SELECT COUNT(*) FROM regions').fetchone()[0]
+        for level, names in levels.items():
+            self._ensure_level(conn, level)
+            conn.executemany('INSERT OR IGNORE INTO regions (level, name) VALUES (?, ?)',
+                             ((level, name) for name in names))
+        return conn.execute('SELECT COUNT(*) FROM regions').fetchone()[0] - before
+
+    def _export(self, conn):
+        data = {level: [] for level in
+                (row[0] for row in conn.execute('SELECT name FROM levels ORDER BY position'))}
+        for level, name in conn.execute('SELECT level, name FROM regions ORDER BY id'):
+            data[level].append(name)
+        return data
+
+
+# 工作进程中共享的匹配器和匹配模式，由 init_worker 在每个进程启动时设置一次
+_worker_matcher = None
+_worker_longest_only = False
+
+
+def init_worker(matcher, longest_only):
+    """进程池的 initializer：匹配器只在工作进程启动时传递一次，而不是随每个文件传递"""
+    global _worker_matcher, _worker_longest_only
+    _worker_matcher = matcher
+    _worker_longest_only = longest_only
+
+
+def check_file_in_worker(docx_path):
+    """在工作进程中检查单个文件"""
+    extractor = DocxTextExtractor(docx_path)
+    return extractor.find_keyword_occurrences(_worker_matcher, longest_only=_worker_longest_only)
+
+
+# 常驻进程池的工作进程中按摘要缓存的匹配器，保留最近使用的 WORKER_MATCHER_CACHE_SIZE 个
+WORKER_MATCHER_CACHE_SIZE = 4
+_worker_matchers = OrderedDict()
+
+
+def check_file_in_pool(docx_path, matcher_key, matcher_payload, longest_only):
+    """
+    在常驻进程池的工作进程中检查单个文件。进程池在多次请求之间复用，每次的关键词集合可能不同，
+    所以匹配器随任务传递：matcher_payload 是 pickle 序列化后的 KeywordMatcher，由调用方对整批文件只序列化一次，
+    matcher_key 是它的摘要；工作进程按摘要缓存反序列化的结果，同一匹配器不再重复反序列化。
+    """
+    matcher = _worker_matchers.get(matcher_key)
+    if matcher is None:
+        matcher = _worker_matchers[matcher_key] = pickle.loads(matcher_payload)
+        while len(_worker_matchers) > WORKER_MATCHER_CACHE_SIZE:
+            _worker_matchers.popitem(last=False)
+    else:
+        _worker_matchers.move_to_end(matcher_key)
+    return DocxTextExtractor(docx_path).find_keyword_occurrences(matcher, longest_only=longest_only)
+
+
+def check_file(docx_path, keywords, longest_only=False):
+    """检查单个 docx 文件，返回匹配项列表"""
+    return DocxTextExtractor(docx_path).find_keyword_occurrences(keywords, longest_only=longest_only)
+
+
+def default_regions_path():
+    """默认的地域名称来源：与 Web 应用相同的 regions.db，数据库还不存在时退回 china_regions.json"""
+    return DEFAULT_REGIONS_DB if os.path.exists(DEFAULT_REGIONS_DB) else DEFAULT_REGIONS_FILE
+
+
+def load_regions_matcher(path=None, divisions_path=DEFAULT_DIVISIONS_FILE):
+    """
+    加载地域名称文件（JSON，或以 .db 结尾的 SQLite 数据库）并返回编译好的匹配器，path 默认见 default_regions_path；
+    divisions_path 为全国行政区划数据文件，为空时只匹配地域名称文件中的名称
+    """
+    if path is None:
+        path = default_regions_path()
+        logger.info(f"Loading region names from {path}")
+    divisions = load_divisions(divisions_path) if divisions_path else None
+    store = SQLiteRegionsStore(path, divisions=divisions) if path.endswith('.db') else RegionsStore(path, divisions)
+    return store.get().matcher
+
+
+def iter_docx_files(paths):
+    """按确定的顺序遍历路径（文件或目录树）中的 docx 文件，跳过 Word 锁文件"""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith('.docx') and not name.startswith('~$'):
+                    yield os.path.join(root, name)
+
+
+def scan_files(paths, keywords, longest_only=False, workers=None, skip=()):
+    """
+    并行检查多个 docx 文件，按完成顺序产出 (路径, 匹配项列表, 错误信息)，成功时错误信息为 None。
+    paths 中的目录会被递归遍历；skip 中的路径（例如断点文件中已完成的路径）会被跳过。
+    同时提交的任务数有上限，文件再多内存占用也不会随之增长。
+    """
+    matcher = keywords if isinstance(keywords, KeywordMatcher) else KeywordMatcher(keywords)
+    skip = set(skip)
+    files = (path for path in iter_docx_files(paths) if os.path.abspath(path) not in skip)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(matcher, longest_only)) as executor:
+        running = {}
+        for path in files:
+            running[executor.submit(check_file_in_worker, path)] = path
+            if len(running) >= workers * 4:
+                yield from _collect_finished(running)
+        while running:
+            yield from _collect_finished(running)
+
+
+def _collect_finished(running):
+    """等待至少一个任务完成，产出并移除已完成的任务"""
+    done, _ = wait(running, return_when=FIRST_COMPLETED)
+    for future in done:
+        path = running.pop(future)
+        try:
+            yield path, future.result(), None
+        except Exception as e:
+            yield path, None, str(e)
+
+
+def read_checkpoint(path):
+    """读取断点文件中已完成的文件路径"""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='离线批量检查 docx 文档中的关键词，按 JSON Lines 输出结果')
+    parser.add_argument('paths', nargs='+', help='要检查的 docx 文件或目录（递归遍历）')
+    parser.add_argument('--keywords', help='自定义关键词，用中文逗号"，"分隔；不指定时检查地域名称')
+    parser.add_argument('--regions', default=None,
+                        help='地域名称 JSON 文件或 SQLite 数据库（.db）路径；默认使用 Web 应用的 regions.db，'
+                             '与网页检查的结果一致，数据库不存在时使用 china_regions.json')
+    parser.add_argument('--divisions', default=DEFAULT_DIVISIONS_FILE,
+                        help='全国行政区划数据文件，传入空字符串时只匹配地域名称文件中的名称')
+    parser.add_argument('--longest', action='store_true', help='仅报告最长匹配')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数，默认等于 CPU 核数')
+    parser.add_argument('--per-file', action='store_true', help='每个文件输出一行，而不是每个匹配项一行')
+    parser.add_argument('--checkpoint', help='断点文件：记录已完成的文件，中断后再次运行时跳过这些文件')
+    args = parser.parse_args(argv)
+
+    if args.keywords is not None:
+        keywords = KeywordMatcher(args.keywords.split('，'))
+    else:
+        keywords = load_regions_matcher(args.regions, args.divisions)
+    if not keywords:
+        parser.error('关键词列表为空')
+
+    completed = read_checkpoint(args.checkpoint)
+    checkpoint = open(args.checkpoint, 'a', encoding='utf-8') if args.checkpoint else None
+    try:
+        for path, occurrences, error in scan_files(args.paths, keywords, longest_only=args.longest,
+                                                   workers=args.workers, skip=completed):
+            if error is not None:
+                records = [{'file': path, 'error': error}]
+            elif args.per_file:
+                records = [{'file': path, 'count': len(occurrences), 'occurrences': occurrences}]
+            else:
+                records = [dict(file=path, **occurrence) for occurrence in occurrences]
+            for record in records:
+                sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+            sys.stdout.flush()
+            # 结果输出之后再记录断点，中断时最多重复处理正在进行的文件
+            if checkpoint and error is None:
+                checkpoint.write(os.path.abspath(path) + '\n')
+                checkpoint.flush()
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if checkpoint:
+            checkpoint.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# divisions.py
+"""
+全国行政区划词典：省级、地级、县级共三千多个区划的全称，以及由全称自动生成的简称和后缀变体。
+数据来自 china_divisions.json（国家统计局统计用区划代码），上级区划由代码推出：
+县级区划的上级为所在的地级区划，没有地级区划时（直辖市的区县、省直辖的县级市）为所在的省级区划。
+不依赖 Flask 和 checkdoc，检查时由 checkdoc.RegionsIndex 把词条编译进匹配器。
+"""
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIVISIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'china_divisions.json')
+
+# 级别名称与地域名称数据库中的级别一致；序号越小级别越高
+LEVEL_PROVINCE = '省级'
+LEVEL_CITY = '市级'
+LEVEL_COUNTY = '区级'
+LEVELS = (LEVEL_PROVINCE, LEVEL_CITY, LEVEL_COUNTY)
+
+# 各级区划名称的通名后缀，按长度从长到短尝试
+SUFFIXES = (
+    ('特别行政区', '自治区', '省', '市'),
+    ('自治州', '地区', '盟', '市'),
+    ('自治县', '自治旗', '林区', '特区', '矿区', '新区', '县', '区', '市', '旗'),
+)
+
+# 自治地方名称中的民族名称（去掉“族”字），去掉通名后再从末尾逐个去掉，例如“恩施土家族苗族” -> “恩施”
+ETHNIC_GROUPS = (
+    '汉', '蒙古', '回', '藏', '维吾尔', '苗', '彝', '壮', '布依', '朝鲜', '满', '侗', '瑶', '白', '土家', '哈尼',
+    '哈萨克', '傣', '黎', '傈僳', '佤', '畲', '高山', '拉祜', '水', '东乡', '纳西', '景颇', '柯尔克孜', '土',
+    '达斡尔', '仫佬', '羌', '布朗', '撒拉', '毛南', '仡佬', '锡伯', '阿昌', '普米', '塔吉克', '怒', '乌孜别克',
+    '俄罗斯', '鄂温克', '德昂', '保安', '裕固', '京', '塔塔尔', '独龙', '鄂伦春', '赫哲', '门巴', '珞巴', '基诺',
+)
+# 单字民族名称必须带“族”字才去掉，例如“三都水族” -> “三都”，但“西藏”不变；“各族”见于“龙胜各族自治县”
+ETHNIC_SUFFIXES = sorted({group + '族' for group in ETHNIC_GROUPS + ('各',)}
+                         | {group for group in ETHNIC_GROUPS if len(group) > 1}, key=len, reverse=True)
+
+# 过于常见、不宜单独作为关键词的名称（仍可以通过 lookup 查到）
+STOP_NAMES = frozenset(('城区', '郊区', '矿区', '新区', '市中区'))
+
+MIN_STEM_LENGTH = 2
+
+
+def division_level(code):
+    """区划代码（6 位整数）-> 级别序号：0 省级，1 地级，2 县级"""
+    if code % 10000 == 0:
+        return 0
+    return 1 if code % 100 == 0 else 2
+
+
+def _strip_ethnic_groups(stem):
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in ETHNIC_SUFFIXES:
+            if stem.endswith(suffix) and len(stem) - len(suffix) >= MIN_STEM_LENGTH:
+                stem = stem[:-len(suffix)]
+                stripped = True
+                break
+    return stem
+
+
+def division_stem(name, level):
+    """
+    去掉通名后缀（以及自治地方名称中的民族名称）后的简称，例如“河北省” -> “河北”、“延边朝鲜族自治州” -> “延边”。
+    去掉后不足两个字时保留全称。返回 (简称, 去掉的通名后缀)，没有去掉任何后缀时后缀为空串。
+    """
+    for suffix in SUFFIXES[level]:
+        if name.endswith(suffix) and len(name) - len(suffix) >= MIN_STEM_LENGTH:
+            stem = name[:-len(suffix)]
+            if suffix.startswith('自治'):
+                stem = _strip_ethnic_groups(stem)
+            return stem, suffix
+    return name, ''
+
+
+def division_variants(name, level, stem=None):
+    """
+    作为匹配关键词的写法：全称总是包括在内；省级和地级另加简称（“河北”、“石家庄”），
+    自治州、自治县、自治旗另加“简称 + 州/县/旗”的常用写法（“延边州”、“长阳县”）。
+    县级区划的简称（“朝阳”、“和平”）多为普通词语，不作为关键词。stem 为已经算好的 division_stem 结果。
+    """
+    variants = [name]
+    stem, suffix = stem or division_stem(name, level)
+    if not suffix:
+        return variants
+    if level < 2:
+        variants.append(stem)
+    if suffix in ('自治州', '自治县', '自治旗') and not stem.endswith('族'):
+        # 民族名称去掉后简称不足两个字时（“鄂温克族自治旗”）没有常用的简写
+        variants.append(stem + suffix[-1])
+    return variants
+
+
+class DivisionDictionary:
+    """
+    只读的行政区划词典。各区划按下标存放在平行的列表中（代码、全称、级别序号、上级下标），
+    variants 把每种写法映射到可能指代的区划下标，stems 把简称映射到区划下标，仅供 lookup 使用。
+    """
+
+    def __init__(self, divisions, source=None):
+        self.source = source
+        self.codes = []
+        self.names = []
+        self.levels = []
+        self.parents = []
+        self.variants = {}
+        self.stems = {}
+        self._annotations = None
+        index_of = {}
+        for code, name in sorted(divisions):
+            code = int(code)
+            index_of[code] = len(self.codes)
+            self.codes.append(code)
+            self.names.append(name)
+            self.levels.append(division_level(code))
+        for index, code in enumerate(self.codes):
+            level = self.levels[index]
+            parent = -1
+            if level == 2:
+                parent = index_of.get(code // 100 * 100, -1)
+            if level >= 1 and parent < 0:
+                parent = index_of.get(code // 10000 * 10000, -1)
+            self.parents.append(parent)
+            name = self.names[index]
+            stem = division_stem(name, level)
+            for variant in division_variants(name, level, stem):
+                self.variants.setdefault(variant, []).append(index)
+            self.stems.setdefault(stem[0], []).append(index)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _rank(self, text, indexes, level=None):
+        """候选区划排序：全称与写法完全一致的优先，其次级别与 level 一致的，再按级别从高到低、代码从小到大"""
+        return sorted(indexes, key=lambda index: (self.names[index] != text,
+                                                  level is not None and LEVELS[self.levels[index]] != level,
+                                                  self.levels[index], self.codes[index]))
+
+    def lookup(self, text, level=None):
+        """
+        某个写法可能指代的区划下标，按可能性从大到小排列；level（“省级”、“市级”、“区级”）为级别提示。
+        全称、变体和简称都参与查找，例如地域名称数据库中的“朝阳”可能是朝阳市，也可能是北京或长春的朝阳区。
+        """
+        indexes = set(self.variants.get(text, ()))
+        indexes.update(self.stems.get(text, ()))
+        return self._rank(text, indexes, level)
+
+    def describe(self, index):
+        """区划的描述：{'name', 'level', 'code', 'parent'}，parent 为上级区划的全称，省级区划为 None"""
+        parent = self.parents[index]
+        return {
+            'name': self.names[index],
+            'level': LEVELS[self.levels[index]],
+            'code': str(self.codes[index]),
+            'parent': self.names[parent] if parent >= 0 else None,
+        }
+
+    def resolve(self, text, level=None):
+        """
+        把一个写法解析为区划描述，查不到时返回 None。
+        一个写法可能指代多个区划（例如北京和长春都有“朝阳区”），此时取最可能的一个，candidates 为候选区划数。
+        """
+        indexes = self.lookup(text, level)
+        if not indexes:
+            return None
+        region = self.describe(indexes[0])
+        if len(indexes) > 1:
+            region['candidates'] = len(indexes)
+        return region
+
+    def keywords(self):
+        """作为匹配关键词的全部写法（按区划代码顺序，不含 STOP_NAMES）"""
+        return [text for text in self.variants if text not in STOP_NAMES]
+
+    def annotations(self):
+        """
+        各关键词匹配项的附加字段 {关键词: {'region': 区划描述}}，用于 KeywordMatcher 的 annotations。
+        与地域名称数据库无关，第一次调用时计算并缓存，数据库修改后重建匹配器时直接复用。
+        """
+        if self._annotations is None:
+            self._annotations = {text: {'region': self.resolve(text)} for text in self.keywords()}
+        return self._annotations
+
+
+def load_divisions(path=DEFAULT_DIVISIONS_FILE):
+    """加载行政区划数据文件并返回 DivisionDictionary；文件不存在或格式错误时记录警告并返回 None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return DivisionDictionary(data['divisions'], source=data.get('source'))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Failed to load divisions from %s: %s", path, e)
+        return None
@@ -0,0 +1,46 @@
+# gunicorn.conf.py
+"""
+gunicorn 配置：gunicorn -c gunicorn.conf.py wsgi:app
+主进程先导入 wsgi.py 并预热（加载地域索引、构建匹配器），再 fork 工作进程，各工作进程以写时复制方式共享这些数据。
+绑定地址、进程数和线程数可以通过环境变量 CHECKDOC_BIND、CHECKDOC_WORKERS、CHECKDOC_THREADS 调整。
+
+注意：异步任务（/jobs）和分组结果的游标（/results）保存在工作进程的内存中，
+多个工作进程时后续请求可能落到别的进程上。需要这两个接口时请设置 CHECKDOC_WORKERS=1、
+通过线程数扩展并发，或在前端代理上按客户端做会话粘滞。
+
+上传的处理名额（app.py 中的 ADMISSION_MAX_COST、ADMISSION_QUEUE_LIMIT、ADMISSION_QUEUE_TIMEOUT）同样按工作进程计算：
+整台服务器同时处理的代价上限和排队数都是单个进程的 CHECKDOC_WORKERS 倍，调整进程数时请相应调整这些上限。
+"""
+import os
+
+from metrics import process_memory
+
+bind = os.environ.get('CHECKDOC_BIND', '0.0.0.0:5003')
+workers = int(os.environ.get('CHECKDOC_WORKERS', os.cpu_count() or 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('CHECKDOC_THREADS', 4))
+preload_app = True  # 在 fork 之前导入应用并预热，见 app.create_app
+timeout = 300  # 大文件的同步检查可能需要较长时间
+max_requests = 1000  # 定期回收工作进程，限制各进程缓存和内存碎片的增长；新进程从已预热的主进程 fork，启动很快
+max_requests_jitter = 100
+loglevel = os.environ.get('CHECKDOC_LOG_LEVEL', 'info')
+
+
+def _format_memory(memory):
+    parts = []
+    for name in ('rss', 'shared', 'private'):
+        if memory[name] is not None:
+            parts.append(f"{name} {memory[name] / 1024 / 1024:.1f} MB")
+    return ', '.join(parts) or 'unknown'
+
+
+def when_ready(server):
+    server.log.info("Master ready, memory: %s", _format_memory(process_memory()))
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s started, memory: %s", worker.pid, _format_memory(process_memory()))
+
+
+def worker_exit(server, worker):
+    worker.log.info("Worker %s exiting, memory: %s", worker.pid, _format_memory(process_memory()))
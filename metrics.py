@@ -0,0 +1,192 @@
+# metrics.py
+"""
+轻量的性能指标：计数器、直方图和按阶段记录耗时的 Trace，以 Prometheus 文本格式导出。
+不依赖 prometheus_client 和 Flask，所有指标都是线程安全的。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 常用的直方图桶
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KB 到 256 MB
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape_label(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器，可按标签区分"""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """累积直方图：每个标签组合记录各桶的计数、总和与次数"""
+
+    def __init__(self, name, documentation, buckets, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.label_names = tuple(label_names)
+        self._values = {}  # 标签值 -> [各桶计数, 总和, 次数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names, key, (('le', _format_value(float(bound))),))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.label_names, key)
+                lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    """取值时才计算的指标，例如进程内存；func 返回当前值，返回 None 时不导出"""
+
+    def __init__(self, name, documentation, func):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def render(self):
+        value = self.func()
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        if value is not None:
+            lines.append(f'{self.name} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    """指标注册表，按注册顺序导出所有指标"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets=DURATION_BUCKETS, label_names=()):
+        metric = Histogram(name, documentation, buckets, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, documentation, func):
+        metric = Gauge(name, documentation, func)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """
+    一次请求或任务中各阶段的耗时记录。每个 span 为 {'stage', 'seconds', ...}，
+    附加属性（字节数、段落数、命中数等）由调用方通过 span() 返回的字典或 add() 的关键字参数填写。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        started = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.add(stage, time.perf_counter() - started, **attrs)
+
+    def add(self, stage, seconds, **attrs):
+        self.spans.append(dict(attrs, stage=stage, seconds=seconds))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def process_memory():
+    """
+    当前进程的内存占用（字节）：{'rss', 'shared', 'private'}。
+    Linux 下读取 /proc/self/smaps_rollup，可以看出 fork 出的工作进程与主进程共享了多少页面；
+    其他平台只能给出 rss（峰值），shared 和 private 为 None。
+    """
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if rest.strip().endswith('kB'):
+                    fields[name] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError):
+        fields = {}
+    if 'Rss' in fields:
+        return {'rss': fields['Rss'],
+                'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+                'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)}
+    try:
+        import resource
+        # Linux 上 ru_maxrss 以 KB 为单位，macOS 上以字节为单位
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'rss': rss if os.uname().sysname == 'Darwin' else rss * 1024, 'shared': None, 'private': None}
+    except (ImportError, AttributeError):
+        return {'rss': None, 'shared': None, 'private': None}
@@ -0,0 +1,60 @@
+"""流式快速查询（quick_scan）：exists 和 first_n 找够匹配项即停止解析文档"""
+import io
+
+import pytest
+
+import checkdoc
+from benchmark import generate_docx
+from checkdoc import DocxTextExtractor, KeywordMatcher, MODE_EXISTS, MODE_FIRST_N, quick_scan
+
+NAMES = ['北京市', '上海市', '广州市']
+
+
+@pytest.fixture(scope='module')
+def document():
+    buffer = io.BytesIO()
+    generate_docx(buffer, paragraphs=2000, table_density=0.1, names=NAMES)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def parsed_blocks(monkeypatch):
+    """记录 _iter_part_blocks 产出的块级元素数，即实际解析了多少文档内容"""
+    counter = {'blocks': 0}
+    iter_part_blocks = checkdoc._iter_part_blocks
+
+    def counting(*args, **kwargs):
+        for item in iter_part_blocks(*args, **kwargs):
+            counter['blocks'] += 1
+            yield item
+
+    monkeypatch.setattr(checkdoc, '_iter_part_blocks', counting)
+    return counter
+
+
+def _key(occurrence):
+    return occurrence['keyword'], occurrence['offset'], occurrence['length'], occurrence['location']
+
+
+@pytest.mark.parametrize('mode, limit', [(MODE_EXISTS, None), (MODE_FIRST_N, 5)])
+def test_early_hit_stops_parsing(document, parsed_blocks, mode, limit):
+    full = DocxTextExtractor(io.BytesIO(document)).find_keyword_occurrences(KeywordMatcher(NAMES))
+    total_blocks = parsed_blocks['blocks']
+    parsed_blocks['blocks'] = 0
+
+    found = quick_scan(io.BytesIO(document), KeywordMatcher(NAMES), mode, limit=limit)
+
+    expected = sorted(full, key=lambda occurrence: occurrence['offset'])[:limit or 1]
+    assert [_key(occurrence) for occurrence in found] == [_key(occurrence) for occurrence in expected]
+    assert all(occurrence['page'] is None and occurrence['pageConfidence'] == 'unknown' for occurrence in found)
+    # 命中在文档开头，文档的其余部分不再解析
+    assert 0 < parsed_blocks['blocks'] < total_blocks // 10
+
+
+def test_no_hit_reads_whole_document(document, parsed_blocks):
+    DocxTextExtractor(io.BytesIO(document))
+    total_blocks = parsed_blocks['blocks']
+    parsed_blocks['blocks'] = 0
+
+    assert quick_scan(io.BytesIO(document), KeywordMatcher(['深圳市']), MODE_EXISTS) == []
+    assert parsed_blocks['blocks'] == total_blocks
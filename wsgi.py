@@ -0,0 +1,13 @@
+# wsgi.py
+"""
+生产环境的 WSGI 入口，例如：
+    gunicorn -c gunicorn.conf.py wsgi:app
+开发环境仍可直接运行 python app.py。
+"""
+import time
+
+_started = time.perf_counter()
+
+from app import create_app  # noqa: E402  需要在计时开始之后导入
+
+app = create_app(started=_started)